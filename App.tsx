@@ -7,7 +7,7 @@ import Header from './components/Header';
 import FileManager from './components/FileManager';
 import Scheduler from './components/Scheduler';
 import Settings from './components/Settings';
-import type { ViewType, CpuData, DownloadMethod, DownloadMethodId } from './types';
+import type { ViewType, CpuData, DownloadMethod, DownloadMethodId, TransferProgress } from './types';
 import GlobalBackupNotification from './components/GlobalBackupNotification';
 
 const App: React.FC = () => {
@@ -90,50 +90,102 @@ const App: React.FC = () => {
     if (!isAuthenticated) return;
     let isMounted = true;
 
-    const fetchStatus = async () => {
-      try {
-        const response = await fetch('/api/status');
-        if (!response.ok) return;
-        const data = await response.json();
-        if (!isMounted) return;
-        if (Array.isArray(data.logs)) {
-          setLogs(data.logs.length > 0 ? data.logs : ['[SYSTEM] Awaiting backup activity...']);
-        }
-        if (typeof data.running === 'boolean') {
-          setIsBackupRunning(data.running);
-        }
-        if (data.methods) {
-          setDownloadMethods(prev =>
-            prev.map(method => {
-              const status = data.methods[method.id];
-              if (!status) return method;
-              return {
+    const applyMethodStatus = (
+      methodId: string,
+      status: { running: boolean; progress: number; last_result: string; transfer?: TransferProgress | null }
+    ) => {
+      setDownloadMethods(prev =>
+        prev.map(method =>
+          method.id === methodId
+            ? {
                 ...method,
                 isRunning: status.running,
                 progress: status.progress,
                 lastResult: status.last_result,
-              };
-            })
-          );
-        }
-        if (Array.isArray(data.cpu_history)) {
-          setCpuData(
-            data.cpu_history.map((point: { time: string; value: number }) => ({
-              time: point.time,
-              usage: point.value,
-            }))
-          );
-        }
-      } catch (error) {
-        console.error('Failed to fetch status:', error);
+                transfer: status.transfer ?? null,
+              }
+            : method
+        )
+      );
+    };
+
+    const applyQueue = (queue: { queued: Array<{ job: string }> }) => {
+      const waiting = new Set(queue.queued.map(entry => entry.job));
+      setDownloadMethods(prev => prev.map(method => ({ ...method, queued: waiting.has(method.id) })));
+    };
+
+    const applySnapshot = (data: any) => {
+      if (Array.isArray(data.logs)) {
+        setLogs(data.logs.length > 0 ? data.logs : ['[SYSTEM] Awaiting backup activity...']);
+      }
+      if (typeof data.running === 'boolean') {
+        setIsBackupRunning(data.running);
       }
+      if (data.methods) {
+        Object.keys(data.methods).forEach(methodId => applyMethodStatus(methodId, data.methods[methodId]));
+      }
+      if (data.queue) {
+        applyQueue(data.queue);
+      }
+      if (Array.isArray(data.cpu_history)) {
+        setCpuData(
+          data.cpu_history.map((point: { time: string; value: number }) => ({
+            time: point.time,
+            usage: point.value,
+          }))
+        );
+      }
+    };
+
+    // Browsers without EventSource fall back to polling; the ETag on
+    // /api/status turns unchanged polls into 304s.
+    if (typeof EventSource === 'undefined') {
+      const fetchStatus = async () => {
+        try {
+          const response = await fetch('/api/status', { cache: 'no-cache' });
+          if (!response.ok || !isMounted) return;
+          applySnapshot(await response.json());
+        } catch (error) {
+          console.error('Failed to fetch status:', error);
+        }
+      };
+      fetchStatus();
+      const interval = setInterval(fetchStatus, 2000);
+      return () => {
+        isMounted = false;
+        clearInterval(interval);
+      };
+    }
+
+    // The server sends a full snapshot first, then one event per change. On
+    // reconnect EventSource sends Last-Event-ID and missed events are replayed.
+    const source = new EventSource('/api/events');
+    source.addEventListener('snapshot', event => {
+      applySnapshot(JSON.parse((event as MessageEvent).data));
+    });
+    source.addEventListener('log', event => {
+      const { line } = JSON.parse((event as MessageEvent).data);
+      setLogs(prev => [...prev.filter(entry => !entry.startsWith('[SYSTEM]')).slice(-99), line]);
+    });
+    source.addEventListener('cpu', event => {
+      const point = JSON.parse((event as MessageEvent).data);
+      setCpuData(prev => [...prev.slice(-39), { time: point.time, usage: point.value }]);
+    });
+    source.addEventListener('method_state', event => {
+      const data = JSON.parse((event as MessageEvent).data);
+      applyMethodStatus(data.method, data);
+      setIsBackupRunning(data.any_running);
+    });
+    source.addEventListener('queue', event => {
+      applyQueue(JSON.parse((event as MessageEvent).data));
+    });
+    source.onerror = () => {
+      console.error('Status stream interrupted; reconnecting...');
     };
 
-    fetchStatus();
-    const interval = setInterval(fetchStatus, 2000);
     return () => {
       isMounted = false;
-      clearInterval(interval);
+      source.close();
     };
   }, [isAuthenticated]);
 
@@ -1,24 +1,119 @@
 import os
-import stat
+import sys
 import tarfile
-import sqlite3
 import time
 import threading
-import paramiko
-import smtplib
 import socket
+import signal
+import sqlite3
 import io
+import json
+import atexit
+import argparse
 import urllib.request
 import base64
 import ssl
-from datetime import datetime
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
-from flask import Flask, send_file, request, jsonify, send_from_directory
+from flask import Flask, Response, send_file, request, jsonify, send_from_directory, stream_with_context
 from werkzeug.security import generate_password_hash, check_password_hash
 from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.cron import CronTrigger
+from catalog import (
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    add_archive,
+    add_index,
+    get_archive,
+    get_blocks,
+    get_member,
+    init_catalog,
+    query_archives,
+    reconcile,
+    remove_archive,
+    search_members,
+    unindexed_archives,
+)
+from chunkstore import (
+    ChunkReader,
+    delete_snapshot,
+    export_snapshot,
+    ingest_tree,
+    init_store,
+    list_snapshots,
+    load_entry,
+    load_snapshot,
+    snapshot_exists,
+)
+from compression import (
+    HashingWriter,
+    archive_codec,
+    archive_extension,
+    count_files,
+    is_archive,
+    iter_archive,
+    member_index,
+    normalize_codec,
+    normalize_level,
+    normalize_threads,
+    open_archive,
+    read_archive,
+    read_member,
+    scan_archive,
+)
+from db import get_pool
+from delta import DeltaSync
+from events import EventBus, format_event
+from executor import DEFAULT_WORKERS as DEFAULT_JOB_WORKERS, JobExecutor, describe_queue, init_job_queue
+from metrics import HostSampler, MetricsStore
+from targets import (
+    TARGET_METHODS,
+    TargetError,
+    delete_target,
+    get_target,
+    host_key,
+    init_targets,
+    list_targets,
+    save_target,
+    validate_name,
+)
+from prometheus import CONTENT_TYPE as PROMETHEUS_CONTENT_TYPE, BackupMetrics
+from notifier import Notifier
+from progress import ProgressTracker
+from relay import CommandChannel, Relay, WorkerUnavailable, init_relay
+from schedules import (
+    ALL_DAYS,
+    DEFAULT_MISFIRE_GRACE,
+    DEFAULT_STAGGER,
+    NextRunCache,
+    ScheduleError,
+    ScheduleSync,
+    normalize_jitter,
+)
+from restore import (
+    archive_members,
+    diff_tree,
+    normalize_paths,
+    remote_files,
+    restore_tree,
+    snapshot_members,
+    snapshot_totals,
+)
+from sshpool import DEFAULT_IDLE_TIMEOUT, DEFAULT_KEEPALIVE, DEFAULT_MAX_LIFETIME, TransportPool
+from logstore import LogBuffer, LogWriter, init_log_store, normalize_time, parse_job, search_logs
+from transfer import (
+    DEFAULT_WORKERS,
+    READ_CHUNK,
+    RemoteExecUnavailable,
+    active_transfers,
+    clamp_workers,
+    is_partial,
+    parallel_download,
+    prune_deleted,
+    remote_tar,
+    scan_remote,
+    stream_archive,
+)
 
 # Try to import psutil, handled in status endpoint if missing
 try:
@@ -27,11 +122,37 @@ except ImportError:
     psutil = None
 
 # --- Config ---
+# "all" runs everything in one process. For production, one "worker" process
+# runs the scheduler, job queue and restores while any number of "web"
+# processes (see wsgi.py) serve the API; they share state through the
+# database (relay.py).
+ROLES = ("all", "web", "worker")
+ROLE = os.getenv("WPBACKUP_ROLE", "all")
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8080"))
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 LOCAL_DIR = os.path.join(BASE_DIR, "wordpress_backups")
-DB_PATH = os.path.join(BASE_DIR, "wpbackup.db")
+DB_PATH = os.getenv("WPBACKUP_DB", os.path.join(BASE_DIR, "wpbackup.db"))
 LOGO_PATH = os.path.join(BASE_DIR, "logo.png")
+LOG_DIR = os.getenv("LOG_DIR", os.path.join(BASE_DIR, "logs"))
+LOG_BUFFER_LINES = int(os.getenv("LOG_BUFFER_LINES", "5000"))
+LOG_FILE_MAX_MB = int(os.getenv("LOG_FILE_MAX_MB", "10"))
+LOG_FILE_BACKUPS = int(os.getenv("LOG_FILE_BACKUPS", "5"))
+LOG_RETENTION_DAYS = int(os.getenv("LOG_RETENTION_DAYS", "30"))
+# Backup runs allowed at the same time; further runs wait in the job queue.
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", str(DEFAULT_JOB_WORKERS)))
+# Authenticated SSH/SFTP sessions are kept for reuse by later runs and tests.
+SSH_KEEPALIVE = int(os.getenv("SSH_KEEPALIVE", str(DEFAULT_KEEPALIVE)))
+SSH_IDLE_TIMEOUT = int(os.getenv("SSH_IDLE_TIMEOUT", str(DEFAULT_IDLE_TIMEOUT)))
+SSH_MAX_LIFETIME = int(os.getenv("SSH_MAX_LIFETIME", str(DEFAULT_MAX_LIFETIME)))
+CHUNK_STORE_DIR = os.path.join(BASE_DIR, "chunkstore")
 TZ = "Africa/Johannesburg"
+# Schedules set for the same time start spread over this many seconds after
+# it; 0 starts them together.
+SCHEDULE_STAGGER = int(os.getenv("SCHEDULE_STAGGER", str(DEFAULT_STAGGER)))
+# How late a missed scheduled run (e.g. while the worker was down) may still
+# start; older ones are skipped. Several missed runs of one schedule run once.
+SCHEDULE_MISFIRE_GRACE = int(os.getenv("SCHEDULE_MISFIRE_GRACE", str(DEFAULT_MISFIRE_GRACE)))
 
 DEFAULT_SFTP_HOST = os.getenv("SFTP_HOST", "cp71.domains.co.za")
 DEFAULT_SFTP_PORT = int(os.getenv("SFTP_PORT", "22000"))
@@ -39,35 +160,153 @@ DEFAULT_SFTP_USER = os.getenv("SFTP_USER", "labverse")
 DEFAULT_SFTP_PASS = os.getenv("SFTP_PASS", "Superadmin@123")
 DEFAULT_ADMIN_USER = os.getenv("ADMIN_USER", "admin")
 DEFAULT_ADMIN_PASS = os.getenv("ADMIN_PASS", "password")
+# "staged" mirrors the tree under LOCAL_DIR and archives it afterwards;
+# "stream" writes remote files straight into the archive.
+ARCHIVE_MODES = ("staged", "stream")
+# SSH only: "remote_tar" runs tar on the server and streams its output,
+# falling back to the SFTP walk when exec is not permitted. "delta" fetches
+# changed large files block-wise against the previous local copy, using
+# checksums computed on the server; it always stages.
+SSH_TRANSFER_MODES = ("sftp", "remote_tar", "delta")
+# "chunkstore" keeps each backup as a deduplicated snapshot instead of a
+# tarball; downloads rebuild a .tar.gz on the fly. Always uses staged transfer.
+STORAGE_MODES = ("archive", "chunkstore")
+
+# Backups configured through /api/config/<method>; any number of further
+# named sites live in the targets table and get a method_state entry each.
+BUILTIN_METHODS = ("sftp", "ssh", "cpanel")
+# Runs against the same remote host at once, across all sites.
+MAX_HOST_CONNECTIONS = int(os.getenv("MAX_HOST_CONNECTIONS", "2"))
+
+
+def new_method_state():
+    return {"running": False, "progress": 0, "last_result": "Idle", "transfer": None, "stop_event": threading.Event()}
+
 
 # Global state
-method_state = {
-    "sftp": {"running": False, "progress": 0, "last_result": "Idle", "stop_event": threading.Event()},
-    "ssh": {"running": False, "progress": 0, "last_result": "Idle", "stop_event": threading.Event()},
-    "cpanel": {"running": False, "progress": 0, "last_result": "Idle", "stop_event": threading.Event()},
-}
-terminal_logs = []
+method_state = {method_id: new_method_state() for method_id in BUILTIN_METHODS}
+# Byte-level progress of the transfer phase, by method, while one is running.
+progress_trackers = {}
+# With a pre-scan, the transfer phase moves the progress bar across this range.
+TRANSFER_PROGRESS = (10, 90)
+log_buffer = LogBuffer(LOG_BUFFER_LINES)
 cpu_history = []
+metrics_store = MetricsStore()
+backup_metrics = BackupMetrics()
+ssh_pool = TransportPool(SSH_KEEPALIVE, SSH_IDLE_TIMEOUT, SSH_MAX_LIFETIME)
+run_started = {}
+# Restores run on their own threads, outside the backup queue; id -> state,
+# newest RESTORE_HISTORY kept.
+restores = {}
+restore_ids = [0]
+RESTORE_HISTORY = 20
+RESTORE_METHODS = ("sftp", "ssh")
+# Set to have index_archives() look for archives without a member index.
+index_wakeup = threading.Event()
+# Set by create_app(): this process's role and the pid its threads run in.
+services = {"role": None, "pid": None}
+services_lock = threading.Lock()
+# Web workers keep the worker's last published queue summary here.
+shared_queue = [{"workers": JOB_WORKERS, "depth": 0, "running": [], "queued": []}]
+# Every change to the state above is also published here for /api/events.
+# CPU samples arrive every half second; they alone do not change the ETag.
+events = EventBus(volatile=("cpu",))
+SSE_KEEPALIVE = 15
+# Config rows by name; cleared by the config POST handlers.
+config_cache = {}
+config_cache_lock = threading.Lock()
+config_generation = [0]
 
 
 def add_log(msg):
-    ts = datetime.now().strftime("%H:%M:%S")
-    terminal_logs.append(f"[{ts}] {msg}")
-    if len(terminal_logs) > 100:
-        terminal_logs.pop(0)
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    if events.mirrored:
+        # A web worker's own lines come back through the relay like everyone
+        # else's, so every web worker numbers them the same way.
+        events.publish("log", None, shared={"time": timestamp, "message": msg})
+        return
+    append_log(timestamp, msg)
+
+
+def append_log(timestamp, msg, seq=None, forward=True):
+    # seq is the relay id in web workers; forward=False for lines relayed
+    # from another process. The worker (or the single process) persists.
+    job = parse_job(msg)
+    line = f"[{timestamp[11:]}] {msg}"
+    with events.lock:
+        entry = log_buffer.append(timestamp, job, msg, line, seq)
+        data = {"line": line, "seq": entry["seq"]}
+        if seq is not None:
+            events.mirror(seq, "log", data)
+        elif forward:
+            events.publish("log", data, shared={"time": timestamp, "message": msg})
+        else:
+            events.publish_local("log", data)
+    if not events.mirrored:
+        log_writer.write(timestamp, job, msg)
 
 
 # --- Database Management ---
+def db():
+    # Pooled connection as a context manager; commits on success.
+    return get_pool(DB_PATH).connection()
+
+
+def cached_config(name, load):
+    with config_cache_lock:
+        if name in config_cache:
+            value = config_cache[name]
+            return dict(value) if value else value
+        generation = config_generation[0]
+    value = load()
+    with config_cache_lock:
+        # Skip the store if a POST invalidated the cache while we were loading.
+        if generation == config_generation[0]:
+            config_cache[name] = value
+    return dict(value) if value else value
+
+
+def invalidate_config(*names):
+    clear_config(names)
+    # The other processes cache the same rows.
+    if relay.started:
+        relay.send("config", {"names": list(names)})
+
+
+def clear_config(names):
+    with config_cache_lock:
+        config_generation[0] += 1
+        for name in names or list(config_cache):
+            config_cache.pop(name, None)
+
+
 def ensure_column(conn, table, column, definition):
     c = conn.cursor()
     c.execute(f"PRAGMA table_info({table})")
     columns = [row[1] for row in c.fetchall()]
     if column not in columns:
-        c.execute(f"ALTER TABLE {table} ADD COLUMN {definition}")
+        try:
+            c.execute(f"ALTER TABLE {table} ADD COLUMN {definition}")
+        except sqlite3.OperationalError:
+            # Another process starting up at the same time added it first.
+            c.execute(f"PRAGMA table_info({table})")
+            if column not in [row[1] for row in c.fetchall()]:
+                raise
 
 
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
+    config_cache.clear()
+    with db() as conn:
+        init_schema(conn)
+        init_store(conn)
+        init_log_store(conn)
+        init_catalog(conn)
+        init_job_queue(conn)
+        init_targets(conn)
+        init_relay(conn)
+
+
+def init_schema(conn):
     c = conn.cursor()
     c.execute(
         "CREATE TABLE IF NOT EXISTS schedules (id INTEGER PRIMARY KEY AUTOINCREMENT, job_type TEXT, hour INTEGER, minute INTEGER, days TEXT)"
@@ -92,16 +331,57 @@ def init_db():
     )
     ensure_column(conn, "downloads", "job_type", "job_type TEXT")
     ensure_column(conn, "schedules", "job_type", "job_type TEXT")
-    conn.commit()
-    conn.close()
+    ensure_column(conn, "schedules", "jitter", "jitter INTEGER DEFAULT 0")
+    # Time the schedule last fired, or was created or edited; fire times up
+    # to here are not caught up after a restart.
+    ensure_column(conn, "schedules", "last_fire", "last_fire REAL")
+    c.execute(
+        "CREATE TABLE IF NOT EXISTS manifest (target TEXT, path TEXT, size INTEGER, mtime INTEGER, PRIMARY KEY (target, path))"
+    )
+    c.execute(
+        "CREATE TABLE IF NOT EXISTS manifest_deletions (id INTEGER PRIMARY KEY, target TEXT, path TEXT, archive TEXT, timestamp DATETIME)"
+    )
+    ensure_column(conn, "downloads", "mode", "mode TEXT")
+    ensure_column(conn, "sftp_config", "workers", "workers INTEGER")
+    ensure_column(conn, "ssh_config", "workers", "workers INTEGER")
+    ensure_column(conn, "sftp_config", "incremental", "incremental INTEGER DEFAULT 1")
+    ensure_column(conn, "ssh_config", "incremental", "incremental INTEGER DEFAULT 1")
+    ensure_column(conn, "sftp_config", "archive_mode", "archive_mode TEXT")
+    ensure_column(conn, "ssh_config", "archive_mode", "archive_mode TEXT")
+    ensure_column(conn, "ssh_config", "transfer_mode", "transfer_mode TEXT")
+    for table in ("sftp_config", "ssh_config", "cpanel_config"):
+        ensure_column(conn, table, "compression", "compression TEXT")
+        ensure_column(conn, table, "compression_level", "compression_level INTEGER")
+        ensure_column(conn, table, "compression_threads", "compression_threads INTEGER")
+    ensure_column(conn, "sftp_config", "storage", "storage TEXT")
+    ensure_column(conn, "ssh_config", "storage", "storage TEXT")
+    ensure_column(conn, "sftp_config", "prescan", "prescan INTEGER DEFAULT 1")
+    ensure_column(conn, "ssh_config", "prescan", "prescan INTEGER DEFAULT 1")
+    ensure_column(conn, "smtp_config", "digest_minutes", "digest_minutes INTEGER DEFAULT 0")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_downloads_timestamp ON downloads (timestamp)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_downloads_filename ON downloads (filename)")
+    # Running total kept by triggers so the status endpoint never counts the table.
+    c.execute("CREATE TABLE IF NOT EXISTS download_totals (id INTEGER PRIMARY KEY CHECK (id = 1), total INTEGER)")
+    c.execute("INSERT OR IGNORE INTO download_totals (id, total) SELECT 1, COUNT(*) FROM downloads")
+    c.execute(
+        "CREATE TRIGGER IF NOT EXISTS downloads_total_insert AFTER INSERT ON downloads "
+        "BEGIN UPDATE download_totals SET total = total + 1 WHERE id = 1; END"
+    )
+    c.execute(
+        "CREATE TRIGGER IF NOT EXISTS downloads_total_delete AFTER DELETE ON downloads "
+        "BEGIN UPDATE download_totals SET total = total - 1 WHERE id = 1; END"
+    )
 
 
 def get_smtp_config():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT host, port, user, password, from_addr, to_addr FROM smtp_config LIMIT 1")
-    row = c.fetchone()
-    conn.close()
+    return cached_config("smtp", load_smtp_config)
+
+
+def load_smtp_config():
+    with db() as conn:
+        c = conn.cursor()
+        c.execute("SELECT host, port, user, password, from_addr, to_addr, digest_minutes FROM smtp_config LIMIT 1")
+        row = c.fetchone()
     if row:
         return {
             "host": row[0],
@@ -110,16 +390,63 @@ def get_smtp_config():
             "password": row[3],
             "from_addr": row[4],
             "to_addr": row[5],
+            "digest_minutes": row[6] or 0,
         }
     return None
 
 
+def compression_config(codec=None, level=None, threads=None):
+    codec = normalize_codec(codec)
+    return {
+        "compression": codec,
+        "compression_level": normalize_level(codec, level),
+        "compression_threads": normalize_threads(threads),
+    }
+
+
+def compression_values(data, prev):
+    conf = compression_config(
+        data.get("compression", prev["compression"]),
+        data.get("compression_level", prev["compression_level"]),
+        data.get("compression_threads", prev["compression_threads"]),
+    )
+    return conf["compression"], conf["compression_level"], conf["compression_threads"]
+
+
+def archive_options(config):
+    return {
+        "codec": config.get("compression"),
+        "level": config.get("compression_level"),
+        "threads": config.get("compression_threads"),
+    }
+
+
+def normalize_archive_mode(value):
+    return value if value in ARCHIVE_MODES else "staged"
+
+
+def normalize_transfer_mode(value):
+    return value if value in SSH_TRANSFER_MODES else "sftp"
+
+
+def normalize_storage(value):
+    return value if value in STORAGE_MODES else "archive"
+
+
+def uses_chunkstore(config):
+    return config.get("storage") == "chunkstore"
+
+
 def get_sftp_config():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT host, port, user, password, remote_path FROM sftp_config LIMIT 1")
-    row = c.fetchone()
-    conn.close()
+    return cached_config("sftp", load_sftp_config)
+
+
+def load_sftp_config():
+    with db() as conn:
+        c = conn.cursor()
+        c.execute("SELECT host, port, user, password, remote_path, workers, incremental, archive_mode, "
+            "compression, compression_level, compression_threads, storage, prescan FROM sftp_config LIMIT 1")
+        row = c.fetchone()
     if row:
         return {
             "host": row[0],
@@ -127,6 +454,12 @@ def get_sftp_config():
             "user": row[2],
             "password": row[3],
             "remote_path": row[4] or ".",
+            "workers": clamp_workers(row[5]),
+            "incremental": row[6] != 0,
+            "archive_mode": normalize_archive_mode(row[7]),
+            **compression_config(*row[8:11]),
+            "storage": normalize_storage(row[11]),
+            "prescan": row[12] != 0,
         }
     return {
         "host": DEFAULT_SFTP_HOST,
@@ -134,15 +467,25 @@ def get_sftp_config():
         "user": DEFAULT_SFTP_USER,
         "password": DEFAULT_SFTP_PASS,
         "remote_path": ".",
+        "workers": DEFAULT_WORKERS,
+        "incremental": True,
+        "archive_mode": "staged",
+        **compression_config(),
+        "storage": "archive",
+        "prescan": True,
     }
 
 
 def get_ssh_config():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT host, port, user, password, key, remote_path FROM ssh_config LIMIT 1")
-    row = c.fetchone()
-    conn.close()
+    return cached_config("ssh", load_ssh_config)
+
+
+def load_ssh_config():
+    with db() as conn:
+        c = conn.cursor()
+        c.execute("SELECT host, port, user, password, key, remote_path, workers, incremental, archive_mode, "
+            "compression, compression_level, compression_threads, transfer_mode, storage, prescan FROM ssh_config LIMIT 1")
+        row = c.fetchone()
     if row:
         return {
             "host": row[0],
@@ -151,16 +494,43 @@ def get_ssh_config():
             "password": row[3],
             "key": row[4],
             "remote_path": row[5] or ".",
+            "workers": clamp_workers(row[6]),
+            "incremental": row[7] != 0,
+            "archive_mode": normalize_archive_mode(row[8]),
+            **compression_config(*row[9:12]),
+            "transfer_mode": normalize_transfer_mode(row[12]),
+            "storage": normalize_storage(row[13]),
+            "prescan": row[14] != 0,
         }
-    return {"host": "", "port": 22, "user": "", "password": "", "key": "", "remote_path": "."}
+    return {
+        "host": "",
+        "port": 22,
+        "user": "",
+        "password": "",
+        "key": "",
+        "remote_path": ".",
+        "workers": DEFAULT_WORKERS,
+        "incremental": True,
+        "archive_mode": "staged",
+        **compression_config(),
+        "transfer_mode": "sftp",
+        "storage": "archive",
+        "prescan": True,
+    }
 
 
 def get_cpanel_config():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT host, port, user, token, password FROM cpanel_config LIMIT 1")
-    row = c.fetchone()
-    conn.close()
+    return cached_config("cpanel", load_cpanel_config)
+
+
+def load_cpanel_config():
+    with db() as conn:
+        c = conn.cursor()
+        c.execute(
+            "SELECT host, port, user, token, password, compression, compression_level, compression_threads "
+            "FROM cpanel_config LIMIT 1"
+        )
+        row = c.fetchone()
     if row:
         return {
             "host": row[0],
@@ -168,165 +538,541 @@ def get_cpanel_config():
             "user": row[2],
             "token": row[3],
             "password": row[4],
+            **compression_config(*row[5:8]),
         }
-    return {"host": "", "port": 2083, "user": "", "token": "", "password": ""}
+    return {"host": "", "port": 2083, "user": "", "token": "", "password": "", **compression_config()}
 
 
 def ensure_default_user():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT username FROM auth_user LIMIT 1")
-    row = c.fetchone()
-    if not row:
-        c.execute(
-            "INSERT INTO auth_user (username, password_hash) VALUES (?, ?)",
+    with db() as conn:
+        if conn.execute("SELECT 1 FROM auth_user LIMIT 1").fetchone():
+            return
+        # Checked again in the insert itself, so processes starting together
+        # cannot both add the user.
+        conn.execute(
+            "INSERT INTO auth_user (username, password_hash) SELECT ?, ? "
+            "WHERE NOT EXISTS (SELECT 1 FROM auth_user)",
             (DEFAULT_ADMIN_USER, generate_password_hash(DEFAULT_ADMIN_PASS)),
         )
-    conn.commit()
-    conn.close()
 
 
-def log_download_stat(count, total_size, job_type, filename):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute(
-        "INSERT INTO downloads (filename, size, status, timestamp, job_type) VALUES (?, ?, ?, ?, ?)",
-        (filename, total_size, "Success", datetime.now(), job_type),
-    )
-    conn.commit()
-    conn.close()
+def log_download_stat(count, total_size, job_type, filename, mode="full"):
+    with db() as conn:
+        conn.execute(
+            "INSERT INTO downloads (filename, size, status, timestamp, job_type, mode) VALUES (?, ?, ?, ?, ?, ?)",
+            (filename, total_size, "Success", datetime.now(), job_type, mode),
+        )
+    events.publish("dl_stats", download_counts())
+
+
+def download_counts():
+    # Timestamps are stored as "YYYY-MM-DD HH:MM:SS", so a day is a string
+    # range the timestamp index can serve.
+    today = datetime.now().date()
+    with db() as conn:
+        c = conn.cursor()
+        c.execute(
+            "SELECT COUNT(*) FROM downloads WHERE timestamp >= ? AND timestamp < ?",
+            (today.isoformat(), (today + timedelta(days=1)).isoformat()),
+        )
+        count_today = c.fetchone()[0]
+        c.execute("SELECT total FROM download_totals WHERE id = 1")
+        row = c.fetchone()
+    return {"Today": count_today, "Total History": row[0] if row else 0}
+
+
+def load_manifest(target):
+    with db() as conn:
+        c = conn.cursor()
+        c.execute("SELECT path, size, mtime FROM manifest WHERE target = ?", (target,))
+        return {row[0]: (row[1], row[2]) for row in c.fetchall()}
+
+
+def save_manifest(target, stats, filename):
+    # Entries we could not re-verify this run (unlisted folders) are carried
+    # over; failed downloads are dropped so the next run fetches them again.
+    rows = dict(stats.current)
+    for path, entry in stats.previous.items():
+        if path not in rows and path not in stats.failed_paths and path not in stats.deleted:
+            rows[path] = entry
+    now = datetime.now()
+    with db() as conn:
+        c = conn.cursor()
+        c.execute("DELETE FROM manifest WHERE target = ?", (target,))
+        c.executemany(
+            "INSERT INTO manifest (target, path, size, mtime) VALUES (?, ?, ?, ?)",
+            [(target, path, size, mtime) for path, (size, mtime) in rows.items()],
+        )
+        c.executemany(
+            "INSERT INTO manifest_deletions (target, path, archive, timestamp) VALUES (?, ?, ?, ?)",
+            [(target, path, filename, now) for path in stats.deleted],
+        )
 
 
 def send_notification(subject, body):
-    conf = get_smtp_config()
-    if not conf or not conf["host"]:
-        add_log("Notification skipped: No SMTP config.")
-        return
-    try:
-        msg = MIMEMultipart()
-        msg["From"] = conf["from_addr"]
-        msg["To"] = conf["to_addr"]
-        msg["Subject"] = subject
-        msg.attach(MIMEText(body, "plain"))
-        server = smtplib.SMTP(conf["host"], conf["port"])
-        server.starttls()
-        server.login(conf["user"], conf["password"])
-        server.sendmail(conf["from_addr"], conf["to_addr"], msg.as_string())
-        server.quit()
-    except Exception as e:
-        add_log(f"Failed to send email: {str(e)}")
+    # Queued for the notifier thread; never waits on the mail server.
+    notifier.send(subject, body)
 
 
 # --- Background Tasks ---
 
 
 def cpu_monitor():
+    sampler = HostSampler(psutil)
     while True:
         if psutil:
             # Faster sampling for smoother graph
             cpu = psutil.cpu_percent(interval=0.5)
             ts = datetime.now().strftime("%H:%M:%S")
-            cpu_history.append({"time": ts, "value": cpu})
-            if len(cpu_history) > 40:
-                cpu_history.pop(0)
+            point = {"time": ts, "value": cpu}
+            with events.lock:
+                cpu_history.append(point)
+                if len(cpu_history) > 40:
+                    cpu_history.pop(0)
+                events.publish("cpu", point)
+            metrics_store.record({"cpu": cpu, "active_transfers": active_transfers.value, **sampler.sample()})
         else:
+            metrics_store.record({"active_transfers": active_transfers.value})
             time.sleep(1)
+        publish_transfer_progress()
+
+
+def publish_transfer_progress():
+    for method_id, tracker in list(progress_trackers.items()):
+        update_transfer_progress(method_id, tracker)
+    for restore_id, state in list(restores.items()):
+        if state["status"] == "running" and not state["dry_run"]:
+            set_restore_state(restore_id, transfer=restore_progress(state))
+
+
+def update_transfer_progress(method_id, tracker):
+    snap = tracker.snapshot()
+    updates = {"transfer": snap}
+    if snap["percent"] is not None:
+        low, high = TRANSFER_PROGRESS
+        updates["progress"] = low + int((high - low) * snap["percent"] / 100)
+    set_method_state(method_id, **updates)
 
 
 def set_method_state(method_id, **updates):
     state = method_state[method_id]
-    state.update(updates)
+    with events.lock:
+        before = public_method_state(state)
+        state.update(updates)
+        after = public_method_state(state)
+        if after != before:
+            events.publish("method_state", {"method": method_id, **after, "any_running": any_running()})
+    if after["running"] and not before["running"]:
+        run_started[method_id] = time.monotonic()
+    elif before["running"] and not after["running"]:
+        started = run_started.pop(method_id, None)
+        elapsed = time.monotonic() - started if started is not None else 0.0
+        backup_metrics.run_finished(method_id, run_outcome(after["last_result"]), elapsed)
+
+
+def run_outcome(last_result):
+    if last_result == "Success":
+        return "success"
+    if last_result == "Stopped":
+        return "stopped"
+    return "failed"
+
+
+def public_method_state(state):
+    return {
+        "running": state["running"],
+        "progress": state["progress"],
+        "last_result": state["last_result"],
+        "transfer": state["transfer"],
+    }
+
+
+def any_running():
+    return any(state["running"] for state in method_state.values())
 
 
 def get_stop_event(method_id):
     return method_state[method_id]["stop_event"]
 
 
+def transfer_plan(method_id, config, local_root=None):
+    # Incremental runs need the previous manifest and the local mirror it
+    # describes. Stream mode (no local_root) always transfers in full: an
+    # archive of only the changed files would restore as a partial site.
+    previous = {}
+    if config.get("incremental") and local_root is not None and os.path.isdir(local_root):
+        previous = load_manifest(method_id)
+    mode = "incremental" if previous else "full"
+    add_log(f"[{method_id.upper()}] {mode.capitalize()} transfer ({len(previous)} files in manifest).")
+    return previous, mode
+
+
+def finish_transfer(method_id, stats, previous, mode, stop_event):
+    stats.mode = mode
+    stats.previous = previous
+    stats.deleted = []
+    # Deletions are only trusted when every folder could be listed.
+    if previous and not stats.listing_errors and not stop_event.is_set():
+        stats.deleted = sorted(set(previous) - set(stats.current) - stats.failed_paths)
+    if mode == "incremental":
+        add_log(
+            f"[{method_id.upper()}] {stats.files} changed, {stats.skipped} unchanged, {len(stats.deleted)} deleted."
+        )
+
+
+@contextmanager
+def transfer_progress(method_id):
+    tracker = ProgressTracker()
+    progress_trackers[method_id] = tracker
+    try:
+        yield tracker
+    finally:
+        progress_trackers.pop(method_id, None)
+        update_transfer_progress(method_id, tracker)
+
+
+def prescan_tree(method_id, transport, config, stop_event):
+    # Lists the whole tree up front so progress can be measured in bytes; the
+    # transfer then works from this listing instead of walking again.
+    if not config.get("prescan"):
+        return None
+    label = method_id.upper()
+    phase = method_state[method_id]["last_result"]
+    set_method_state(method_id, last_result="Scanning...")
+    started = time.monotonic()
+    scan = scan_remote(
+        transport, config.get("remote_path") or ".", stop_event, log=lambda msg: add_log(f"[{label}] {msg}")
+    )
+    add_log(
+        f"[{label}] Scanned {scan.files} files ({round(scan.bytes/1024/1024, 2)} MB) "
+        f"in {round(time.monotonic() - started, 1)}s."
+    )
+    set_method_state(method_id, last_result=phase)
+    return scan
+
+
+def download_remote_tree(method_id, transport, config, local_root, stop_event, verb="Downloaded"):
+    label = method_id.upper()
+    remote_root = config.get("remote_path") or "."
+    previous, mode = transfer_plan(method_id, config, local_root)
+    scan = prescan_tree(method_id, transport, config, stop_event)
+    log = lambda msg: add_log(f"[{label}] {msg}")
+    delta = DeltaSync(transport, log=log) if config.get("transfer_mode") == "delta" else None
+    with transfer_progress(method_id) as tracker:
+        stats = parallel_download(
+            transport,
+            remote_root,
+            local_root,
+            stop_event,
+            workers=config.get("workers") or DEFAULT_WORKERS,
+            log=log,
+            verb=verb,
+            previous=previous,
+            listener=backup_metrics.listener(method_id),
+            scan=scan,
+            progress=tracker,
+            delta=delta,
+        )
+    if delta and delta.summary():
+        log(delta.summary())
+    finish_transfer(method_id, stats, previous, mode, stop_event)
+    prune_deleted(remote_root, local_root, stats.deleted)
+    return stats
+
+
+def stream_remote_tree(method_id, transport, config, stop_event, verb="Archived"):
+    # Streaming mode: remote files go straight into the archive, so there is no
+    # staging copy and no separate archiving pass. Every archive is complete.
+    label = method_id.upper()
+    previous, mode = transfer_plan(method_id, config)
+    scan = prescan_tree(method_id, transport, config, stop_event)
+    filename = new_archive_name(method_id, config.get("compression"))
+    full_archive_path = os.path.join(BASE_DIR, filename)
+    part_path = full_archive_path + ".part"
+    stats = None
+    try:
+        with open_archive(part_path, **archive_options(config)) as tar, transfer_progress(method_id) as tracker:
+            stats = stream_archive(
+                transport,
+                config.get("remote_path") or ".",
+                tar,
+                f"{method_id}_backups",
+                stop_event,
+                workers=config.get("workers") or DEFAULT_WORKERS,
+                log=lambda msg: add_log(f"[{label}] {msg}"),
+                verb=verb,
+                previous=previous,
+                listener=backup_metrics.listener(method_id),
+                scan=scan,
+                progress=tracker,
+            )
+            finish_transfer(method_id, stats, previous, mode, stop_event)
+            files = count_files(tar)
+            if not stop_event.is_set():
+                add_info_member(tar, method_id, archive_info(stats))
+            writer = tar.compressor
+    except Exception:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        if stop_event.is_set():
+            return None, stats
+        raise
+    if stop_event.is_set():
+        os.remove(part_path)
+        return None, stats
+    os.replace(part_path, full_archive_path)
+    backup_metrics.compression_ratio.set(writer.ratio(), job=method_id)
+    catalog_archive(method_id, filename, files, writer.checksum(), (member_index(tar), writer.blocks))
+    return filename, stats
+
+
+def remote_tar_archive(method_id, transport, config, stop_event):
+    # Returns (None, None) when the server will not run tar so the caller can
+    # fall back to the SFTP walk.
+    label = method_id.upper()
+    filename = new_archive_name(method_id, "gzip")
+    full_archive_path = os.path.join(BASE_DIR, filename)
+    part_path = full_archive_path + ".part"
+    add_log(f"[{label}] Running tar on the remote host...")
+    try:
+        with open(part_path, "wb") as raw:
+            out = HashingWriter(raw)
+            stats = remote_tar(
+                transport,
+                config.get("remote_path") or ".",
+                out,
+                f"{method_id}_backups",
+                stop_event,
+                log=lambda msg: add_log(f"[{label}] {msg}"),
+                verb="Synced",
+                listener=backup_metrics.listener(method_id),
+            )
+    except RemoteExecUnavailable as e:
+        os.remove(part_path)
+        add_log(f"[{label}] Remote tar unavailable ({str(e)}), falling back to SFTP walk.")
+        return None, None
+    except Exception:
+        os.remove(part_path)
+        raise
+    if stop_event.is_set():
+        os.remove(part_path)
+        return None, stats
+    os.replace(part_path, full_archive_path)
+    catalog_archive(method_id, filename, stats.files, out.checksum())
+    # tar's own single gzip stream has no block table; index it by reading it.
+    index_wakeup.set()
+    return filename, stats
+
+
+def new_archive_name(method_id, codec=None):
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return f"{method_id}_backup_{timestamp}{archive_extension(codec)}"
+
+
+def add_info_member(tar, method_id, info):
+    payload = json.dumps({"job": method_id, **info}, indent=2).encode("utf-8")
+    member = tarfile.TarInfo("backup_info.json")
+    member.size = len(payload)
+    member.mtime = int(time.time())
+    tar.addfile(member, io.BytesIO(payload))
+
+
+def create_archive(method_id, local_root, info, config):
+    started = time.monotonic()
+    if uses_chunkstore(config):
+        filename = create_snapshot(method_id, local_root, info)
+        backup_metrics.archive_seconds.observe(time.monotonic() - started, job=method_id)
+        return filename
+    filename = new_archive_name(method_id, config.get("compression"))
+    full_archive_path = os.path.join(BASE_DIR, filename)
+    with open_archive(full_archive_path, **archive_options(config)) as tar:
+        # Interrupted downloads wait in the mirror as .partial files; they are
+        # not part of the backup.
+        tar.add(
+            local_root,
+            arcname=f"{method_id}_backups",
+            filter=lambda member: None if is_partial(member.name) else member,
+        )
+        files = count_files(tar)
+        add_info_member(tar, method_id, info)
+        writer = tar.compressor
+    backup_metrics.archive_seconds.observe(time.monotonic() - started, job=method_id)
+    backup_metrics.compression_ratio.set(writer.ratio(), job=method_id)
+    catalog_archive(method_id, filename, files, writer.checksum(), (member_index(tar), writer.blocks))
+    return filename
+
+
+def catalog_archive(method_id, filename, files, checksum, index=None):
+    # index is (members, blocks) for archives written through open_archive.
+    st = os.stat(os.path.join(BASE_DIR, filename))
+    with db() as conn:
+        add_archive(conn, filename, method_id, st.st_size, st.st_mtime, files, checksum)
+        if index:
+            add_index(conn, filename, *index)
+
+
+def snapshot_index(snapshot):
+    return [(path, size, mtime, None) for path, entry_type, size, mtime, _, _ in snapshot["entries"] if entry_type != "d"]
+
+
+def index_archives():
+    # Builds the member index for archives that have none: older ones, remote
+    # tar output and anything reconcile picked up from disk.
+    while True:
+        index_wakeup.wait()
+        index_wakeup.clear()
+        with db() as conn:
+            pending = unindexed_archives(conn)
+        indexed = 0
+        for filename, storage in pending:
+            try:
+                if storage == "chunkstore":
+                    with db() as conn:
+                        snapshot = load_snapshot(conn, filename)
+                        if snapshot:
+                            add_index(conn, filename, snapshot_index(snapshot))
+                            indexed += 1
+                    continue
+                path = os.path.join(BASE_DIR, filename)
+                if not os.path.exists(path):
+                    continue
+                with open(path, "rb") as f:
+                    blocks, members = scan_archive(f, archive_codec(filename))
+                with db() as conn:
+                    if get_archive(conn, filename):
+                        add_index(conn, filename, members, blocks)
+                        indexed += 1
+            except Exception as e:
+                add_log(f"[ARCHIVE] Could not index {filename}: {str(e)}")
+        if indexed:
+            add_log(f"[ARCHIVE] Indexed {indexed} archive(s).")
+
+
+def reconcile_catalog():
+    def lookup_job(conn, filename):
+        row = conn.execute("SELECT job_type FROM downloads WHERE filename = ? LIMIT 1", (filename,)).fetchone()
+        return row[0] if row else None
+
+    with db() as conn:
+        added, removed = reconcile(conn, BASE_DIR, is_archive, list_snapshots(conn), lookup_job)
+    if added or removed:
+        add_log(f"[ARCHIVE] Catalog reconciled: {added} added, {removed} removed.")
+
+
+def create_snapshot(method_id, local_root, info):
+    # Snapshots are exported as gzip, so they carry a .tar.gz name.
+    filename = new_archive_name(method_id, "gzip")
+    with db() as conn:
+        totals = ingest_tree(
+            conn,
+            CHUNK_STORE_DIR,
+            filename,
+            method_id,
+            local_root,
+            f"{method_id}_backups",
+            {"job": method_id, **info},
+            get_stop_event(method_id),
+            log=lambda msg: add_log(f"[{method_id.upper()}] {msg}"),
+            exclude=is_partial,
+        )
+        if not get_stop_event(method_id).is_set():
+            add_archive(conn, filename, method_id, totals["size"], time.time(), totals["files"], storage="chunkstore")
+            add_index(conn, filename, snapshot_index(load_snapshot(conn, filename)))
+    add_log(
+        f"[{method_id.upper()}] Snapshot stored: {totals['new_chunks']} new chunks "
+        f"({round(totals['new_bytes']/1024/1024, 2)} MB), {totals['reused_files']} files unchanged"
+    )
+    return filename
+
+
+def archive_info(stats):
+    return {
+        "mode": stats.mode,
+        "files_transferred": stats.files,
+        "files_unchanged": stats.skipped,
+        "files_failed": stats.failed,
+        "deleted": stats.deleted,
+    }
+
+
+def record_archive(method_id, filename, stats, files_count, total_size):
+    add_log(f"[{method_id.upper()}] Archive created: {filename}")
+    log_download_stat(files_count, total_size, method_id, filename, stats.mode if stats else "full")
+    if stats:
+        save_manifest(method_id, stats, filename)
+
+
+def connect_remote(method_id, config):
+    # Checks out a pooled transport; returns (transport, pool entry).
+    started = time.monotonic()
+    transport, entry, reused = ssh_pool.acquire(config)
+    backup_metrics.connect_seconds.observe(time.monotonic() - started, job=method_id)
+    backup_metrics.ssh_sessions.inc(job=method_id, reused="true" if reused else "false")
+    if reused:
+        add_log(f"[{method_id.upper()}] Reusing pooled connection.")
+    return transport, entry
+
+
 def run_sftp_backup(method_id, config):
-    set_method_state(method_id, running=True, progress=10, last_result="Starting...")
+    set_method_state(method_id, running=True, progress=10, last_result="Starting...", transfer=None)
     stop_event = get_stop_event(method_id)
     stop_event.clear()
     add_log(f"[{method_id.upper()}] Starting Backup Process...")
 
     transport = None
-    sftp = None
+    pooled = None
+    broken = False
+    stats = None
     files_downloaded_count = 0
     total_size = 0
     local_root = os.path.join(LOCAL_DIR, method_id)
+    streamed = config.get("archive_mode") == "stream" and not uses_chunkstore(config)
 
     try:
         add_log(f"[{method_id.upper()}] Connecting to SFTP...")
-        transport = paramiko.Transport((config["host"], config["port"]))
-        transport.connect(username=config["user"], password=config["password"])
-        sftp = paramiko.SFTPClient.from_transport(transport)
+        transport, pooled = connect_remote(method_id, config)
 
-        if not os.path.exists(local_root):
-            os.makedirs(local_root)
-
-        def sftp_get_recursive(remote, local):
-            nonlocal files_downloaded_count, total_size
-            if stop_event.is_set():
-                return
-
-            try:
-                file_list = sftp.listdir_attr(remote)
-            except Exception as e:
-                add_log(f"[{method_id.upper()}] Skipping folder {remote}: {str(e)}")
-                return
-
-            for item in file_list:
-                if stop_event.is_set():
-                    return
-
-                r_path = remote + "/" + item.filename if remote != "." else item.filename
-                l_path = os.path.join(local, item.filename)
-
-                try:
-                    if stat.S_ISDIR(item.st_mode):
-                        if not os.path.exists(l_path):
-                            os.makedirs(l_path)
-                        sftp_get_recursive(r_path, l_path)
-                    else:
-                        sftp.get(r_path, l_path)
-                        add_log(f"[{method_id.upper()}] Downloaded: {item.filename}")
-                        files_downloaded_count += 1
-                        total_size += item.st_size
-                except Exception as inner_e:
-                    add_log(f"[{method_id.upper()}] FAILED {item.filename}: {str(inner_e)}")
-
-        add_log(f"[{method_id.upper()}] Starting File Download...")
-        set_method_state(method_id, progress=60, last_result="Downloading...")
-        sftp_get_recursive(config.get("remote_path") or ".", local_root)
+        if streamed:
+            add_log(f"[{method_id.upper()}] Streaming Files Into Archive...")
+            set_method_state(method_id, progress=10 if config.get("prescan") else 60, last_result="Streaming...")
+            filename, stats = stream_remote_tree(method_id, transport, config, stop_event)
+        else:
+            add_log(f"[{method_id.upper()}] Starting File Download...")
+            set_method_state(method_id, progress=10 if config.get("prescan") else 60, last_result="Downloading...")
+            stats = download_remote_tree(method_id, transport, config, local_root, stop_event)
+        if stats:
+            files_downloaded_count, total_size = stats.files, stats.bytes
 
         if stop_event.is_set():
             add_log(f"[{method_id.upper()}] Process stopped by user.")
             set_method_state(method_id, last_result="Stopped")
             return
 
+        if streamed:
+            record_archive(method_id, filename, stats, files_downloaded_count, total_size)
+            send_notification(
+                f"{method_id.upper()} Backup Success",
+                f"Backup: {filename}\nFiles: {files_downloaded_count}\nSize: {round(total_size/1024/1024, 2)} MB",
+            )
+            set_method_state(method_id, progress=100, last_result="Success")
+
     except Exception as e:
+        broken = True
         add_log(f"[{method_id.upper()}] Critical Connection Error: {str(e)}")
         set_method_state(method_id, last_result=f"Failed: {str(e)}")
         send_notification(f"{method_id.upper()} Backup Failed", f"Error: {str(e)}")
 
     finally:
-        if sftp:
-            sftp.close()
         if transport:
-            transport.close()
+            ssh_pool.release(transport, pooled, broken=broken or stop_event.is_set())
 
-        if not stop_event.is_set():
+        if not streamed and not stop_event.is_set():
             add_log(f"[{method_id.upper()}] Creating Timestamped Archive...")
             try:
                 if os.path.exists(local_root):
-                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                    filename = f"{method_id}_backup_{timestamp}.tar.gz"
-                    full_archive_path = os.path.join(BASE_DIR, filename)
-
-                    with tarfile.open(full_archive_path, "w:gz") as tar:
-                        tar.add(local_root, arcname=f"{method_id}_backups")
-
-                    add_log(f"[{method_id.upper()}] Archive created: {filename}")
-                    log_download_stat(files_downloaded_count, total_size, method_id, filename)
+                    info = archive_info(stats) if stats else {"mode": "full"}
+                    filename = create_archive(method_id, local_root, info, config)
+                    record_archive(method_id, filename, stats, files_downloaded_count, total_size)
 
                     send_notification(
                         f"{method_id.upper()} Backup Success",
@@ -343,98 +1089,68 @@ def run_sftp_backup(method_id, config):
         set_method_state(method_id, running=False)
 
 
-def run_ssh_backup():
-    config = get_ssh_config()
-    method_id = "ssh"
-    set_method_state(method_id, running=True, progress=10, last_result="Starting...")
+def run_ssh_backup(method_id="ssh", config=None):
+    config = config or get_ssh_config()
+    label = method_id.upper()
+    set_method_state(method_id, running=True, progress=10, last_result="Starting...", transfer=None)
     stop_event = get_stop_event(method_id)
     stop_event.clear()
-    add_log("[SSH] Starting SSH Sync...")
+    add_log(f"[{label}] Starting SSH Sync...")
 
-    client = paramiko.SSHClient()
-    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    transport = None
+    pooled = None
+    broken = False
     files_downloaded_count = 0
     total_size = 0
     local_root = os.path.join(LOCAL_DIR, method_id)
 
     try:
-        pkey = None
-        if config.get("key"):
-            pkey = paramiko.RSAKey.from_private_key(io.StringIO(config["key"]))
-        client.connect(
-            config["host"],
-            port=config.get("port") or 22,
-            username=config["user"],
-            password=config.get("password") or None,
-            pkey=pkey,
-            timeout=10,
-        )
-        add_log("[SSH] Connected. Starting file sync...")
-        set_method_state(method_id, progress=50, last_result="Syncing...")
-        if not os.path.exists(local_root):
-            os.makedirs(local_root)
-        sftp = client.open_sftp()
-
-        def sftp_get_recursive(remote, local):
-            nonlocal files_downloaded_count, total_size
-            if stop_event.is_set():
-                return
-
-            try:
-                file_list = sftp.listdir_attr(remote)
-            except Exception as e:
-                add_log(f"[SSH] Skipping folder {remote}: {str(e)}")
-                return
-
-            for item in file_list:
-                if stop_event.is_set():
-                    return
-                r_path = remote + "/" + item.filename if remote != "." else item.filename
-                l_path = os.path.join(local, item.filename)
-                try:
-                    if stat.S_ISDIR(item.st_mode):
-                        if not os.path.exists(l_path):
-                            os.makedirs(l_path)
-                        sftp_get_recursive(r_path, l_path)
-                    else:
-                        sftp.get(r_path, l_path)
-                        add_log(f"[SSH] Synced: {item.filename}")
-                        files_downloaded_count += 1
-                        total_size += item.st_size
-                except Exception as inner_e:
-                    add_log(f"[SSH] FAILED {item.filename}: {str(inner_e)}")
-
-        sftp_get_recursive(config.get("remote_path") or ".", local_root)
-        sftp.close()
+        transport, pooled = connect_remote(method_id, config)
+        add_log(f"[{label}] Connected. Starting file sync...")
+        filename, stats, tar_stats = None, None, None
+        chunked = uses_chunkstore(config)
+        remote_tarred = config.get("transfer_mode") == "remote_tar" and not chunked
+        # Remote tar has no listing to scan, so its progress stays coarse.
+        scanned = config.get("prescan") and not remote_tarred
+        set_method_state(method_id, progress=10 if scanned else 50, last_result="Syncing...")
+        if remote_tarred:
+            filename, tar_stats = remote_tar_archive(method_id, transport, config, stop_event)
+        if tar_stats:
+            files_downloaded_count, total_size = tar_stats.files, tar_stats.bytes
+        elif config.get("archive_mode") == "stream" and not chunked and config.get("transfer_mode") != "delta":
+            filename, stats = stream_remote_tree(method_id, transport, config, stop_event, verb="Synced")
+        else:
+            stats = download_remote_tree(method_id, transport, config, local_root, stop_event, verb="Synced")
+        if stats:
+            files_downloaded_count, total_size = stats.files, stats.bytes
 
         if stop_event.is_set():
-            add_log("[SSH] Process stopped by user.")
+            add_log(f"[{label}] Process stopped by user.")
             set_method_state(method_id, last_result="Stopped")
             return
 
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{method_id}_backup_{timestamp}.tar.gz"
-        full_archive_path = os.path.join(BASE_DIR, filename)
-        with tarfile.open(full_archive_path, "w:gz") as tar:
-            tar.add(local_root, arcname=f"{method_id}_backups")
-        log_download_stat(files_downloaded_count, total_size, method_id, filename)
-        add_log(f"[SSH] Archive created: {filename}")
+        if not filename:
+            add_log(f"[{label}] Creating Timestamped Archive...")
+            filename = create_archive(method_id, local_root, archive_info(stats), config)
+        record_archive(method_id, filename, stats, files_downloaded_count, total_size)
         set_method_state(method_id, progress=100, last_result="Success")
     except Exception as e:
-        add_log(f"[SSH] Critical Error: {str(e)}")
+        broken = True
+        add_log(f"[{label}] Critical Error: {str(e)}")
         set_method_state(method_id, last_result=f"Failed: {str(e)}")
     finally:
-        client.close()
+        if transport:
+            ssh_pool.release(transport, pooled, broken=broken or stop_event.is_set())
         set_method_state(method_id, running=False)
 
 
-def run_cpanel_backup():
-    config = get_cpanel_config()
-    method_id = "cpanel"
-    set_method_state(method_id, running=True, progress=20, last_result="Starting...")
+def run_cpanel_backup(method_id="cpanel", config=None):
+    config = config or get_cpanel_config()
+    label = method_id.upper()
+    set_method_state(method_id, running=True, progress=20, last_result="Starting...", transfer=None)
     stop_event = get_stop_event(method_id)
     stop_event.clear()
-    add_log("[CPANEL] Starting cPanel API backup...")
+    add_log(f"[{label}] Starting cPanel API backup...")
     try:
         if not config.get("host"):
             raise ValueError("cPanel host not configured.")
@@ -447,73 +1163,222 @@ def run_cpanel_backup():
             credentials = f"{config['user']}:{config['password']}".encode("utf-8")
             req.add_header("Authorization", "Basic " + base64.b64encode(credentials).decode("utf-8"))
         context = ssl._create_unverified_context()
+        started = time.monotonic()
         with urllib.request.urlopen(req, timeout=10, context=context) as response:
-            add_log(f"[CPANEL] Connected: {response.status}")
+            add_log(f"[{label}] Connected: {response.status}")
+        backup_metrics.connect_seconds.observe(time.monotonic() - started, job=method_id)
         if stop_event.is_set():
-            add_log("[CPANEL] Process stopped by user.")
+            add_log(f"[{label}] Process stopped by user.")
             set_method_state(method_id, last_result="Stopped")
             return
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{method_id}_backup_{timestamp}.tar.gz"
+        filename = new_archive_name(method_id, config.get("compression"))
         full_archive_path = os.path.join(BASE_DIR, filename)
-        with tarfile.open(full_archive_path, "w:gz") as tar:
+        with open_archive(full_archive_path, **archive_options(config)) as tar:
             marker_path = os.path.join(BASE_DIR, f"{method_id}_backup_{timestamp}.txt")
             with open(marker_path, "w", encoding="utf-8") as marker:
                 marker.write("cPanel backup placeholder.\n")
             tar.add(marker_path, arcname=f"{method_id}_backup_info.txt")
             os.remove(marker_path)
-        log_download_stat(1, os.path.getsize(full_archive_path), method_id, filename)
-        add_log(f"[CPANEL] Archive created: {filename}")
+            writer = tar.compressor
+        catalog_archive(method_id, filename, count_files(tar), writer.checksum(), (member_index(tar), writer.blocks))
+        archive_size = os.path.getsize(full_archive_path)
+        backup_metrics.listener(method_id).on_file(archive_size)
+        log_download_stat(1, archive_size, method_id, filename)
+        add_log(f"[{label}] Archive created: {filename}")
         set_method_state(method_id, progress=100, last_result="Success")
     except Exception as e:
-        add_log(f"[CPANEL] Error: {str(e)}")
+        add_log(f"[{label}] Error: {str(e)}")
         set_method_state(method_id, last_result=f"Failed: {str(e)}")
     finally:
         set_method_state(method_id, running=False)
 
 
 # --- Scheduler Setup ---
-scheduler = BackgroundScheduler(timezone=TZ)
-scheduler.start()
+# A run that fires late (the process was busy or suspended) still starts
+# within the grace time, once however many times it was missed.
+scheduler = BackgroundScheduler(
+    timezone=TZ,
+    job_defaults={"coalesce": True, "misfire_grace_time": max(1, SCHEDULE_MISFIRE_GRACE), "max_instances": 1},
+)
+schedule_sync = ScheduleSync(
+    scheduler,
+    lambda job_type, schedule_id: run_scheduled_job(job_type, schedule_id),
+    TZ,
+    stagger=SCHEDULE_STAGGER,
+    misfire_grace=SCHEDULE_MISFIRE_GRACE,
+    log=add_log,
+)
+next_runs = NextRunCache(TZ)
 
 
-def load_schedules_from_db():
-    scheduler.remove_all_jobs()
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT id, job_type, hour, minute, days FROM schedules")
-    for schedule_id, job_type, hour, minute, days in c.fetchall():
-        if days:
-            trigger = CronTrigger(day_of_week=days, hour=hour, minute=minute, timezone=TZ)
-            scheduler.add_job(
-                run_scheduled_job,
-                trigger=trigger,
-                id=f"{job_type}-{schedule_id}",
-                args=[job_type],
-                replace_existing=True,
-            )
-    conn.close()
+def schedule_rows(conn):
+    return conn.execute(
+        "SELECT id, job_type, hour, minute, days, jitter, last_fire FROM schedules ORDER BY id DESC"
+    ).fetchall()
+
+
+def load_schedules_from_db(catch_up=False):
+    with db() as conn:
+        rows = schedule_rows(conn)
+    added, changed, removed = schedule_sync.sync(rows, catch_up)
+    if added or changed or removed:
+        add_log(f"[SCHEDULER] Schedules synced: {added} added, {changed} changed, {removed} removed.")
+
+
+# --- Sites ---
+
+BUILTIN_CONFIGS = {"sftp": get_sftp_config, "ssh": get_ssh_config, "cpanel": get_cpanel_config}
+TARGET_RUNNERS = {"sftp": run_sftp_backup, "ssh": run_ssh_backup, "cpanel": run_cpanel_backup}
 
 
-def run_scheduled_job(job_type):
-    if method_state[job_type]["running"]:
-        add_log(f"[{job_type.upper()}] Scheduled run skipped: already running.")
+def get_target_config(name):
+    return cached_config(f"target:{name}", lambda: load_target(name))
+
+
+def load_target(name):
+    with db() as conn:
+        return get_target(conn, name)
+
+
+def load_target_states():
+    with db() as conn:
+        targets = list_targets(conn)
+    with events.lock:
+        for target in targets:
+            method_state.setdefault(target["name"], new_method_state())
+
+
+def target_defaults(method):
+    defaults = {
+        "host": "",
+        "port": 2083 if method == "cpanel" else 22,
+        "user": "",
+        "password": "",
+        **compression_config(),
+    }
+    if method == "cpanel":
+        defaults["token"] = ""
+        return defaults
+    defaults.update(
+        {
+            "remote_path": ".",
+            "workers": DEFAULT_WORKERS,
+            "incremental": True,
+            "archive_mode": "staged",
+            "storage": "archive",
+            "prescan": True,
+        }
+    )
+    if method == "ssh":
+        defaults.update({"key": "", "transfer_mode": "sftp"})
+    return defaults
+
+
+def target_config(method, data, prev=None):
+    # Same fields and normalisation as the matching /api/config/<method>.
+    prev = prev or target_defaults(method)
+    conf = {key: data.get(key, value) for key, value in prev.items() if key in ("host", "user", "password", "key", "token")}
+    conf["port"] = int(data.get("port") or prev["port"])
+    conf.update(dict(zip(("compression", "compression_level", "compression_threads"), compression_values(data, prev))))
+    if method != "cpanel":
+        conf.update(
+            {
+                "remote_path": data.get("remote_path", prev["remote_path"]) or ".",
+                "workers": clamp_workers(data.get("workers", prev["workers"])),
+                "incremental": bool(data.get("incremental", prev["incremental"])),
+                "archive_mode": normalize_archive_mode(data.get("archive_mode", prev["archive_mode"])),
+                "storage": normalize_storage(data.get("storage", prev["storage"])),
+                "prescan": bool(data.get("prescan", prev["prescan"])),
+            }
+        )
+    if method == "ssh":
+        conf["transfer_mode"] = normalize_transfer_mode(data.get("transfer_mode", prev["transfer_mode"]))
+    return conf
+
+
+def public_target(target):
+    config = {key: value for key, value in target["config"].items() if key not in ("password", "key", "token")}
+    return {**target, "config": config, **public_method_state(method_state.get(target["name"], new_method_state()))}
+
+
+def publish_targets():
+    with events.lock:
+        events.publish("targets", {"methods": sorted(method_state)})
+
+
+def run_scheduled_job(job_type, schedule_id=None):
+    if schedule_id is not None:
+        with db() as conn:
+            conn.execute("UPDATE schedules SET last_fire = ? WHERE id = ?", (time.time(), schedule_id))
+    if job_type not in method_state:
+        add_log(f"[{job_type.upper()}] Scheduled run skipped: unknown job.")
         return
-    add_log(f"[{job_type.upper()}] Scheduled run triggered.")
-    if job_type == "sftp":
-        threading.Thread(target=run_sftp_backup, args=("sftp", get_sftp_config())).start()
-    elif job_type == "ssh":
-        threading.Thread(target=run_ssh_backup).start()
-    elif job_type == "cpanel":
-        threading.Thread(target=run_cpanel_backup).start()
+    _, deduplicated = job_executor.submit(job_type, "scheduled")
+    if deduplicated:
+        add_log(f"[{job_type.upper()}] Scheduled run already queued.")
+    else:
+        add_log(f"[{job_type.upper()}] Scheduled run queued.")
 
 
-threading.Thread(target=cpu_monitor, daemon=True).start()
+def run_job(method_id):
+    # Called on a job executor worker.
+    if method_id == "sftp":
+        run_sftp_backup("sftp", get_sftp_config())
+    elif method_id == "ssh":
+        run_ssh_backup()
+    elif method_id == "cpanel":
+        run_cpanel_backup()
+    else:
+        target = get_target_config(method_id)
+        if not target:
+            add_log(f"[{method_id.upper()}] Run skipped: site no longer exists.")
+        elif not target["enabled"]:
+            add_log(f"[{method_id.upper()}] Run skipped: site is disabled.")
+        else:
+            TARGET_RUNNERS[target["method"]](method_id, target["config"])
+
+
+def job_config(method_id):
+    # (method, config) of a built-in job or site; (None, None) if unknown.
+    if method_id in BUILTIN_METHODS:
+        return method_id, BUILTIN_CONFIGS[method_id]()
+    target = get_target_config(method_id)
+    return (target["method"], target["config"]) if target else (None, None)
+
+
+def job_host(method_id):
+    _, config = job_config(method_id)
+    return host_key(config) if config else None
+
+
+def publish_queue():
+    with events.lock:
+        summary = job_executor.summary()
+        events.publish("queue", summary)
+    backup_metrics.queue_depth.set(summary["depth"])
+
+
+def queue_run_started(entry):
+    backup_metrics.queue_wait_seconds.observe(entry["started"] - entry["enqueued"], job=entry["job"])
+
+
+job_executor = JobExecutor(
+    db,
+    run_job,
+    JOB_WORKERS,
+    log=add_log,
+    on_change=publish_queue,
+    on_start=queue_run_started,
+    resource=job_host,
+    resource_limit=MAX_HOST_CONNECTIONS,
+)
+
+
+log_writer = LogWriter(db, LOG_DIR, LOG_FILE_MAX_MB * 1024 * 1024, LOG_FILE_BACKUPS, LOG_RETENTION_DAYS)
+notifier = Notifier(get_smtp_config, log=add_log)
 
 app = Flask(__name__)
-init_db()
-ensure_default_user()
-load_schedules_from_db()
 
 
 # --- API Endpoints ---
@@ -540,85 +1405,247 @@ def upload_logo():
     return ("No file", 400)
 
 
+def status_snapshot():
+    dl_stats = download_counts()
+    return events.snapshot(
+        lambda: {
+            "running": any_running(),
+            "methods": {method_id: public_method_state(state) for method_id, state in method_state.items()},
+            "logs": log_buffer.tail(100),
+            "cpu_history": list(cpu_history),
+            "dl_stats": dl_stats,
+            "queue": queue_summary(),
+        }
+    )
+
+
+def queue_summary():
+    return shared_queue[0] if events.mirrored else job_executor.summary()
+
+
 @app.route("/api/status")
 def status():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    today_str = datetime.now().strftime("%Y-%m-%d")
-    c.execute("SELECT COUNT(*) FROM downloads WHERE date(timestamp) = ?", (today_str,))
-    count_today = c.fetchone()[0]
-    c.execute("SELECT COUNT(*) FROM downloads")
-    count_total = c.fetchone()[0]
-    conn.close()
-
-    return jsonify(
-        {
-            "running": any(state["running"] for state in method_state.values()),
-            "methods": {
-                method_id: {
-                    "running": state["running"],
-                    "progress": state["progress"],
-                    "last_result": state["last_result"],
-                }
-                for method_id, state in method_state.items()
-            },
-            "logs": terminal_logs,
-            "cpu_history": cpu_history,
-            "dl_stats": {"Today": count_today, "Total History": count_total},
-        }
+    # Everything in the payload publishes an event when it changes, so the
+    # last non-CPU sequence number (plus the date, for "Today") identifies it;
+    # a 304 leaves the client's CPU history as it was. Read before building,
+    # so the body is never older than its tag.
+    etag = f"{events.last_change()}-{datetime.now().date().isoformat()}"
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers={"ETag": f'"{etag}"', "Cache-Control": "no-cache"})
+    _, snapshot = status_snapshot()
+    response = jsonify(snapshot)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+@app.route("/api/events")
+def api_events():
+    # Server-Sent Events: a full "snapshot" first (or when the client's
+    # Last-Event-ID is too old to replay), then one event per change.
+    try:
+        last_id = int(request.headers.get("Last-Event-ID") or request.args.get("last_event_id") or -1)
+    except ValueError:
+        last_id = -1
+
+    def stream():
+        seq = last_id
+        yield "retry: 3000\n\n"
+        pending, complete = events.since(seq) if seq >= 0 else ([], False)
+        while True:
+            if not complete:
+                seq, snapshot = status_snapshot()
+                yield format_event(seq, "snapshot", snapshot)
+                pending, complete = events.since(seq)
+            for event in pending:
+                seq = event[0]
+                yield format_event(*event)
+            pending, complete = events.wait(seq, SSE_KEEPALIVE)
+            if complete and not pending:
+                yield ": keepalive\n\n"
+
+    return Response(
+        stream_with_context(stream()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
 
 
+@app.route("/api/logs")
+def api_logs():
+    # Incremental fetch from the in-memory buffer: pass the last seen seq.
+    try:
+        since = int(request.args.get("since", 0))
+        limit = min(max(int(request.args.get("limit", 1000)), 1), LOG_BUFFER_LINES)
+    except ValueError:
+        return ("Invalid since/limit", 400)
+    entries, last_seq, truncated = log_buffer.since(since, limit)
+    return jsonify({"entries": entries, "last_seq": last_seq, "truncated": truncated})
+
+
+@app.route("/api/logs/search")
+def api_logs_search():
+    # Searches persisted log lines, newest first; page with before=<smallest id>.
+    try:
+        limit = min(max(int(request.args.get("limit", 200)), 1), 1000)
+        before_id = int(request.args["before"]) if request.args.get("before") else None
+    except ValueError:
+        return ("Invalid limit/before", 400)
+    start = normalize_time(request.args.get("start"))
+    end = normalize_time(request.args.get("end"), end=True)
+    if (request.args.get("start") and not start) or (request.args.get("end") and not end):
+        return ("Invalid start/end; use YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS", 400)
+    with db() as conn:
+        entries = search_logs(
+            conn,
+            job=request.args.get("job"),
+            start=start,
+            end=end,
+            text=request.args.get("q"),
+            before_id=before_id,
+            limit=limit,
+        )
+    return jsonify({"entries": entries, "next_before": entries[-1]["id"] if len(entries) == limit else None})
+
+
+def parse_metric_time(value, default):
+    # Epoch seconds, an ISO date/time, or seconds relative to now ("-3600").
+    if not value:
+        return default
+    try:
+        number = float(value)
+        return time.time() + number if value.startswith("-") else number
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        return None
+
+
+@app.route("/api/metrics")
+def api_metrics():
+    return jsonify(worker_call("metrics"))
+
+
+def metrics_summary():
+    return {**metrics_store.describe(), "latest": metrics_store.latest()}
+
+
+@app.route("/api/metrics/<metric>")
+def api_metric_series(metric):
+    if metric not in metrics_store.series:
+        return ("Unknown metric", 404)
+    now = time.time()
+    start = parse_metric_time(request.args.get("start"), now - 600)
+    end = parse_metric_time(request.args.get("end"), now)
+    tier = request.args.get("tier")
+    if start is None or end is None:
+        return ("Invalid start/end", 400)
+    if tier and tier not in metrics_store.series[metric]:
+        return ("Unknown tier", 400)
+    return jsonify(worker_call("metric_series", metric=metric, start=start, end=end, tier=tier))
+
+
+def metric_series(metric, start, end, tier):
+    return metrics_store.query(metric, start, end, tier)
+
+
+@app.route("/metrics")
+def prometheus_metrics():
+    return Response(worker_call("prometheus"), content_type=PROMETHEUS_CONTENT_TYPE)
+
+
+def prometheus_text():
+    for method_id, state in method_state.items():
+        backup_metrics.running.set(1 if state["running"] else 0, job=method_id)
+    backup_metrics.active_transfers.set(active_transfers.value)
+    return backup_metrics.render()
+
+
 @app.route("/api/run/<method_id>", methods=["POST"])
 def run(method_id):
     if method_id not in method_state:
         return ("Unknown method", 400)
-    if method_state[method_id]["running"]:
-        return ("", 204)
-    if method_id == "sftp":
-        threading.Thread(target=run_sftp_backup, args=("sftp", get_sftp_config())).start()
-    elif method_id == "ssh":
-        threading.Thread(target=run_ssh_backup).start()
-    elif method_id == "cpanel":
-        threading.Thread(target=run_cpanel_backup).start()
-    return ("", 204)
+    entry = worker_call("submit", job=method_id, source="manual")
+    if not entry["deduplicated"]:
+        add_log(f"[{method_id.upper()}] Run queued.")
+    return jsonify(entry), 202
+
+
+def submit_run(job, source):
+    entry, deduplicated = job_executor.submit(job, source)
+    return {"id": entry["id"], "deduplicated": deduplicated}
 
 
 @app.route("/api/stop/<method_id>", methods=["POST"])
 def stop(method_id):
     if method_id not in method_state:
         return ("Unknown method", 400)
-    if method_state[method_id]["running"]:
-        method_state[method_id]["stop_event"].set()
-        add_log(f"[{method_id.upper()}] Stopping backup process requested by user...")
+    worker_call("stop", job=method_id)
+    return ("", 204)
+
+
+def stop_run(job):
+    # Also drops a queued run, so it does not start straight after stopping.
+    if job_executor.cancel(job=job):
+        add_log(f"[{job.upper()}] Queued run cancelled.")
+    if method_state[job]["running"]:
+        method_state[job]["stop_event"].set()
+        add_log(f"[{job.upper()}] Stopping backup process requested by user...")
+
+
+@app.route("/api/queue")
+def api_queue():
+    with db() as conn:
+        return jsonify(describe_queue(conn, queue_summary()))
+
+
+@app.route("/api/queue/<int:entry_id>", methods=["DELETE"])
+def cancel_queued(entry_id):
+    if not worker_call("cancel", entry_id=entry_id):
+        return ("Not queued", 404)
     return ("", 204)
 
 
+def cancel_runs(entry_id=None, job=None):
+    return job_executor.cancel(entry_id=entry_id, job=job)
+
+
 @app.route("/api/list_archives")
 def list_archives():
-    files = []
-    if os.path.exists(BASE_DIR):
-        for f in os.listdir(BASE_DIR):
-            if f.endswith(".tar.gz"):
-                path = os.path.join(BASE_DIR, f)
-                stats = os.stat(path)
-                size_mb = round(stats.st_size / (1024 * 1024), 2)
-                created = datetime.fromtimestamp(stats.st_mtime).strftime("%Y-%m-%d %H:%M")
-                files.append({"filename": f, "size": f"{size_mb} MB", "created": created})
-    files.sort(key=lambda x: x["created"], reverse=True)
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT filename, job_type FROM downloads")
-    job_map = {row[0]: row[1] for row in c.fetchall()}
-    conn.close()
+    # Served from the archives catalog: ?page=&per_page=&sort=created|size|
+    # filename|job|files&order=asc|desc&job=&q=&start=&end=
+    page = max(1, request.args.get("page", default=1, type=int))
+    per_page = max(1, min(MAX_PAGE_SIZE, request.args.get("per_page", default=DEFAULT_PAGE_SIZE, type=int)))
+    with db() as conn:
+        rows, total = query_archives(
+            conn,
+            job=request.args.get("job"),
+            text=request.args.get("q"),
+            start=normalize_time(request.args.get("start")),
+            end=normalize_time(request.args.get("end"), end=True),
+            sort=request.args.get("sort", "created"),
+            order=request.args.get("order", "desc"),
+            limit=per_page,
+            offset=(page - 1) * per_page,
+        )
     return jsonify(
-        [
-            {
-                **file_info,
-                "job": job_map.get(file_info["filename"], "Unknown"),
-            }
-            for file_info in files
-        ]
+        {
+            "items": [
+                {
+                    **row,
+                    "size": f"{round(row['size'] / (1024 * 1024), 2)} MB",
+                    "size_bytes": row["size"],
+                    "created": row["created"][:16],
+                    "job": row["job"] or "Unknown",
+                }
+                for row in rows
+            ],
+            "total": total,
+            "page": page,
+            "per_page": per_page,
+        }
     )
 
 
@@ -626,9 +1653,28 @@ def list_archives():
 def download_archive(filename):
     if ".." in filename or "/" in filename:
         return "Invalid filename", 400
+    if not os.path.exists(os.path.join(BASE_DIR, filename)):
+        with db() as conn:
+            found = snapshot_exists(conn, filename)
+        if found:
+            return stream_snapshot(filename)
     return send_from_directory(BASE_DIR, filename, as_attachment=True)
 
 
+def stream_snapshot(filename):
+    def build(tar):
+        with db() as conn:
+            snapshot = load_snapshot(conn, filename)
+        export_snapshot(CHUNK_STORE_DIR, snapshot, tar)
+
+    add_log(f"[ARCHIVE] Exporting snapshot {filename}")
+    return Response(
+        stream_with_context(iter_archive(build, "gzip")),
+        mimetype="application/gzip",
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
+
+
 @app.route("/api/archives/<filename>", methods=["DELETE"])
 def delete_archive(filename):
     if ".." in filename or "/" in filename:
@@ -636,105 +1682,419 @@ def delete_archive(filename):
     full_path = os.path.join(BASE_DIR, filename)
     if os.path.exists(full_path):
         os.remove(full_path)
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("DELETE FROM downloads WHERE filename = ?", (filename,))
-    conn.commit()
-    conn.close()
+    with db() as conn:
+        delete_snapshot(conn, CHUNK_STORE_DIR, filename)
+        remove_archive(conn, filename)
+        conn.execute("DELETE FROM downloads WHERE filename = ?", (filename,))
+    events.publish("dl_stats", download_counts())
     add_log(f"[ARCHIVE] Deleted {filename}")
     return ("", 204)
 
 
+@app.route("/api/archives/search")
+def search_archives():
+    # Files inside archives: ?name= (file name prefix) and/or ?path= (path
+    # substring), plus job=&start=&end=&page=&per_page=
+    name = (request.args.get("name") or "").strip()
+    path = (request.args.get("path") or "").strip()
+    if not name and not path:
+        return jsonify({"error": "name or path is required"}), 400
+    page = max(1, request.args.get("page", default=1, type=int))
+    per_page = max(1, min(MAX_PAGE_SIZE, request.args.get("per_page", default=DEFAULT_PAGE_SIZE, type=int)))
+    with db() as conn:
+        rows, total = search_members(
+            conn,
+            name=name,
+            path=path,
+            job=request.args.get("job"),
+            start=normalize_time(request.args.get("start")),
+            end=normalize_time(request.args.get("end"), end=True),
+            limit=per_page,
+            offset=(page - 1) * per_page,
+        )
+    for row in rows:
+        row["created"] = row["created"][:16]
+    return jsonify({"items": rows, "total": total, "page": page, "per_page": per_page})
+
+
+@app.route("/api/archives/<filename>/member")
+def download_member(filename):
+    # One file out of an archive, ?path= as listed by /api/archives/search.
+    # Only the compressed blocks from the one holding the file onwards are
+    # read, not the whole archive.
+    if ".." in filename or "/" in filename:
+        return "Invalid filename", 400
+    path = request.args.get("path") or ""
+    with db() as conn:
+        archive = get_archive(conn, filename)
+        member = get_member(conn, filename, path) if archive else None
+        snapshot = archive and archive["storage"] == "chunkstore"
+        entry = load_entry(conn, filename, path) if member and snapshot else None
+        blocks = get_blocks(conn, filename) if member and not snapshot else []
+    if not member:
+        return jsonify({"error": "File not found in the archive index"}), 404
+    if snapshot:
+        if not entry:
+            return jsonify({"error": "Snapshot not found"}), 404
+        reader = ChunkReader(CHUNK_STORE_DIR, entry[1])
+        chunks = iter(lambda: reader.read(READ_CHUNK), b"")
+    else:
+        full_path = os.path.join(BASE_DIR, filename)
+        if not os.path.exists(full_path) or member["offset"] is None:
+            return jsonify({"error": "Archive file not found"}), 404
+
+        def chunks():
+            with open(full_path, "rb") as f:
+                yield from read_member(f, archive_codec(filename), blocks, member["offset"], member["size"])
+
+        chunks = chunks()
+    add_log(f"[ARCHIVE] Extracting {path} from {filename}")
+    return Response(
+        stream_with_context(chunks),
+        mimetype="application/octet-stream",
+        headers={
+            "Content-Disposition": f"attachment; filename={os.path.basename(path)}",
+            "Content-Length": str(member["size"]),
+        },
+    )
+
+
 @app.route("/api/archives/restore", methods=["POST"])
 def restore_archive():
+    # {filename, target?, remote_path?, paths?, dry_run?, skip_unchanged?}.
+    # target defaults to the job that took the archive, remote_path to its
+    # configured remote path; paths limits the restore to those files/folders.
     data = request.json or {}
     filename = data.get("filename", "")
-    add_log(f"[ARCHIVE] Restore requested for {filename}")
-    return ("", 204)
+    if not filename or ".." in filename or "/" in filename:
+        return "Invalid filename", 400
+    body, status = worker_call("start_restore", data=data)
+    return (jsonify(body) if isinstance(body, dict) else body), status
+
+
+def start_restore(data):
+    # Returns (body, status) for the endpoint above.
+    filename = data["filename"]
+    with db() as conn:
+        archive = get_archive(conn, filename)
+    if not archive or (archive["storage"] != "chunkstore" and not os.path.exists(os.path.join(BASE_DIR, filename))):
+        return "Unknown archive", 404
+    target = data.get("target") or archive["job"]
+    method, config = job_config(target)
+    if method not in RESTORE_METHODS or not config.get("host"):
+        return "Restores need a configured SFTP or SSH target", 400
+    busy = any(s["target"] == target and s["status"] in ("queued", "running") for s in restores.values())
+    if busy or method_state[target]["running"]:
+        return "Target is busy", 409
+    with events.lock:
+        restore_ids[0] += 1
+        restore_id = restore_ids[0]
+        restores[restore_id] = {
+            "id": restore_id,
+            "filename": filename,
+            "storage": archive["storage"],
+            "archive_size": archive["size"],
+            "target": target,
+            "remote_path": data.get("remote_path") or config.get("remote_path") or ".",
+            "paths": normalize_paths(data.get("paths")),
+            "dry_run": bool(data.get("dry_run")),
+            "skip_unchanged": bool(data.get("skip_unchanged", True)),
+            "status": "queued",
+            "result": None,
+            "transfer": None,
+            "diff": None,
+            "created": time.time(),
+            "started": None,
+            "finished": None,
+            "stop_event": threading.Event(),
+            "tracker": ProgressTracker(),
+            "source": None,
+        }
+        trim_restores()
+        events.publish("restore", public_restore(restores[restore_id]))
+    threading.Thread(target=run_restore, args=(restore_id, config), daemon=True).start()
+    return {"id": restore_id}, 202
+
 
+@app.route("/api/archives/restore")
+def list_restores():
+    return jsonify([public_restore(state) for state in sorted(restores.values(), key=lambda s: -s["id"])])
 
-def serialize_schedule(schedule_id, job_type, hour, minute, days):
-    days_list = days.split(",") if days else []
-    tz = ZoneInfo(TZ)
-    trigger = CronTrigger(day_of_week=days, hour=hour, minute=minute, timezone=TZ)
-    next_run = trigger.get_next_fire_time(None, datetime.now(tz))
-    next_run_str = next_run.astimezone(tz).strftime("%Y-%m-%d %H:%M") if next_run else ""
+
+@app.route("/api/archives/restore/<int:restore_id>", methods=["GET", "DELETE"])
+def restore_detail(restore_id):
+    state = restores.get(restore_id)
+    if not state:
+        return ("Unknown restore", 404)
+    if request.method == "DELETE":
+        worker_call("stop_restore", restore_id=restore_id)
+        return ("", 204)
+    return jsonify(public_restore(state))
+
+
+def stop_restore(restore_id):
+    state = restores.get(restore_id)
+    if state and state["status"] in ("queued", "running"):
+        state["stop_event"].set()
+        add_log(f"[RESTORE] Stop requested for restore #{restore_id}.")
+
+
+def trim_restores():
+    finished = sorted(i for i, s in restores.items() if s["status"] not in ("queued", "running"))
+    for old_id in finished[: max(0, len(restores) - RESTORE_HISTORY)]:
+        del restores[old_id]
+
+
+def public_restore(state):
+    return {key: value for key, value in state.items() if key not in ("stop_event", "tracker", "source")}
+
+
+def set_restore_state(restore_id, **updates):
+    state = restores[restore_id]
+    with events.lock:
+        before = public_restore(state)
+        state.update(updates)
+        after = public_restore(state)
+        if after != before:
+            events.publish("restore", after)
+
+
+def restore_progress(state):
+    snap = state["tracker"].snapshot()
+    source = state.get("source")
+    # A tar stream's uncompressed size is unknown until the end; how far into
+    # the archive file the reader is stands in for it.
+    if snap["percent"] is None and source and state["archive_size"]:
+        try:
+            fraction = min(1.0, source.tell() / state["archive_size"])
+        except (OSError, ValueError):
+            fraction = 0
+        if fraction:
+            snap["percent"] = round(fraction * 100, 1)
+            snap["eta"] = int((time.time() - state["started"]) * (1 - fraction) / fraction)
+    return snap
+
+
+@contextmanager
+def restore_members(state):
+    stop_event = state["stop_event"]
+    if state["storage"] == "chunkstore":
+        with db() as conn:
+            snapshot = load_snapshot(conn, state["filename"])
+        state["tracker"].start(*snapshot_totals(snapshot, state["paths"]))
+        yield snapshot_members(CHUNK_STORE_DIR, snapshot, stop_event)
+        return
+    with open(os.path.join(BASE_DIR, state["filename"]), "rb") as raw:
+        state["source"] = raw
+        try:
+            with read_archive(raw, archive_codec(state["filename"])) as tar:
+                yield archive_members(tar, stop_event)
+        finally:
+            state["source"] = None
+
+
+def run_restore(restore_id, config):
+    state = restores[restore_id]
+    stop_event = state["stop_event"]
+    log = lambda msg: add_log(f"[RESTORE] {msg}")
+    action = "Dry run" if state["dry_run"] else "Restore"
+    set_restore_state(restore_id, status="running", started=time.time())
+    log(f"{action} of {state['filename']} to {state['target']}:{state['remote_path']} started.")
+    transport = None
+    pooled = None
+    broken = False
+    try:
+        transport, pooled = connect_remote(state["target"], config)
+        remote = None
+        if state["dry_run"] or state["skip_unchanged"]:
+            log("Listing remote tree...")
+            remote = remote_files(transport, state["remote_path"], stop_event, log)
+        with restore_members(state) as members:
+            if state["dry_run"]:
+                diff = diff_tree(members, remote, state["paths"])
+                result = (
+                    f"{diff['create']['count']} new, {diff['overwrite']['count']} changed, "
+                    f"{diff['unchanged']['count']} unchanged, {diff['remote_only']['count']} only on remote"
+                )
+                set_restore_state(restore_id, diff=diff)
+            else:
+                stats = restore_tree(
+                    transport,
+                    members,
+                    state["remote_path"],
+                    stop_event,
+                    workers=config.get("workers") or DEFAULT_WORKERS,
+                    log=log,
+                    paths=state["paths"],
+                    remote=remote,
+                    progress=state["tracker"],
+                )
+                result = (
+                    f"{stats.files} restored ({round(stats.bytes/1024/1024, 2)} MB), "
+                    f"{stats.skipped} unchanged, {stats.failed} failed"
+                )
+                set_restore_state(restore_id, transfer=restore_progress(state))
+        if stop_event.is_set():
+            status, result = "stopped", f"Stopped: {result}"
+        else:
+            status = "failed" if not state["dry_run"] and stats.failed else "done"
+    except Exception as e:
+        broken = True
+        status, result = "failed", f"Failed: {str(e)}"
+    finally:
+        if transport:
+            ssh_pool.release(transport, pooled, broken=broken or stop_event.is_set())
+    log(f"{action} #{restore_id} {status}: {result}")
+    set_restore_state(restore_id, status=status, result=result, finished=time.time())
+    if not state["dry_run"]:
+        send_notification(f"Restore of {state['filename']} {status}", result)
+
+
+def serialize_schedule(row, offset, now):
+    schedule_id, job_type, hour, minute, days, jitter, _ = row
+    # Includes the stagger offset; jitter may add up to jitter seconds more.
+    next_run = next_runs.get(days, hour, minute, offset, now) if days else None
     return {
         "id": schedule_id,
         "job_type": job_type,
         "hour": hour,
         "minute": minute,
-        "days": days_list,
-        "next_run": next_run_str,
+        "days": days.split(",") if days else [],
+        "jitter": jitter or 0,
+        "offset": offset,
+        "next_run": next_run.astimezone(now.tzinfo).strftime("%Y-%m-%d %H:%M:%S") if next_run else "",
     }
 
 
+def schedule_fields(data):
+    # (job_type, hour, minute, days, jitter) from a POST/PUT body.
+    job_type = data.get("job_type", "sftp")
+    if job_type not in method_state:
+        raise ScheduleError("Unknown job type")
+    days = ",".join(data.get("days") or ALL_DAYS)
+    return job_type, data["hour"], data["minute"], days, normalize_jitter(data.get("jitter"))
+
+
 @app.route("/api/schedules", methods=["GET", "POST"])
 def api_schedules():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-
     if request.method == "POST":
-        data = request.json
-        job_type = data.get("job_type", "sftp")
-        days_list = data.get("days") or []
-        if not days_list:
-            days_list = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
-        days = ",".join(days_list)
-        c.execute(
-            "INSERT INTO schedules (job_type, hour, minute, days) VALUES (?, ?, ?, ?)",
-            (job_type, data["hour"], data["minute"], days),
-        )
-        conn.commit()
-        conn.close()
-        load_schedules_from_db()
+        try:
+            fields = schedule_fields(request.json)
+        except ScheduleError as e:
+            return (str(e), 400)
+        with db() as conn:
+            conn.execute(
+                "INSERT INTO schedules (job_type, hour, minute, days, jitter, last_fire) VALUES (?, ?, ?, ?, ?, ?)",
+                (*fields, time.time()),
+            )
+        worker_call("reload_schedules")
         return ("", 204)
 
-    c.execute("SELECT id, job_type, hour, minute, days FROM schedules ORDER BY id DESC")
-    rows = c.fetchall()
-    conn.close()
-    return jsonify([serialize_schedule(*row) for row in rows])
+    with db() as conn:
+        rows = schedule_rows(conn)
+    offsets = schedule_sync.offsets(rows)
+    now = datetime.now(ZoneInfo(TZ))
+    return jsonify([serialize_schedule(row, offsets[row[0]], now) for row in rows])
 
 
 @app.route("/api/schedules/<int:schedule_id>", methods=["PUT", "DELETE"])
 def api_schedule_detail(schedule_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
     if request.method == "PUT":
-        data = request.json
-        days_list = data.get("days") or []
-        if not days_list:
-            days_list = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
-        days = ",".join(days_list)
-        c.execute(
-            "UPDATE schedules SET job_type = ?, hour = ?, minute = ?, days = ? WHERE id = ?",
-            (data["job_type"], data["hour"], data["minute"], days, schedule_id),
-        )
-        conn.commit()
-        conn.close()
-        load_schedules_from_db()
+        try:
+            fields = schedule_fields(request.json)
+        except ScheduleError as e:
+            return (str(e), 400)
+        with db() as conn:
+            conn.execute(
+                "UPDATE schedules SET job_type = ?, hour = ?, minute = ?, days = ?, jitter = ?, last_fire = ? "
+                "WHERE id = ?",
+                (*fields, time.time(), schedule_id),
+            )
+        worker_call("reload_schedules")
         return ("", 204)
 
-    c.execute("DELETE FROM schedules WHERE id = ?", (schedule_id,))
-    conn.commit()
-    conn.close()
-    load_schedules_from_db()
+    with db() as conn:
+        conn.execute("DELETE FROM schedules WHERE id = ?", (schedule_id,))
+    worker_call("reload_schedules")
+    return ("", 204)
+
+
+@app.route("/api/targets", methods=["GET", "POST"])
+def api_targets():
+    if request.method == "POST":
+        d = request.json or {}
+        name = (d.get("name") or "").strip().lower()
+        method = d.get("method", "sftp")
+        try:
+            validate_name(name, reserved=BUILTIN_METHODS)
+            if method not in TARGET_METHODS:
+                raise TargetError(f"Unknown method '{method}'.")
+        except TargetError as e:
+            return (str(e), 400)
+        prev = get_target_config(name)
+        if prev and prev["method"] == method:
+            # Secrets are not sent back by GET, so keep them unless replaced.
+            config = target_config(method, {k: v for k, v in d.items() if v != ""}, prev["config"])
+        else:
+            config = target_config(method, d)
+        with db() as conn:
+            save_target(conn, name, method, config, d.get("enabled", True))
+        invalidate_config(f"target:{name}")
+        with events.lock:
+            method_state.setdefault(name, new_method_state())
+        publish_targets()
+        add_log(f"[{name.upper()}] Site {'updated' if prev else 'added'} ({method}).")
+        return jsonify(public_target(get_target_config(name))), 200 if prev else 201
+
+    with db() as conn:
+        targets = list_targets(conn)
+    return jsonify([public_target(target) for target in targets])
+
+
+@app.route("/api/targets/<name>", methods=["GET", "DELETE"])
+def api_target_detail(name):
+    target = get_target_config(name)
+    if not target:
+        return ("Unknown site", 404)
+    if request.method == "GET":
+        return jsonify(public_target(target))
+    if method_state.get(name, {}).get("running"):
+        return ("Site is running a backup", 409)
+    # Archives already taken are kept; they stay listed under this job name.
+    worker_call("cancel", job=name)
+    with db() as conn:
+        delete_target(conn, name)
+        conn.execute("DELETE FROM schedules WHERE job_type = ?", (name,))
+    invalidate_config(f"target:{name}")
+    with events.lock:
+        method_state.pop(name, None)
+    publish_targets()
+    worker_call("reload_schedules")
+    add_log(f"[{name.upper()}] Site removed.")
     return ("", 204)
 
 
 @app.route("/api/smtp", methods=["GET", "POST"])
 def api_smtp():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
     if request.method == "POST":
         d = request.json
-        c.execute("DELETE FROM smtp_config")
-        c.execute(
-            "INSERT INTO smtp_config (host, port, user, password, from_addr, to_addr) VALUES (?,?,?,?,?,?)",
-            (d["host"], d["port"], d["user"], d["password"], d["from_addr"], d["to_addr"]),
-        )
-        conn.commit()
-        conn.close()
+        with db() as conn:
+            c = conn.cursor()
+            c.execute("DELETE FROM smtp_config")
+            c.execute(
+                "INSERT INTO smtp_config (host, port, user, password, from_addr, to_addr, digest_minutes) "
+                "VALUES (?,?,?,?,?,?,?)",
+                (
+                    d["host"],
+                    d["port"],
+                    d["user"],
+                    d["password"],
+                    d["from_addr"],
+                    d["to_addr"],
+                    max(0, int(d.get("digest_minutes") or 0)),
+                ),
+            )
+        invalidate_config("smtp")
         return ("", 204)
     conf = get_smtp_config()
     return jsonify(conf if conf else {})
@@ -742,17 +2102,30 @@ def api_smtp():
 
 @app.route("/api/config/sftp", methods=["GET", "POST"])
 def api_sftp_config():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
     if request.method == "POST":
         d = request.json
-        c.execute("DELETE FROM sftp_config")
-        c.execute(
-            "INSERT INTO sftp_config (host, port, user, password, remote_path) VALUES (?,?,?,?,?)",
-            (d["host"], d["port"], d["user"], d["password"], d.get("remote_path", ".")),
-        )
-        conn.commit()
-        conn.close()
+        prev = get_sftp_config()
+        with db() as conn:
+            c = conn.cursor()
+            c.execute("DELETE FROM sftp_config")
+            c.execute(
+                "INSERT INTO sftp_config (host, port, user, password, remote_path, workers, incremental, archive_mode, "
+                "compression, compression_level, compression_threads, storage, prescan) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)",
+                (
+                    d["host"],
+                    d["port"],
+                    d["user"],
+                    d["password"],
+                    d.get("remote_path", "."),
+                    clamp_workers(d.get("workers", prev["workers"])),
+                    int(bool(d.get("incremental", prev["incremental"]))),
+                    normalize_archive_mode(d.get("archive_mode", prev["archive_mode"])),
+                    *compression_values(d, prev),
+                    normalize_storage(d.get("storage", prev["storage"])),
+                    int(bool(d.get("prescan", prev["prescan"]))),
+                ),
+            )
+        invalidate_config("sftp")
         return ("", 204)
     conf = get_sftp_config()
     return jsonify(conf)
@@ -760,17 +2133,32 @@ def api_sftp_config():
 
 @app.route("/api/config/ssh", methods=["GET", "POST"])
 def api_ssh_config():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
     if request.method == "POST":
         d = request.json
-        c.execute("DELETE FROM ssh_config")
-        c.execute(
-            "INSERT INTO ssh_config (host, port, user, password, key, remote_path) VALUES (?,?,?,?,?,?)",
-            (d["host"], d["port"], d["user"], d.get("password"), d.get("key"), d.get("remote_path", ".")),
-        )
-        conn.commit()
-        conn.close()
+        prev = get_ssh_config()
+        with db() as conn:
+            c = conn.cursor()
+            c.execute("DELETE FROM ssh_config")
+            c.execute(
+                "INSERT INTO ssh_config (host, port, user, password, key, remote_path, workers, incremental, archive_mode, "
+                "compression, compression_level, compression_threads, transfer_mode, storage, prescan) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
+                (
+                    d["host"],
+                    d["port"],
+                    d["user"],
+                    d.get("password"),
+                    d.get("key"),
+                    d.get("remote_path", "."),
+                    clamp_workers(d.get("workers", prev["workers"])),
+                    int(bool(d.get("incremental", prev["incremental"]))),
+                    normalize_archive_mode(d.get("archive_mode", prev["archive_mode"])),
+                    *compression_values(d, prev),
+                    normalize_transfer_mode(d.get("transfer_mode", prev["transfer_mode"])),
+                    normalize_storage(d.get("storage", prev["storage"])),
+                    int(bool(d.get("prescan", prev["prescan"]))),
+                ),
+            )
+        invalidate_config("ssh")
         return ("", 204)
     conf = get_ssh_config()
     return jsonify(conf)
@@ -778,17 +2166,18 @@ def api_ssh_config():
 
 @app.route("/api/config/cpanel", methods=["GET", "POST"])
 def api_cpanel_config():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
     if request.method == "POST":
         d = request.json
-        c.execute("DELETE FROM cpanel_config")
-        c.execute(
-            "INSERT INTO cpanel_config (host, port, user, token, password) VALUES (?,?,?,?,?)",
-            (d["host"], d["port"], d["user"], d.get("token"), d.get("password")),
-        )
-        conn.commit()
-        conn.close()
+        prev = get_cpanel_config()
+        with db() as conn:
+            c = conn.cursor()
+            c.execute("DELETE FROM cpanel_config")
+            c.execute(
+                "INSERT INTO cpanel_config (host, port, user, token, password, compression, compression_level, "
+                "compression_threads) VALUES (?,?,?,?,?,?,?,?)",
+                (d["host"], d["port"], d["user"], d.get("token"), d.get("password"), *compression_values(d, prev)),
+            )
+        invalidate_config("cpanel")
         return ("", 204)
     conf = get_cpanel_config()
     return jsonify(conf)
@@ -799,11 +2188,10 @@ def api_login():
     data = request.json or {}
     username = data.get("username", "")
     password = data.get("password", "")
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT password_hash FROM auth_user WHERE username = ?", (username,))
-    row = c.fetchone()
-    conn.close()
+    with db() as conn:
+        c = conn.cursor()
+        c.execute("SELECT password_hash FROM auth_user WHERE username = ?", (username,))
+        row = c.fetchone()
     if row and check_password_hash(row[0], password):
         return jsonify({"ok": True})
     return ("Unauthorized", 401)
@@ -815,19 +2203,16 @@ def api_change_password():
     username = data.get("username", DEFAULT_ADMIN_USER)
     current_password = data.get("currentPassword", "")
     new_password = data.get("newPassword", "")
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT password_hash FROM auth_user WHERE username = ?", (username,))
-    row = c.fetchone()
-    if not row or not check_password_hash(row[0], current_password):
-        conn.close()
-        return ("Unauthorized", 401)
-    c.execute(
-        "UPDATE auth_user SET password_hash = ? WHERE username = ?",
-        (generate_password_hash(new_password), username),
-    )
-    conn.commit()
-    conn.close()
+    with db() as conn:
+        c = conn.cursor()
+        c.execute("SELECT password_hash FROM auth_user WHERE username = ?", (username,))
+        row = c.fetchone()
+        if not row or not check_password_hash(row[0], current_password):
+            return ("Unauthorized", 401)
+        c.execute(
+            "UPDATE auth_user SET password_hash = ? WHERE username = ?",
+            (generate_password_hash(new_password), username),
+        )
     return ("", 204)
 
 
@@ -835,48 +2220,29 @@ def api_change_password():
 def api_ssh_test():
     data = request.json or {}
     config = {**get_ssh_config(), **data}
-    client = paramiko.SSHClient()
-    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
     try:
-        pkey = None
-        if config.get("key"):
-            pkey = paramiko.RSAKey.from_private_key(io.StringIO(config["key"]))
-        client.connect(
-            config["host"],
-            port=config.get("port") or 22,
-            username=config["user"],
-            password=config.get("password") or None,
-            pkey=pkey,
-            timeout=10,
-        )
-        stdin, stdout, stderr = client.exec_command("echo ok")
-        stdout.read()
+        with ssh_pool.transport(config) as transport:
+            channel = transport.open_session(timeout=10)
+            try:
+                channel.exec_command("echo ok")
+                channel.makefile("rb").read()
+            finally:
+                channel.close()
         return jsonify({"ok": True})
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 400
-    finally:
-        client.close()
 
 
 @app.route("/api/sftp/test", methods=["POST"])
 def api_sftp_test():
     data = request.json or {}
     config = {**get_sftp_config(), **data}
-    transport = None
-    sftp = None
     try:
-        transport = paramiko.Transport((config["host"], config["port"]))
-        transport.connect(username=config["user"], password=config["password"])
-        sftp = paramiko.SFTPClient.from_transport(transport)
-        sftp.listdir(".")
+        with ssh_pool.sftp(config) as sftp:
+            sftp.listdir(".")
         return jsonify({"ok": True})
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 400
-    finally:
-        if sftp:
-            sftp.close()
-        if transport:
-            transport.close()
 
 
 @app.route("/api/cpanel/test", methods=["POST"])
@@ -901,6 +2267,185 @@ def api_cpanel_test():
         return jsonify({"ok": False, "error": str(e)}), 400
 
 
+# --- Process Roles ---
+
+
+def worker_call(command, **args):
+    # Backup work belongs to the process running the job executor; a web
+    # worker sends it there and waits for the result.
+    if events.mirrored:
+        return commands.call(command, **args)
+    return COMMANDS[command](**args)
+
+
+@app.errorhandler(WorkerUnavailable)
+def worker_unavailable(e):
+    return jsonify({"error": str(e)}), 503
+
+
+def shared_snapshot():
+    # Stored by the worker every few seconds for web workers that start
+    # later; see seed_shared().
+    return {
+        "methods": {method_id: public_method_state(state) for method_id, state in method_state.items()},
+        "cpu_history": list(cpu_history),
+        "queue": job_executor.summary(),
+        "restores": [public_restore(state) for state in restores.values()],
+    }
+
+
+def seed_shared(snapshot, last_id, logs):
+    # Web workers: the state as of relay id last_id, and the log lines
+    # relayed before it.
+    log_buffer.clear(logs[0][0] - 1 if logs else last_id)
+    for event_id, _, data in logs:
+        append_log(data["time"], data["message"], event_id)
+    if snapshot:
+        for method_id, state in snapshot["methods"].items():
+            method_state.setdefault(method_id, new_method_state()).update(state)
+        cpu_history[:] = snapshot["cpu_history"]
+        shared_queue[0] = snapshot["queue"]
+        restores.clear()
+        restores.update((state["id"], state) for state in snapshot["restores"])
+    events.reset(last_id)
+
+
+def apply_shared(event_id, kind, data):
+    # A relay row from another process; web workers also get their own,
+    # since their events only reach clients this way.
+    if kind == "config":
+        clear_config(data["names"])
+        return
+    if kind == "log":
+        if events.mirrored:
+            append_log(data["time"], data["message"], event_id)
+        else:
+            append_log(data["time"], data["message"], forward=False)
+        return
+    if kind == "targets":
+        sync_methods(data["methods"])
+    if not events.mirrored:
+        return
+    if kind == "method_state":
+        state = method_state.setdefault(data["method"], new_method_state())
+        state.update({key: data[key] for key in ("running", "progress", "last_result", "transfer")})
+    elif kind == "cpu":
+        cpu_history.append(data)
+        if len(cpu_history) > 40:
+            cpu_history.pop(0)
+    elif kind == "queue":
+        shared_queue[0] = data
+    elif kind == "restore":
+        restores[data["id"]] = data
+        trim_restores()
+    events.mirror(event_id, kind, data)
+
+
+def sync_methods(methods):
+    # Sites added or removed through another process.
+    with events.lock:
+        for name in methods:
+            method_state.setdefault(name, new_method_state())
+        for name in [name for name in method_state if name not in methods]:
+            if not method_state[name]["running"]:
+                del method_state[name]
+
+
+COMMANDS = {
+    "submit": submit_run,
+    "stop": stop_run,
+    "cancel": cancel_runs,
+    "reload_schedules": load_schedules_from_db,
+    "start_restore": start_restore,
+    "stop_restore": stop_restore,
+    "metrics": metrics_summary,
+    "metric_series": metric_series,
+    "prometheus": prometheus_text,
+}
+relay = Relay(db, apply_shared, events.lock, replay=("log",), replay_limit=LOG_BUFFER_LINES, log=add_log)
+commands = CommandChannel(db, COMMANDS, log=add_log)
+
+
+def create_app(role=None):
+    # Sets up the database and starts what role is responsible for, then
+    # returns the Flask app; importing this module starts nothing. A "web"
+    # process starts its relay on its first request instead, since gunicorn
+    # forks the web workers after loading the app (see wsgi.py).
+    role = role or ROLE
+    if role not in ROLES:
+        raise ValueError(f"Unknown role '{role}'; expected one of: {', '.join(ROLES)}.")
+    with services_lock:
+        if services["role"] is not None:
+            if services["role"] != role:
+                raise RuntimeError(f"Already started as '{services['role']}'.")
+            return app
+        services["role"] = role
+        init_db()
+        ensure_default_user()
+        load_target_states()
+        atexit.register(ssh_pool.close)
+        if role == "web":
+            events.forward = relay.send
+            events.mirrored = True
+            # Forked workers must not inherit open SQLite connections.
+            get_pool(DB_PATH).close()
+        else:
+            start_services(role)
+    return app
+
+
+def start_services(role):
+    services["pid"] = os.getpid()
+    if role == "worker":
+        events.forward = relay.send
+        relay.start(snapshot=shared_snapshot)
+        commands.start()
+        atexit.register(relay.close)
+        atexit.register(commands.close)
+    log_writer.start()
+    atexit.register(log_writer.close)
+    notifier.start()
+    atexit.register(notifier.close)
+    threading.Thread(target=cpu_monitor, daemon=True).start()
+    scheduler.start()
+    reconcile_catalog()
+    threading.Thread(target=index_archives, daemon=True).start()
+    index_wakeup.set()
+    job_executor.start()
+    load_schedules_from_db(catch_up=True)
+
+
+@app.before_request
+def start_web_worker():
+    if services["role"] != "web" or services["pid"] == os.getpid():
+        return
+    with services_lock:
+        if services["pid"] != os.getpid():
+            relay.start(seed=seed_shared, include_own=True)
+            atexit.register(relay.close)
+            services["pid"] = os.getpid()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backup server. For several web workers run gunicorn (wsgi.py).")
+    parser.add_argument("--role", choices=ROLES, default=ROLE)
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    args = parser.parse_args()
+    create_app(args.role)
+    if args.role != "worker":
+        app.run(host=args.host, port=args.port, threaded=True)
+        return
+    # systemd and gunicorn.conf.py stop the worker with SIGTERM; exit
+    # through atexit so the log and mail queues are flushed.
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    add_log("[SYSTEM] Worker started.")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
 if __name__ == "__main__":
-    init_db()
-    app.run(host="0.0.0.0", port=8080)
+    main()
@@ -0,0 +1,597 @@
+import argparse
+import json
+import os
+import platform
+import queue
+import random
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+import paramiko
+from paramiko import SFTPAttributes, SFTPHandle, SFTPServer, SFTPServerInterface
+
+# Transfer benchmark. Serves a synthetic WordPress-shaped tree from a local
+# paramiko SFTP/SSH server and runs the real backup functions against it:
+#
+#   python backend/bench.py --profile small --latency-ms 40 --output run.json
+#   python backend/bench.py --baseline run.json
+#
+# The server and each scenario run in their own processes, so peak RSS is the
+# backup's own and the server does not compete for the client's GIL.
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+SEED = 1337
+FIXED_MTIME = 1700000000
+BENCH_USER = "bench"
+BENCH_PASS = "bench"
+
+PROFILES = {
+    "tiny": {"plugins": 4, "depth": 3, "files_per_dir": 8, "uploads": 40, "large_files": 1, "large_mb": 8},
+    "small": {"plugins": 20, "depth": 4, "files_per_dir": 15, "uploads": 400, "large_files": 1, "large_mb": 128},
+    "wordpress": {"plugins": 60, "depth": 6, "files_per_dir": 25, "uploads": 6000, "large_files": 2, "large_mb": 2048},
+}
+
+SCENARIOS = {
+    "sftp-staged": ("sftp", {"archive_mode": "staged"}),
+    "sftp-stream": ("sftp", {"archive_mode": "stream"}),
+    "sftp-chunkstore": ("sftp", {"storage": "chunkstore"}),
+    "ssh-staged": ("ssh", {"archive_mode": "staged"}),
+    "ssh-stream": ("ssh", {"archive_mode": "stream"}),
+    "ssh-remote_tar": ("ssh", {"transfer_mode": "remote_tar"}),
+    "ssh-delta": ("ssh", {"transfer_mode": "delta"}),
+}
+DEFAULT_SCENARIOS = ("sftp-staged", "sftp-stream", "ssh-staged", "ssh-remote_tar", "ssh-delta")
+# The repeat run of these first edits the large dumps (see edited_dumps), so
+# it measures moving the changed blocks rather than skipping unchanged files.
+EDITED_REPEATS = ("ssh-delta",)
+EDIT_ROW = b"INSERT INTO wp_postmeta VALUES (0,'bench-edit');\n"
+
+# Log messages that open each phase; the run starts in "connect".
+PHASE_MARKERS = (
+    ("transfer", ("Starting File Download", "Streaming Files Into Archive", "Connected. Starting file sync")),
+    ("archive", ("Creating Timestamped Archive",)),
+    ("record", ("Archive created",)),
+)
+
+# metric -> True when higher is better
+COMPARED_METRICS = {"mb_per_s": True, "files_per_s": True, "wall_s": False, "peak_rss_mb": False}
+
+
+# --- Synthetic tree ---
+def write_text_file(path, rng, low, high):
+    words = ("wp", "post", "meta", "option", "hook", "filter", "query", "user", "term", "cache")
+    size = rng.randint(low, high)
+    lines = []
+    total = 0
+    while total < size:
+        line = f"$x_{rng.randint(0, 9999)} = {rng.choice(words)}_{rng.choice(words)}({rng.randint(0, 99999)});\n"
+        lines.append(line)
+        total += len(line)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("<?php\n" + "".join(lines))
+
+
+def write_nested(root, rng, depth, files_per_dir):
+    os.makedirs(root, exist_ok=True)
+    count = 0
+    for i in range(files_per_dir):
+        write_text_file(os.path.join(root, f"file-{i}.php"), rng, 200, 8192)
+        count += 1
+    if depth > 1:
+        for i in range(2):
+            count += write_nested(os.path.join(root, f"level{depth}-{i}"), rng, depth - 1, files_per_dir)
+    return count
+
+
+def write_large_file(path, rng, size_mb):
+    # SQL-dump-like text built from a small pool of 1 MiB blocks, each tagged
+    # with its index so no two blocks in the file are identical.
+    pool = []
+    for _ in range(8):
+        rows = []
+        total = 0
+        while total < 1024 * 1024:
+            row = f"INSERT INTO wp_postmeta VALUES ({rng.randint(1, 10**9)},'{rng.randbytes(12).hex()}');\n"
+            rows.append(row)
+            total += len(row)
+        pool.append("".join(rows).encode("utf-8")[: 1024 * 1024 - 32])
+    with open(path, "wb") as f:
+        for i in range(size_mb):
+            header = f"-- block {i:012d}\n".encode("utf-8").ljust(32, b"-")
+            f.write(header + pool[i % len(pool)])
+
+
+def build_tree(data_dir, profile):
+    spec = {"profile": profile, "seed": SEED, **PROFILES[profile]}
+    site = os.path.join(data_dir, "site")
+    marker = os.path.join(data_dir, "tree.json")
+    if os.path.exists(marker):
+        with open(marker, encoding="utf-8") as f:
+            existing = json.load(f)
+        if existing.get("spec") == spec:
+            return existing["summary"]
+    shutil.rmtree(site, ignore_errors=True)
+    rng = random.Random(SEED)
+
+    write_nested(os.path.join(site, "wp-admin"), rng, spec["depth"], spec["files_per_dir"])
+    write_nested(os.path.join(site, "wp-includes"), rng, spec["depth"], spec["files_per_dir"])
+    for i in range(spec["plugins"]):
+        write_nested(os.path.join(site, "wp-content", "plugins", f"plugin-{i}"), rng, spec["depth"], spec["files_per_dir"] // 3 + 1)
+    for i in range(spec["uploads"]):
+        folder = os.path.join(site, "wp-content", "uploads", str(2015 + i % 10), f"{i % 12 + 1:02d}")
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, f"image-{i}.jpg"), "wb") as f:
+            f.write(rng.randbytes(rng.randint(20 * 1024, 400 * 1024)))
+    large_dir = os.path.join(site, "wp-content", "backup-db")
+    os.makedirs(large_dir, exist_ok=True)
+    for i in range(spec["large_files"]):
+        write_large_file(os.path.join(large_dir, f"dump-{i}.sql"), rng, spec["large_mb"])
+    write_text_file(os.path.join(site, "wp-config.php"), rng, 2048, 4096)
+
+    files = 0
+    size = 0
+    for dirpath, _, filenames in os.walk(site):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            os.utime(path, (FIXED_MTIME, FIXED_MTIME))
+            files += 1
+            size += os.path.getsize(path)
+    summary = {"files": files, "bytes": size}
+    with open(marker, "w", encoding="utf-8") as f:
+        json.dump({"spec": spec, "summary": summary}, f)
+    return summary
+
+
+def copy_bytes(src, dst, length):
+    while length > 0:
+        data = src.read(min(1024 * 1024, length))
+        if not data:
+            break
+        dst.write(data)
+        length -= len(data)
+
+
+@contextmanager
+def edited_dumps(data_dir):
+    # Inserts a few rows halfway into each large dump and appends some more,
+    # the kind of change a daily database dump sees. The original is moved
+    # out of the served tree meanwhile and put back afterwards, mtime and all.
+    folder = os.path.join(data_dir, "site", "wp-content", "backup-db")
+    names = sorted(name for name in os.listdir(folder) if name.endswith(".sql"))
+    for name in names:
+        path, original = os.path.join(folder, name), os.path.join(data_dir, name + ".orig")
+        if os.path.exists(original):
+            # Left over from an interrupted run.
+            os.replace(original, path)
+        os.rename(path, original)
+        with open(original, "rb") as src, open(path, "wb") as dst:
+            copy_bytes(src, dst, os.path.getsize(original) // 2)
+            dst.write(EDIT_ROW * 20)
+            shutil.copyfileobj(src, dst)
+            dst.write(EDIT_ROW * 200)
+    try:
+        yield
+    finally:
+        for name in names:
+            os.replace(os.path.join(data_dir, name + ".orig"), os.path.join(folder, name))
+
+
+# --- Stub server ---
+class StubHandle(SFTPHandle):
+    def stat(self):
+        return SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+
+class StubSFTP(SFTPServerInterface):
+    # Read-only view of ROOT; enough of the protocol for the backup paths.
+    ROOT = None
+
+    def local(self, path):
+        return os.path.join(self.ROOT, os.path.normpath("/" + path).lstrip("/"))
+
+    def canonicalize(self, path):
+        return "/" + os.path.normpath("/" + path).lstrip("/")
+
+    def list_folder(self, path):
+        folder = self.local(path)
+        try:
+            entries = []
+            for name in os.listdir(folder):
+                attr = SFTPAttributes.from_stat(os.lstat(os.path.join(folder, name)))
+                attr.filename = name
+                entries.append(attr)
+            return entries
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return SFTPAttributes.from_stat(os.stat(self.local(path)))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def lstat(self, path):
+        try:
+            return SFTPAttributes.from_stat(os.lstat(self.local(path)))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def open(self, path, flags, attr):
+        try:
+            f = open(self.local(path), "rb")
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        handle = StubHandle(flags)
+        handle.readfile = f
+        handle.filename = path
+        return handle
+
+
+class StubServer(paramiko.ServerInterface):
+    def __init__(self, root):
+        self.root = root
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_auth_password(self, username, password):
+        if username == BENCH_USER and password == BENCH_PASS:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=run_exec, args=(channel, command.decode("utf-8"), self.root), daemon=True).start()
+        return True
+
+
+def run_exec(channel, command, root):
+    proc = subprocess.Popen(command, shell=True, cwd=root, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def pump_stderr():
+        for data in iter(lambda: proc.stderr.read(32768), b""):
+            channel.sendall_stderr(data)
+
+    err_thread = threading.Thread(target=pump_stderr, daemon=True)
+    err_thread.start()
+    try:
+        for data in iter(lambda: proc.stdout.read(262144), b""):
+            channel.sendall(data)
+    except OSError:
+        proc.kill()
+    err_thread.join()
+    channel.send_exit_status(proc.wait())
+    channel.close()
+
+
+def delayed_pipe(src, dst, delay):
+    # Forwards src to dst, holding each segment back by `delay` seconds. Models
+    # one-way latency without capping throughput, so pipelining still pays off.
+    pending = queue.Queue()
+
+    def send():
+        while True:
+            due, data = pending.get()
+            if data is None:
+                break
+            wait = due - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                dst.sendall(data)
+            except OSError:
+                break
+        try:
+            dst.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+    threading.Thread(target=send, daemon=True).start()
+    try:
+        while True:
+            data = src.recv(65536)
+            if not data:
+                break
+            pending.put((time.monotonic() + delay, data))
+    except OSError:
+        pass
+    pending.put((0, None))
+
+
+def serve(root, latency_ms, port=0):
+    StubSFTP.ROOT = root
+    host_key = paramiko.RSAKey.generate(2048)
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("127.0.0.1", port))
+    listener.listen(64)
+    delay = latency_ms / 2000.0
+
+    def accept_loop():
+        while True:
+            client, _ = listener.accept()
+            if delay:
+                # The transport talks to one end of a socketpair; the delay
+                # pipes sit between the other end and the real client.
+                inner, outer = socket.socketpair()
+                threading.Thread(target=delayed_pipe, args=(client, outer, delay), daemon=True).start()
+                threading.Thread(target=delayed_pipe, args=(outer, client, delay), daemon=True).start()
+                client = inner
+            transport = paramiko.Transport(client)
+            transport.add_server_key(host_key)
+            transport.set_subsystem_handler("sftp", SFTPServer, StubSFTP)
+            try:
+                transport.start_server(server=StubServer(root))
+            except (paramiko.SSHException, EOFError, OSError):
+                transport.close()
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+    return listener.getsockname()[1]
+
+
+# --- Scenario runner (child process) ---
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux and bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def phase_times(events, start, end):
+    phases = {}
+    current, since = "connect", start
+    for stamp, msg in events:
+        for phase, markers in PHASE_MARKERS:
+            if phase != current and any(marker in msg for marker in markers):
+                phases[current] = phases.get(current, 0) + stamp - since
+                current, since = phase, stamp
+                break
+    phases[current] = phases.get(current, 0) + end - since
+    return {phase: round(seconds, 3) for phase, seconds in phases.items()}
+
+
+def run_scenario(name, port, work, workers, repeat, data_dir):
+    method_id, overrides = SCENARIOS[name]
+    import app
+
+    app.BASE_DIR = work
+    app.LOCAL_DIR = os.path.join(work, "wordpress_backups")
+    app.CHUNK_STORE_DIR = os.path.join(work, "chunkstore")
+    # Only the schema: create_app() would also start the scheduler, CPU
+    # sampler and archive indexer, which would run alongside the timed backups.
+    app.init_db()
+
+    events = []
+    recorded = {}
+    add_log, log_download_stat = app.add_log, app.log_download_stat
+
+    def capture_log(msg):
+        events.append((time.monotonic(), msg))
+        add_log(msg)
+
+    def capture_stat(count, total_size, job_type, filename, mode="full"):
+        recorded.update(files=count, bytes=total_size, filename=filename, mode=mode)
+        log_download_stat(count, total_size, job_type, filename, mode)
+
+    app.add_log = capture_log
+    app.log_download_stat = capture_stat
+
+    config = {
+        "host": "127.0.0.1",
+        "port": port,
+        "user": BENCH_USER,
+        "password": BENCH_PASS,
+        "key": "",
+        "remote_path": "site",
+        "workers": workers,
+        "incremental": True,
+        "archive_mode": "staged",
+        "transfer_mode": "sftp",
+        "storage": "archive",
+        **app.compression_config(),
+        **overrides,
+    }
+    if method_id == "ssh":
+        app.app.test_client().post("/api/config/ssh", json=config)
+
+    runs = {}
+    for label in ("full", "repeat")[: 2 if repeat else 1]:
+        events.clear()
+        recorded.clear()
+        edit = edited_dumps(data_dir) if label == "repeat" and name in EDITED_REPEATS else nullcontext()
+        with edit:
+            start = time.monotonic()
+            if method_id == "ssh":
+                app.run_ssh_backup()
+            else:
+                app.run_sftp_backup(method_id, config)
+            end = time.monotonic()
+        wall = end - start
+        files, size = recorded.get("files", 0), recorded.get("bytes", 0)
+        archive = os.path.join(work, recorded["filename"]) if recorded.get("filename") else None
+        runs[label] = {
+            "result": app.method_state[method_id]["last_result"],
+            "mode": recorded.get("mode"),
+            "wall_s": round(wall, 3),
+            "files": files,
+            "bytes": size,
+            "files_per_s": round(files / wall, 1) if wall else 0.0,
+            "mb_per_s": round(size / 1024 / 1024 / wall, 2) if wall else 0.0,
+            "archive_bytes": os.path.getsize(archive) if archive and os.path.exists(archive) else None,
+            "peak_rss_mb": peak_rss_mb(),
+            "phases": phase_times(events, start, end),
+        }
+    return runs
+
+
+# --- Orchestration ---
+def start_server(data_dir, latency_ms):
+    proc = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "_serve", "--data-dir", data_dir, "--latency-ms", str(latency_ms)],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    line = proc.stdout.readline()
+    if not line:
+        proc.kill()
+        raise RuntimeError("Stub server failed to start")
+    return proc, json.loads(line)["port"]
+
+
+def run_child(name, port, workers, repeat, data_dir):
+    work = tempfile.mkdtemp(prefix=f"bench-{name}-")
+    out_path = os.path.join(work, "result.json")
+    env = dict(os.environ, WPBACKUP_DB=os.path.join(work, "wpbackup.db"))
+    try:
+        proc = subprocess.run(
+            [
+                sys.executable,
+                os.path.abspath(__file__),
+                "_run",
+                name,
+                "--port",
+                str(port),
+                "--work",
+                work,
+                "--workers",
+                str(workers),
+                "--out",
+                out_path,
+                "--data-dir",
+                data_dir,
+            ]
+            + (["--repeat"] if repeat else []),
+            env=env,
+            cwd=BACKEND_DIR,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        if proc.returncode != 0 or not os.path.exists(out_path):
+            return {"full": {"result": f"Benchmark error: {proc.stderr.strip()[-500:]}"}}
+        with open(out_path, encoding="utf-8") as f:
+            return json.load(f)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for key in ("profile", "latency_ms", "workers"):
+        if baseline.get(key) != results.get(key):
+            print(f"warning: baseline {key}={baseline.get(key)} differs from this run ({results.get(key)})", file=sys.stderr)
+    for name, runs in results["scenarios"].items():
+        for label, run in runs.items():
+            base = baseline.get("scenarios", {}).get(name, {}).get(label)
+            if not base:
+                continue
+            for metric, higher_is_better in COMPARED_METRICS.items():
+                old, new = base.get(metric), run.get(metric)
+                if not old or new is None:
+                    continue
+                change = (new - old) / old
+                worse = -change if higher_is_better else change
+                status = "REGRESSION" if worse > tolerance else "ok"
+                print(f"{name:16} {label:6} {metric:12} {old:>10} -> {new:>10} ({change:+.1%}) {status}", file=sys.stderr)
+                if status != "ok":
+                    regressions.append({"scenario": name, "run": label, "metric": metric, "baseline": old, "current": new})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the backup transfer paths against a local stub server.")
+    sub = parser.add_subparsers(dest="command")
+
+    serve_cmd = sub.add_parser("_serve")
+    serve_cmd.add_argument("--data-dir", required=True)
+    serve_cmd.add_argument("--latency-ms", type=float, default=0)
+
+    run_cmd = sub.add_parser("_run")
+    run_cmd.add_argument("scenario", choices=sorted(SCENARIOS))
+    run_cmd.add_argument("--port", type=int, required=True)
+    run_cmd.add_argument("--work", required=True)
+    run_cmd.add_argument("--workers", type=int, required=True)
+    run_cmd.add_argument("--out", required=True)
+    run_cmd.add_argument("--repeat", action="store_true")
+    run_cmd.add_argument("--data-dir", required=True)
+
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="small")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="repeatable; default: %(default)s")
+    parser.add_argument("--latency-ms", type=float, default=0, help="round-trip time added to every connection")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--repeat", action="store_true", help="run each scenario a second time (incremental; ssh-delta edits the dumps first)")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "velocity-bench"))
+    parser.add_argument("--output", help="write the JSON report here as well as to stdout")
+    parser.add_argument("--baseline", help="JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed relative slowdown (default 0.10)")
+    args = parser.parse_args(argv)
+
+    if args.command == "_serve":
+        port = serve(os.path.abspath(args.data_dir), args.latency_ms)
+        print(json.dumps({"port": port}), flush=True)
+        # Runs until the parent closes our stdin or kills us.
+        sys.stdin.read()
+        return 0
+    if args.command == "_run":
+        runs = run_scenario(args.scenario, args.port, args.work, args.workers, args.repeat, args.data_dir)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(runs, f)
+        return 0
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    print(f"Preparing '{args.profile}' tree in {args.data_dir}...", file=sys.stderr)
+    tree = build_tree(args.data_dir, args.profile)
+    results = {
+        "profile": args.profile,
+        "latency_ms": args.latency_ms,
+        "workers": args.workers,
+        "tree": tree,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "scenarios": {},
+    }
+    server, port = start_server(args.data_dir, args.latency_ms)
+    try:
+        for name in args.scenario or DEFAULT_SCENARIOS:
+            print(f"Running {name}...", file=sys.stderr)
+            results["scenarios"][name] = run_child(name, port, args.workers, args.repeat, args.data_dir)
+    finally:
+        server.kill()
+        server.wait()
+
+    failed = [
+        f"{name} ({label}): {run.get('result')}"
+        for name, runs in results["scenarios"].items()
+        for label, run in runs.items()
+        if run.get("result") != "Success"
+    ]
+    for failure in failed:
+        print(f"FAILED {failure}", file=sys.stderr)
+    status = 1 if failed else 0
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        results["regressions"] = compare(results, baseline, args.tolerance)
+        if results["regressions"]:
+            status = 1
+    report = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(report + "\n")
+    print(report)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
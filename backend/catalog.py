@@ -0,0 +1,239 @@
+import os
+import posixpath
+import re
+import time
+from datetime import datetime
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+# Sort keys accepted by query_archives; filename breaks ties so pages are stable.
+SORT_COLUMNS = {
+    "created": "created",
+    "size": "size",
+    "filename": "filename",
+    "job": "job",
+    "files": "files",
+}
+# "sftp_backup_20240101_120000.tar.gz" -> "sftp"
+JOB_PREFIX = re.compile(r"^([A-Za-z0-9-]+)_backup_")
+
+
+def init_catalog(conn):
+    c = conn.cursor()
+    c.execute(
+        "CREATE TABLE IF NOT EXISTS archives (filename TEXT PRIMARY KEY, job TEXT, storage TEXT, size INTEGER, "
+        "mtime REAL, created TEXT, files INTEGER, checksum TEXT)"
+    )
+    c.execute("CREATE INDEX IF NOT EXISTS idx_archives_created ON archives (created)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_archives_job_created ON archives (job, created)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_archives_size ON archives (size)")
+    # Member index: where each file sits inside an archive. blocks are the
+    # (uncompressed, compressed) offsets of its independently compressed
+    # blocks; offset is NULL for chunk store snapshots, which need neither.
+    c.execute("CREATE TABLE IF NOT EXISTS archive_index (filename TEXT PRIMARY KEY, members INTEGER, indexed TEXT)")
+    c.execute(
+        "CREATE TABLE IF NOT EXISTS archive_blocks (filename TEXT, raw_offset INTEGER, comp_offset INTEGER, "
+        "PRIMARY KEY (filename, raw_offset))"
+    )
+    c.execute(
+        "CREATE TABLE IF NOT EXISTS archive_members (id INTEGER PRIMARY KEY, filename TEXT, path TEXT, name TEXT, "
+        "size INTEGER, mtime INTEGER, offset INTEGER)"
+    )
+    # name is the lowercased basename, searched by prefix.
+    c.execute("CREATE INDEX IF NOT EXISTS idx_archive_members_name ON archive_members (name)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_archive_members_file ON archive_members (filename, path)")
+    conn.commit()
+
+
+def format_created(mtime):
+    return datetime.fromtimestamp(mtime).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def job_from_filename(filename):
+    match = JOB_PREFIX.match(filename)
+    return match.group(1).lower() if match else None
+
+
+def add_archive(conn, filename, job, size, mtime, files=None, checksum=None, storage="archive"):
+    conn.execute(
+        "INSERT OR REPLACE INTO archives (filename, job, storage, size, mtime, created, files, checksum) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (filename, job, storage, size, mtime, format_created(mtime), files, checksum),
+    )
+
+
+def get_archive(conn, filename):
+    c = conn.cursor()
+    c.execute("SELECT job, storage, size FROM archives WHERE filename = ?", (filename,))
+    row = c.fetchone()
+    return {"filename": filename, "job": row[0], "storage": row[1], "size": row[2]} if row else None
+
+
+def remove_archive(conn, filename):
+    conn.execute("DELETE FROM archives WHERE filename = ?", (filename,))
+    remove_index(conn, filename)
+
+
+def add_index(conn, filename, members, blocks=()):
+    # members are (path, size, mtime, offset) as from compression.member_index.
+    remove_index(conn, filename)
+    conn.executemany(
+        "INSERT INTO archive_blocks (filename, raw_offset, comp_offset) VALUES (?, ?, ?)",
+        [(filename, raw, comp) for raw, comp in blocks],
+    )
+    conn.executemany(
+        "INSERT INTO archive_members (filename, path, name, size, mtime, offset) VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            (filename, path, posixpath.basename(path).lower(), size, int(mtime or 0), offset)
+            for path, size, mtime, offset in members
+        ],
+    )
+    conn.execute(
+        "INSERT INTO archive_index (filename, members, indexed) VALUES (?, ?, ?)",
+        (filename, len(members), format_created(time.time())),
+    )
+
+
+def remove_index(conn, filename):
+    for table in ("archive_index", "archive_blocks", "archive_members"):
+        conn.execute(f"DELETE FROM {table} WHERE filename = ?", (filename,))
+
+
+def unindexed_archives(conn):
+    c = conn.cursor()
+    c.execute(
+        "SELECT a.filename, a.storage FROM archives a LEFT JOIN archive_index i ON i.filename = a.filename "
+        "WHERE i.filename IS NULL ORDER BY a.created DESC"
+    )
+    return c.fetchall()
+
+
+def get_member(conn, filename, path):
+    c = conn.cursor()
+    c.execute("SELECT size, mtime, offset FROM archive_members WHERE filename = ? AND path = ?", (filename, path))
+    row = c.fetchone()
+    return {"path": path, "size": row[0], "mtime": row[1], "offset": row[2]} if row else None
+
+
+def get_blocks(conn, filename):
+    c = conn.cursor()
+    c.execute("SELECT raw_offset, comp_offset FROM archive_blocks WHERE filename = ? ORDER BY raw_offset", (filename,))
+    return c.fetchall()
+
+
+def search_members(conn, name=None, path=None, job=None, start=None, end=None, limit=None, offset=0):
+    # Files across all indexed archives, newest archive first. name matches the
+    # start of the file name (case-insensitive, uses the index); path is a
+    # substring of the full member path. Returns (rows, total).
+    clauses = []
+    params = []
+    if name:
+        clauses.append("m.name GLOB ?")
+        params.append("".join(f"[{ch}]" if ch in "*?[" else ch for ch in name.lower()) + "*")
+    if path:
+        clauses.append("m.path LIKE ? ESCAPE '\\'")
+        params.append("%" + path.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+    if job:
+        clauses.append("a.job = ?")
+        params.append(job.lower())
+    if start:
+        clauses.append("a.created >= ?")
+        params.append(start)
+    if end:
+        clauses.append("a.created < ?")
+        params.append(end)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    limit = DEFAULT_PAGE_SIZE if limit is None else max(1, min(MAX_PAGE_SIZE, limit))
+    c = conn.cursor()
+    c.execute(f"SELECT COUNT(*) FROM archive_members m JOIN archives a ON a.filename = m.filename {where}", params)
+    total = c.fetchone()[0]
+    c.execute(
+        f"SELECT m.filename, a.job, a.created, m.path, m.size, m.mtime FROM archive_members m "
+        f"JOIN archives a ON a.filename = m.filename {where} ORDER BY a.created DESC, m.path LIMIT ? OFFSET ?",
+        (*params, limit, max(0, offset)),
+    )
+    rows = [
+        {"filename": row[0], "job": row[1], "created": row[2], "path": row[3], "size": row[4], "mtime": row[5]}
+        for row in c.fetchall()
+    ]
+    return rows, total
+
+
+def reconcile(conn, base_dir, is_archive, snapshots, lookup_job):
+    # Brings the catalog in line with what is actually there: archives added
+    # or removed behind our back, and snapshots from before the catalog
+    # existed. Only files the catalog does not know yet are stat'ed.
+    # Returns (added, removed).
+    c = conn.cursor()
+    c.execute("SELECT filename, storage FROM archives")
+    known = dict(c.fetchall())
+    on_disk = set()
+    if os.path.isdir(base_dir):
+        on_disk = {name for name in os.listdir(base_dir) if is_archive(name)}
+    snapshot_names = {snapshot["name"] for snapshot in snapshots}
+    added = removed = 0
+    for name in on_disk - set(known):
+        try:
+            st = os.stat(os.path.join(base_dir, name))
+        except OSError:
+            continue
+        add_archive(conn, name, lookup_job(conn, name) or job_from_filename(name), st.st_size, st.st_mtime)
+        added += 1
+    for snapshot in snapshots:
+        if snapshot["name"] not in known:
+            mtime = datetime.fromisoformat(snapshot["created"]).timestamp()
+            add_archive(
+                conn, snapshot["name"], snapshot["job_type"], snapshot["size"], mtime, snapshot["files"],
+                storage="chunkstore",
+            )
+            added += 1
+    for name, storage in known.items():
+        present = name in snapshot_names if storage == "chunkstore" else name in on_disk
+        if not present:
+            remove_archive(conn, name)
+            removed += 1
+    return added, removed
+
+
+def query_archives(conn, job=None, text=None, start=None, end=None, sort="created", order="desc", limit=None,
+                   offset=0):
+    # Returns (rows for the requested page, total matching rows).
+    clauses = []
+    params = []
+    if job:
+        clauses.append("job = ?")
+        params.append(job.lower())
+    if text:
+        clauses.append("filename LIKE ? ESCAPE '\\'")
+        params.append("%" + text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+    if start:
+        clauses.append("created >= ?")
+        params.append(start)
+    if end:
+        clauses.append("created < ?")
+        params.append(end)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    column = SORT_COLUMNS.get(sort, "created")
+    direction = "ASC" if order == "asc" else "DESC"
+    limit = DEFAULT_PAGE_SIZE if limit is None else max(1, min(MAX_PAGE_SIZE, limit))
+    c = conn.cursor()
+    c.execute(f"SELECT COUNT(*) FROM archives {where}", params)
+    total = c.fetchone()[0]
+    c.execute(
+        f"SELECT filename, job, storage, size, created, files, checksum FROM archives {where} "
+        f"ORDER BY {column} {direction}, filename {direction} LIMIT ? OFFSET ?",
+        (*params, limit, max(0, offset)),
+    )
+    rows = [
+        {
+            "filename": row[0],
+            "job": row[1],
+            "storage": row[2],
+            "size": row[3],
+            "created": row[4],
+            "files": row[5],
+            "checksum": row[6],
+        }
+        for row in c.fetchall()
+    ]
+    return rows, total
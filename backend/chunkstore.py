@@ -0,0 +1,351 @@
+import hashlib
+import io
+import json
+import os
+import stat
+import tarfile
+import time
+import zlib
+from datetime import datetime
+
+# Content-defined chunking: a chunk may end at a newline byte once it is at
+# least MIN_CHUNK long, when the CRC of the ANCHOR_WINDOW bytes before it has
+# its low ANCHOR_BITS clear. Boundaries depend only on nearby content, so an
+# insert early in a file does not shift every later chunk. The scan uses
+# bytes.find and zlib.crc32 so it runs at C speed; data without newlines is
+# cut at MAX_CHUNK.
+MIN_CHUNK = 256 * 1024
+MAX_CHUNK = 4 * 1024 * 1024
+ANCHOR = b"\n"
+ANCHOR_WINDOW = 32
+ANCHOR_BITS = 12
+READ_SIZE = 8 * 1024 * 1024
+
+# Objects are stored zlib-compressed when that helps, raw otherwise.
+RAW_TAG = b"r"
+ZLIB_TAG = b"z"
+
+
+def init_store(conn):
+    c = conn.cursor()
+    c.execute(
+        "CREATE TABLE IF NOT EXISTS chunks (hash TEXT PRIMARY KEY, size INTEGER, stored_size INTEGER)"
+    )
+    c.execute(
+        "CREATE TABLE IF NOT EXISTS snapshots (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT UNIQUE, job_type TEXT, "
+        "created DATETIME, status TEXT, files INTEGER, size INTEGER, info TEXT)"
+    )
+    c.execute(
+        "CREATE TABLE IF NOT EXISTS snapshot_entries (snapshot_id INTEGER, path TEXT, type TEXT, size INTEGER, "
+        "mtime INTEGER, mode INTEGER, chunks TEXT)"
+    )
+    c.execute("CREATE TABLE IF NOT EXISTS snapshot_chunks (snapshot_id INTEGER, hash TEXT, PRIMARY KEY (snapshot_id, hash))")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_snapshot_entries ON snapshot_entries (snapshot_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_snapshot_chunks_hash ON snapshot_chunks (hash)")
+    conn.commit()
+
+
+def find_cut(buf, start, end):
+    pos = start + MIN_CHUNK
+    mask = (1 << ANCHOR_BITS) - 1
+    find = buf.find
+    while pos < end:
+        i = find(ANCHOR, pos, end)
+        if i < 0:
+            break
+        if not zlib.crc32(buf[i - ANCHOR_WINDOW : i]) & mask:
+            return i + 1
+        pos = i + 1
+    return end
+
+
+def iter_chunks(path):
+    # Yields (offset, length, sha256) for each chunk of the file.
+    offset = 0
+    buf = b""
+    eof = False
+    with open(path, "rb") as f:
+        while True:
+            if not eof and len(buf) < MAX_CHUNK:
+                more = f.read(READ_SIZE)
+                eof = not more
+                buf += more
+            if not buf:
+                return
+            cut = find_cut(buf, 0, min(len(buf), MAX_CHUNK)) if (eof or len(buf) >= MAX_CHUNK) else None
+            if cut is None:
+                continue
+            chunk = buf[:cut]
+            yield offset, cut, hashlib.sha256(chunk).hexdigest()
+            offset += cut
+            buf = buf[cut:]
+
+
+def object_path(store_dir, digest):
+    return os.path.join(store_dir, "objects", digest[:2], digest)
+
+
+def write_object(store_dir, digest, data):
+    path = object_path(store_dir, digest)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    packed = zlib.compress(data, 1)
+    payload = ZLIB_TAG + packed if len(packed) < len(data) else RAW_TAG + data
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(payload)
+    os.replace(tmp, path)
+    return len(payload)
+
+
+def read_object(store_dir, digest):
+    with open(object_path(store_dir, digest), "rb") as f:
+        payload = f.read()
+    if payload[:1] == ZLIB_TAG:
+        return zlib.decompress(payload[1:])
+    return payload[1:]
+
+
+def read_range(path, offset, length):
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return f.read(length)
+
+
+def latest_entries(conn, job_type):
+    # path -> (size, mtime, chunks) from the newest complete snapshot of a job,
+    # so unchanged files are linked without being read again.
+    c = conn.cursor()
+    c.execute(
+        "SELECT id FROM snapshots WHERE job_type = ? AND status = 'complete' ORDER BY id DESC LIMIT 1",
+        (job_type,),
+    )
+    row = c.fetchone()
+    if not row:
+        return {}
+    c.execute(
+        "SELECT path, size, mtime, chunks FROM snapshot_entries WHERE snapshot_id = ? AND type = 'f'",
+        (row[0],),
+    )
+    return {path: (size, mtime, chunks) for path, size, mtime, chunks in c.fetchall()}
+
+
+def all_stored(c, chunk_list):
+    for _, _, digest in chunk_list:
+        c.execute("SELECT 1 FROM chunks WHERE hash = ?", (digest,))
+        if not c.fetchone():
+            return False
+    return True
+
+
+def ingest_tree(conn, store_dir, name, job_type, local_root, arc_root, info, stop_event, log=print, batch=200,
+                exclude=None):
+    # Records local_root as snapshot `name`. Each batch of files is linked to
+    # its chunks inside one write transaction; delete_snapshot sweeps orphans
+    # under the same lock, so a chunk is never collected between being found
+    # and being linked. Files for which exclude(filename) is true are left out.
+    previous = latest_entries(conn, job_type)
+    c = conn.cursor()
+    c.execute(
+        "INSERT INTO snapshots (name, job_type, created, status, files, size, info) VALUES (?, ?, ?, 'partial', 0, 0, ?)",
+        (name, job_type, datetime.now(), json.dumps(info)),
+    )
+    snapshot_id = c.lastrowid
+    conn.commit()
+
+    totals = {"files": 0, "size": 0, "new_chunks": 0, "new_bytes": 0, "reused_files": 0}
+    pending = []
+
+    def flush():
+        c.execute("BEGIN IMMEDIATE")
+        for rel, st, chunk_list, source, reused in pending:
+            if chunk_list is None:
+                c.execute(
+                    "INSERT INTO snapshot_entries (snapshot_id, path, type, size, mtime, mode, chunks) VALUES (?, ?, 'd', 0, ?, ?, '')",
+                    (snapshot_id, rel, int(st.st_mtime), stat.S_IMODE(st.st_mode)),
+                )
+                continue
+            if reused and not all_stored(c, chunk_list):
+                chunk_list = list(iter_chunks(source))
+            for offset, length, digest in chunk_list:
+                c.execute("SELECT 1 FROM chunks WHERE hash = ?", (digest,))
+                if not c.fetchone():
+                    stored = write_object(store_dir, digest, read_range(source, offset, length))
+                    c.execute(
+                        "INSERT INTO chunks (hash, size, stored_size) VALUES (?, ?, ?)", (digest, length, stored)
+                    )
+                    totals["new_chunks"] += 1
+                    totals["new_bytes"] += stored
+                c.execute(
+                    "INSERT OR IGNORE INTO snapshot_chunks (snapshot_id, hash) VALUES (?, ?)", (snapshot_id, digest)
+                )
+            c.execute(
+                "INSERT INTO snapshot_entries (snapshot_id, path, type, size, mtime, mode, chunks) VALUES (?, ?, 'f', ?, ?, ?, ?)",
+                (
+                    snapshot_id,
+                    rel,
+                    st.st_size,
+                    int(st.st_mtime),
+                    stat.S_IMODE(st.st_mode),
+                    " ".join(digest for _, _, digest in chunk_list),
+                ),
+            )
+        conn.commit()
+        pending.clear()
+
+    try:
+        for dirpath, dirnames, filenames in os.walk(local_root):
+            dirnames.sort()
+            rel_dir = os.path.relpath(dirpath, local_root).replace(os.sep, "/")
+            rel_dir = arc_root if rel_dir == "." else f"{arc_root}/{rel_dir}"
+            pending.append((rel_dir, os.stat(dirpath), None, None, False))
+            for filename in sorted(filenames):
+                if stop_event.is_set():
+                    raise InterruptedError("Snapshot stopped")
+                if exclude and exclude(filename):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(path)
+                except OSError as e:
+                    log(f"Skipping {filename}: {str(e)}")
+                    continue
+                rel = f"{rel_dir}/{filename}"
+                known = previous.get(rel)
+                reused = bool(known and known[0] == st.st_size and known[1] == int(st.st_mtime))
+                if reused:
+                    chunk_list = [(None, None, digest) for digest in known[2].split()]
+                    totals["reused_files"] += 1
+                else:
+                    chunk_list = list(iter_chunks(path))
+                pending.append((rel, st, chunk_list, path, reused))
+                totals["files"] += 1
+                totals["size"] += st.st_size
+                if len(pending) >= batch:
+                    flush()
+        flush()
+        c.execute(
+            "UPDATE snapshots SET status = 'complete', files = ?, size = ? WHERE id = ?",
+            (totals["files"], totals["size"], snapshot_id),
+        )
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        delete_snapshot(conn, store_dir, name)
+        raise
+    return totals
+
+
+def snapshot_exists(conn, name):
+    c = conn.cursor()
+    c.execute("SELECT 1 FROM snapshots WHERE name = ? AND status = 'complete'", (name,))
+    return c.fetchone() is not None
+
+
+def list_snapshots(conn):
+    c = conn.cursor()
+    c.execute("SELECT name, job_type, created, files, size FROM snapshots WHERE status = 'complete'")
+    return [
+        {"name": name, "job_type": job_type, "created": created, "files": files, "size": size}
+        for name, job_type, created, files, size in c.fetchall()
+    ]
+
+
+def delete_snapshot(conn, store_dir, name):
+    c = conn.cursor()
+    c.execute("BEGIN IMMEDIATE")
+    c.execute("SELECT id FROM snapshots WHERE name = ?", (name,))
+    row = c.fetchone()
+    if not row:
+        conn.rollback()
+        return False
+    snapshot_id = row[0]
+    c.execute("DELETE FROM snapshot_entries WHERE snapshot_id = ?", (snapshot_id,))
+    c.execute("DELETE FROM snapshot_chunks WHERE snapshot_id = ?", (snapshot_id,))
+    c.execute("DELETE FROM snapshots WHERE id = ?", (snapshot_id,))
+    c.execute("SELECT hash FROM chunks WHERE hash NOT IN (SELECT hash FROM snapshot_chunks)")
+    orphans = [row[0] for row in c.fetchall()]
+    for digest in orphans:
+        try:
+            os.remove(object_path(store_dir, digest))
+        except FileNotFoundError:
+            pass
+    c.executemany("DELETE FROM chunks WHERE hash = ?", [(digest,) for digest in orphans])
+    conn.commit()
+    return True
+
+
+def store_usage(conn):
+    c = conn.cursor()
+    c.execute("SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(stored_size), 0) FROM chunks")
+    count, logical, stored = c.fetchone()
+    return {"chunks": count, "chunk_bytes": logical, "stored_bytes": stored}
+
+
+class ChunkReader:
+    def __init__(self, store_dir, digests):
+        self.store_dir = store_dir
+        self.digests = iter(digests)
+        self.chunk = b""
+        self.pos = 0
+
+    def read(self, n=-1):
+        parts = []
+        while n != 0:
+            if self.pos >= len(self.chunk):
+                digest = next(self.digests, None)
+                if digest is None:
+                    break
+                self.chunk, self.pos = read_object(self.store_dir, digest), 0
+                continue
+            part = self.chunk[self.pos :] if n < 0 else self.chunk[self.pos : self.pos + n]
+            self.pos += len(part)
+            if n > 0:
+                n -= len(part)
+            parts.append(part)
+        return b"".join(parts)
+
+
+def load_snapshot(conn, name):
+    c = conn.cursor()
+    c.execute("SELECT id, info FROM snapshots WHERE name = ? AND status = 'complete'", (name,))
+    row = c.fetchone()
+    if not row:
+        raise FileNotFoundError(name)
+    snapshot_id, info = row
+    c.execute(
+        "SELECT path, type, size, mtime, mode, chunks FROM snapshot_entries WHERE snapshot_id = ? ORDER BY rowid",
+        (snapshot_id,),
+    )
+    return {"name": name, "info": info, "entries": c.fetchall()}
+
+
+def load_entry(conn, name, path):
+    # (size, chunk digests) of one file in a complete snapshot, or None.
+    c = conn.cursor()
+    c.execute(
+        "SELECT e.size, e.chunks FROM snapshot_entries e JOIN snapshots s ON s.id = e.snapshot_id "
+        "WHERE s.name = ? AND s.status = 'complete' AND e.path = ? AND e.type = 'f'",
+        (name, path),
+    )
+    row = c.fetchone()
+    return (row[0], row[1].split()) if row else None
+
+
+def export_snapshot(store_dir, snapshot, tar):
+    # Rebuilds a loaded snapshot as ordinary tar members, plus backup_info.json.
+    # Needs no database connection, so a slow download holds none.
+    for path, entry_type, size, mtime, mode, chunks in snapshot["entries"]:
+        member = tarfile.TarInfo(path)
+        member.mtime = mtime
+        member.mode = mode
+        if entry_type == "d":
+            member.type = tarfile.DIRTYPE
+            tar.addfile(member)
+        else:
+            member.size = size
+            tar.addfile(member, ChunkReader(store_dir, chunks.split()))
+    payload = (snapshot["info"] or "{}").encode("utf-8")
+    member = tarfile.TarInfo("backup_info.json")
+    member.size = len(payload)
+    member.mtime = int(time.time())
+    tar.addfile(member, io.BytesIO(payload))
@@ -0,0 +1,379 @@
+import bisect
+import gzip
+import hashlib
+import os
+import queue
+import tarfile
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+# zstd support is optional
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CODEC_EXTENSIONS = {"gzip": ".tar.gz", "zstd": ".tar.zst"}
+ARCHIVE_EXTENSIONS = tuple(CODEC_EXTENSIONS.values())
+DEFAULT_CODEC = "gzip"
+DEFAULT_LEVELS = {"gzip": 6, "zstd": 3}
+LEVEL_RANGES = {"gzip": (1, 9), "zstd": (1, 19)}
+# Each block becomes an independent gzip member / zstd frame. Concatenated
+# members are valid gzip (RFC 1952) and concatenated frames are valid zstd, so
+# the output still unpacks with plain gunzip/unzstd and tar.
+BLOCK_SIZE = 1024 * 1024
+# Compressed bytes read per step when decompressing blocks back, and the most
+# output one step may produce from a single gzip stream.
+READ_SIZE = 256 * 1024
+MAX_OUTPUT = 4 * 1024 * 1024
+
+
+def available_codecs():
+    return [codec for codec in CODEC_EXTENSIONS if codec != "zstd" or zstandard]
+
+
+def default_threads():
+    return os.cpu_count() or 1
+
+
+def normalize_codec(codec):
+    return codec if codec in available_codecs() else DEFAULT_CODEC
+
+
+def normalize_level(codec, level):
+    low, high = LEVEL_RANGES[codec]
+    try:
+        level = int(level)
+    except (TypeError, ValueError):
+        return DEFAULT_LEVELS[codec]
+    return max(low, min(high, level))
+
+
+def normalize_threads(threads):
+    try:
+        threads = int(threads)
+    except (TypeError, ValueError):
+        return default_threads()
+    return max(1, min(64, threads))
+
+
+def archive_extension(codec):
+    return CODEC_EXTENSIONS[normalize_codec(codec)]
+
+
+def is_archive(filename):
+    return filename.endswith(ARCHIVE_EXTENSIONS)
+
+
+def archive_codec(filename):
+    for codec, extension in CODEC_EXTENSIONS.items():
+        if filename.endswith(extension):
+            return codec
+    return DEFAULT_CODEC
+
+
+def block_compressor(codec, level):
+    if codec == "zstd":
+        # ZstdCompressor is not thread-safe; each pool thread gets its own.
+        local = threading.local()
+
+        def compress(data):
+            if not hasattr(local, "cctx"):
+                local.cctx = zstandard.ZstdCompressor(level=level)
+            return local.cctx.compress(data)
+
+        return compress
+    return lambda data: gzip.compress(data, compresslevel=level, mtime=0)
+
+
+class BlockWriter:
+    # Write-only file object that cuts its input into BLOCK_SIZE blocks and
+    # compresses them on a thread pool (zlib and zstd release the GIL), writing
+    # the results out in order. At most threads * 2 blocks are in flight.
+    def __init__(self, fileobj, codec=DEFAULT_CODEC, level=None, threads=None):
+        self.fileobj = fileobj
+        self.codec = normalize_codec(codec)
+        self.level = normalize_level(self.codec, level)
+        self.threads = normalize_threads(threads)
+        self.compress = block_compressor(self.codec, self.level)
+        self.pool = ThreadPoolExecutor(max_workers=self.threads)
+        self.pending = deque()
+        self.buffer = bytearray()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.submitted = 0
+        # (uncompressed offset, compressed offset) where each block starts, so
+        # a reader can start decompressing at any block.
+        self.blocks = []
+        # Digest of the compressed output, i.e. of the archive file itself.
+        self.digest = hashlib.sha256()
+        self.closed = False
+
+    def write(self, data):
+        self.buffer += data
+        self.bytes_in += len(data)
+        while len(self.buffer) >= BLOCK_SIZE:
+            self._submit(bytes(self.buffer[:BLOCK_SIZE]))
+            del self.buffer[:BLOCK_SIZE]
+        return len(data)
+
+    def _submit(self, block):
+        self.pending.append((self.submitted, self.pool.submit(self.compress, block)))
+        self.submitted += len(block)
+        self._drain(self.threads * 2)
+
+    def _drain(self, limit):
+        while len(self.pending) > limit:
+            offset, future = self.pending.popleft()
+            out = future.result()
+            self.blocks.append((offset, self.bytes_out))
+            self.fileobj.write(out)
+            self.digest.update(out)
+            self.bytes_out += len(out)
+
+    def tell(self):
+        return self.bytes_in
+
+    def ratio(self):
+        return round(self.bytes_in / self.bytes_out, 3) if self.bytes_out else 0.0
+
+    def checksum(self):
+        return self.digest.hexdigest()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if self.buffer or not self.bytes_in:
+                self._submit(bytes(self.buffer))
+                self.buffer = bytearray()
+            self._drain(0)
+        finally:
+            self.pool.shutdown(wait=True, cancel_futures=True)
+
+
+class IndexedTarFile(tarfile.TarFile):
+    # Sets offset_data on written members too (tarfile only does so when
+    # reading), i.e. where each member's data starts in the uncompressed tar.
+    def addfile(self, tarinfo, fileobj=None):
+        super().addfile(tarinfo, fileobj)
+        member = self.members[-1]
+        padded = 0
+        if fileobj is not None and member.isreg():
+            padded = -(-member.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+        member.offset_data = self.offset - padded
+
+
+def member_index(tar):
+    # (path, size, mtime, data offset) of every regular file in the archive.
+    return [(m.name, m.size, m.mtime, m.offset_data) for m in tar.members if m.isreg()]
+
+
+@contextmanager
+def open_archive(path, codec=DEFAULT_CODEC, level=None, threads=None):
+    # Yields a tarfile writing through a BlockWriter; tar.compressor exposes the
+    # writer so callers can read its byte counts and block table once the
+    # archive is closed.
+    with open(path, "wb") as raw:
+        writer = BlockWriter(raw, codec, level, threads)
+        try:
+            with IndexedTarFile.open(fileobj=writer, mode="w|") as tar:
+                tar.compressor = writer
+                yield tar
+        finally:
+            writer.close()
+
+
+@contextmanager
+def read_archive(fileobj, codec=DEFAULT_CODEC):
+    # Yields a tarfile streaming members out of an archive from open_archive.
+    # tarfile's own "r|gz" stops after the first gzip member, so the blocks
+    # are decompressed here instead.
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd archives need the zstandard package.")
+        stream = zstandard.ZstdDecompressor().stream_reader(fileobj, read_across_frames=True)
+    else:
+        stream = gzip.GzipFile(fileobj=fileobj, mode="rb")
+    with tarfile.open(fileobj=stream, mode="r|") as tar:
+        yield tar
+
+
+def new_decompressor(codec):
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd archives need the zstandard package.")
+        return zstandard.ZstdDecompressor().decompressobj()
+    return zlib.decompressobj(zlib.MAX_WBITS | 16)
+
+
+def iter_blocks(fileobj, codec=DEFAULT_CODEC, comp_offset=0, raw_offset=0, on_block=None):
+    # Decompresses consecutive gzip members / zstd frames starting at
+    # comp_offset (which must be the start of one) and yields the output.
+    # on_block(raw offset, compressed offset) is called as each one starts.
+    fileobj.seek(comp_offset)
+    decomp = None
+    while True:
+        data = fileobj.read(READ_SIZE)
+        if not data:
+            return
+        while data:
+            if decomp is None:
+                if on_block:
+                    on_block(raw_offset, comp_offset)
+                decomp = new_decompressor(codec)
+            if codec == "zstd":
+                out = decomp.decompress(data)
+            else:
+                out = decomp.decompress(data, MAX_OUTPUT)
+            if out:
+                raw_offset += len(out)
+                yield out
+            if decomp.eof:
+                rest = decomp.unused_data
+                comp_offset += len(data) - len(rest)
+                data = rest
+                decomp = None
+            else:
+                rest = getattr(decomp, "unconsumed_tail", b"")
+                comp_offset += len(data) - len(rest)
+                data = rest
+
+
+class IterReader:
+    # read() over an iterator of byte strings.
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.chunk = b""
+        self.pos = 0
+
+    def read(self, n=-1):
+        parts = []
+        while n != 0:
+            if self.pos >= len(self.chunk):
+                self.chunk, self.pos = next(self.chunks, b""), 0
+                if not self.chunk:
+                    break
+                continue
+            part = self.chunk[self.pos :] if n < 0 else self.chunk[self.pos : self.pos + n]
+            self.pos += len(part)
+            if n > 0:
+                n -= len(part)
+            parts.append(part)
+        return b"".join(parts)
+
+
+def scan_archive(fileobj, codec=DEFAULT_CODEC):
+    # Builds (blocks, member_index) by reading an archive once, for archives
+    # not written through open_archive. A single-stream .tar.gz comes out as
+    # one block, so reading a member from it decompresses from the start.
+    blocks = []
+    reader = IterReader(iter_blocks(fileobj, codec, on_block=lambda raw, comp: blocks.append((raw, comp))))
+    with tarfile.open(fileobj=reader, mode="r|") as tar:
+        members = [(m.name, m.size, m.mtime, m.offset_data) for m in tar if m.isreg()]
+    return blocks, members
+
+
+def read_member(fileobj, codec, blocks, offset, size):
+    # Yields size bytes starting at uncompressed offset, decompressing only
+    # from the block that holds offset onwards.
+    if not size:
+        return
+    starts = [raw for raw, _ in blocks]
+    index = max(0, bisect.bisect_right(starts, offset) - 1)
+    raw_start, comp_start = blocks[index] if blocks else (0, 0)
+    skip = offset - raw_start
+    remaining = size
+    for data in iter_blocks(fileobj, codec, comp_start, raw_start):
+        if skip:
+            if len(data) <= skip:
+                skip -= len(data)
+                continue
+            data = data[skip:]
+            skip = 0
+        part = data[:remaining]
+        remaining -= len(part)
+        yield part
+        if not remaining:
+            return
+    raise EOFError(f"archive ended {remaining} bytes short of the member")
+
+
+class HashingWriter:
+    # Pass-through file object that keeps a sha256 of everything written.
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.digest = hashlib.sha256()
+
+    def write(self, data):
+        self.digest.update(data)
+        return self.fileobj.write(data)
+
+    def checksum(self):
+        return self.digest.hexdigest()
+
+
+def count_files(tar):
+    # Regular files written so far; tarfile keeps every member it has added.
+    return sum(1 for member in tar.members if member.isfile())
+
+
+class QueueWriter:
+    # File object handing each write to a bounded queue; raises once the
+    # consumer has gone away so the producing thread unwinds.
+    def __init__(self, out, abort):
+        self.out = out
+        self.abort = abort
+
+    def write(self, data):
+        while not self.abort.is_set():
+            try:
+                self.out.put(bytes(data), timeout=1)
+                return len(data)
+            except queue.Full:
+                continue
+        raise BrokenPipeError("Archive consumer closed")
+
+
+def iter_archive(build, codec=DEFAULT_CODEC, level=None, threads=None, buffer_blocks=16):
+    # Runs build(tar) on a thread against a compressed tar stream and yields
+    # the output as it is produced, e.g. for a streamed HTTP response.
+    out = queue.Queue(maxsize=buffer_blocks)
+    abort = threading.Event()
+    done = object()
+    errors = []
+
+    def produce():
+        try:
+            writer = BlockWriter(QueueWriter(out, abort), codec, level, threads)
+            try:
+                with tarfile.open(fileobj=writer, mode="w|") as tar:
+                    build(tar)
+            finally:
+                writer.close()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            while not abort.is_set():
+                try:
+                    out.put(done, timeout=1)
+                    break
+                except queue.Full:
+                    continue
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            data = out.get()
+            if data is done:
+                break
+            yield data
+        if errors and not isinstance(errors[0], BrokenPipeError):
+            raise errors[0]
+    finally:
+        abort.set()
@@ -0,0 +1,87 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+DEFAULT_POOL_SIZE = 8
+BUSY_TIMEOUT = 60
+
+
+def open_connection(path):
+    # WAL lets the status endpoint read while a backup thread is writing.
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class ConnectionPool:
+    # Hands out at most `size` connections; a connection is only ever used by
+    # the thread that checked it out, so sharing across threads is safe.
+    def __init__(self, path, size=DEFAULT_POOL_SIZE):
+        self.path = path
+        self.size = size
+        self.idle = []
+        self.created = 0
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        with self.cond:
+            while not self.idle and self.created >= self.size:
+                self.cond.wait()
+            if self.idle:
+                return self.idle.pop()
+            self.created += 1
+        try:
+            return open_connection(self.path)
+        except Exception:
+            with self.cond:
+                self.created -= 1
+                self.cond.notify()
+            raise
+
+    def release(self, conn, broken=False):
+        with self.cond:
+            if broken:
+                self.created -= 1
+            else:
+                self.idle.append(conn)
+            self.cond.notify()
+        if broken:
+            conn.close()
+
+    @contextmanager
+    def connection(self):
+        # Commits on success and rolls back on error, so a connection always
+        # goes back to the pool outside a transaction.
+        conn = self.acquire()
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                self.release(conn, broken=True)
+                raise
+            self.release(conn)
+            raise
+        self.release(conn)
+
+    def close(self):
+        with self.cond:
+            idle, self.idle = self.idle, []
+            self.created -= len(idle)
+        for conn in idle:
+            conn.close()
+
+
+pools = {}
+pools_lock = threading.Lock()
+
+
+def get_pool(path, size=DEFAULT_POOL_SIZE):
+    with pools_lock:
+        pool = pools.get(path)
+        if pool is None:
+            pool = pools[path] = ConnectionPool(path, size)
+        return pool
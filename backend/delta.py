@@ -0,0 +1,317 @@
+import hashlib
+import os
+import shlex
+import socket
+import stat
+import threading
+import zlib
+
+from transfer import PARTIAL_SUFFIX, READ_CHUNK, iter_chunks
+
+# Changed files at least this big are fetched as a delta against the copy
+# from the previous run: the server sends a checksum per block, blocks found
+# in the old copy are taken from it and only the rest is read over SFTP.
+DELTA_MIN_SIZE = 8 * 1024 * 1024
+MIN_BLOCK = 64 * 1024
+MAX_BLOCK = 1024 * 1024
+# Block size grows with the file to keep the signature at about this many lines.
+TARGET_BLOCKS = 16384
+# Where aligned blocks stop matching, the old copy is searched this far either
+# side for the blocks that follow (data inserted or removed before them).
+SEARCH_WINDOW = 256 * 1024
+SEARCH_BLOCKS = 16
+ADLER_MOD = 65521
+# Runs on the server under python3: one "<adler32> <blake2b>" line per block
+# of the first limit bytes, then "end <bytes> <blake2b of them all>".
+SIGNATURE_SCRIPT = """
+import hashlib, sys, zlib
+path, block, limit = sys.argv[1], int(sys.argv[2]), int(sys.argv[3])
+whole = hashlib.blake2b(digest_size=16)
+done = 0
+with open(path, "rb") as f:
+    while done < limit:
+        data = f.read(min(block, limit - done))
+        if not data:
+            break
+        done += len(data)
+        whole.update(data)
+        sys.stdout.write("%08x %s\\n" % (zlib.adler32(data), hashlib.blake2b(data, digest_size=16).hexdigest()))
+sys.stdout.write("end %d %s\\n" % (done, whole.hexdigest()))
+"""
+
+
+class DeltaUnavailable(Exception):
+    pass
+
+
+def block_size(size):
+    block = MIN_BLOCK
+    while block < MAX_BLOCK and size > block * TARGET_BLOCKS:
+        block *= 2
+    return block
+
+
+def strong_sum(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def signature_command(r_path, block, limit):
+    return f"python3 -c {shlex.quote(SIGNATURE_SCRIPT)} {shlex.quote(r_path)} {block} {limit}"
+
+
+def remote_signature(transport, r_path, block, limit, stop_event):
+    # Returns ([(weak, strong)], size, whole) for the remote file, or None if
+    # stopped. Raises DeltaUnavailable if the server cannot run the script at
+    # all, IOError if it failed on this file.
+    try:
+        channel = transport.open_session()
+    except Exception as e:
+        raise IOError(f"no channel for checksums: {str(e)}")
+    try:
+        channel.settimeout(1.0)
+        try:
+            channel.exec_command(signature_command(r_path, block, limit))
+        except Exception as e:
+            raise DeltaUnavailable(str(e))
+        # stderr is drained as it comes: a script blocked on a full stderr
+        # window would never finish its stdout.
+        output, errors = [], []
+        stdout_open = stderr_open = True
+        while (stdout_open or stderr_open) and not stop_event.is_set():
+            if stderr_open and (channel.recv_stderr_ready() or not stdout_open):
+                try:
+                    data = channel.recv_stderr(65536)
+                except socket.timeout:
+                    continue
+                if data:
+                    errors.append(data)
+                else:
+                    stderr_open = False
+                continue
+            try:
+                data = channel.recv(65536)
+            except socket.timeout:
+                continue
+            if data:
+                output.append(data)
+            else:
+                stdout_open = False
+        if stop_event.is_set():
+            return None
+        status = channel.recv_exit_status()
+        if status != 0:
+            detail = b"".join(errors).decode("utf-8", "replace").strip().splitlines()
+            detail = detail[-1] if detail else f"exit status {status}"
+            # 127: the shell found no python3.
+            if status == 127:
+                raise DeltaUnavailable(detail)
+            raise IOError(detail)
+    finally:
+        channel.close()
+    lines = b"".join(output).decode("ascii", "replace").splitlines()
+    if not lines or not lines[-1].startswith("end "):
+        raise IOError("incomplete checksum listing")
+    _, size, whole = lines[-1].split()
+    sums = []
+    for line in lines[:-1]:
+        weak, strong = line.split()
+        sums.append((int(weak, 16), strong))
+    return sums, int(size), whole
+
+
+def read_at(f, offset, length):
+    f.seek(offset)
+    return f.read(length)
+
+
+def search_blocks(old, old_size, sums, first, block, size, center):
+    # Rolls an adler32 window of one block over the old copy around center,
+    # looking for any of the SEARCH_BLOCKS blocks from first on. Returns
+    # (offset in old copy, block index) of the earliest verified hit, or None.
+    targets = {}
+    for index in range(first, min(len(sums), first + SEARCH_BLOCKS)):
+        if (index + 1) * block <= size:
+            targets.setdefault(sums[index][0], []).append(index)
+    lo = max(0, center - SEARCH_WINDOW)
+    hi = min(old_size, center + SEARCH_WINDOW + block)
+    if not targets or hi - lo < block:
+        return None
+    data = read_at(old, lo, hi - lo)
+    checksum = zlib.adler32(data[:block])
+    a, b = checksum & 0xFFFF, checksum >> 16
+    for start in range(len(data) - block + 1):
+        if start:
+            out, new = data[start - 1], data[start + block - 1]
+            a = (a - out + new) % ADLER_MOD
+            b = (b - block * out - 1 + a) % ADLER_MOD
+        candidates = targets.get((b << 16) | a)
+        if candidates:
+            strong = strong_sum(data[start : start + block])
+            for index in candidates:
+                if sums[index][1] == strong:
+                    return lo + start, index
+    return None
+
+
+def match_blocks(old, old_size, sums, block, size, stop_event):
+    # Source offset in the old copy for each block of the new file, or None
+    # for blocks that have to be fetched. Blocks are checked where they were
+    # expected to be; on a miss the old copy is searched nearby, and after a
+    # fruitless search the next one waits twice as many blocks.
+    plan = [None] * len(sums)
+    shift = 0
+    next_search, gap = 0, SEARCH_BLOCKS
+    index = 0
+    while index < len(sums):
+        if stop_event.is_set():
+            return None
+        length = min(block, size - index * block)
+        pos = index * block + shift
+        if 0 <= pos and pos + length <= old_size and strong_sum(read_at(old, pos, length)) == sums[index][1]:
+            plan[index] = pos
+            next_search, gap = index + 1, SEARCH_BLOCKS
+            index += 1
+            continue
+        if index >= next_search and pos < old_size + SEARCH_WINDOW:
+            hit = search_blocks(old, old_size, sums, index, block, size, pos)
+            if hit:
+                offset, found = hit
+                shift = offset - found * block
+                index = found
+                continue
+            next_search, gap = index + gap, gap * 2
+        index += 1
+    return plan
+
+
+def plan_runs(plan, block, size):
+    # Collapses the plan into (start, end, source) runs of the new file;
+    # source is the old copy offset of start, or None to fetch.
+    run = None
+    for index, source in enumerate(plan):
+        start, end = index * block, min(size, (index + 1) * block)
+        if run and (source is None) == (run[2] is None) and (source is None or source == run[2] + run[1] - run[0]):
+            run[1] = end
+            continue
+        if run:
+            yield tuple(run)
+        run = [start, end, source]
+    if run:
+        yield tuple(run)
+
+
+def read_range(f, offset, length):
+    f.seek(offset)
+    while length > 0:
+        data = f.read(min(READ_CHUNK, length))
+        if not data:
+            raise EOFError("previous copy changed while syncing")
+        length -= len(data)
+        yield data
+
+
+class DeltaSync:
+    # Passed to parallel_download for the SSH "delta" transfer mode and shared
+    # by its workers. The signature script needs python3 on the server; if it
+    # is missing or exec is refused, the rest of the run fetches files whole.
+    def __init__(self, transport, log=print, min_size=DELTA_MIN_SIZE):
+        self.transport = transport
+        self.log = log
+        self.min_size = min_size
+        self.unavailable = None
+        self.lock = threading.Lock()
+        self.files = 0
+        self.bytes = 0
+        self.fetched = 0
+
+    def applies(self, l_path, item):
+        return (
+            self.unavailable is None
+            and stat.S_ISREG(item.st_mode or 0)
+            and (item.st_size or 0) >= self.min_size
+            and os.path.isfile(l_path)
+        )
+
+    def fetch(self, sftp, r_path, l_path, item, stop_event, on_progress=None):
+        # True once l_path holds the new version, False if stopped part way
+        # (l_path is then untouched), None if it should be fetched whole.
+        size = item.st_size
+        block = block_size(size)
+        try:
+            signature = remote_signature(self.transport, r_path, block, size, stop_event)
+        except DeltaUnavailable as e:
+            with self.lock:
+                if self.unavailable is None:
+                    self.unavailable = str(e)
+                    self.log(f"Delta transfer unavailable ({str(e)}); fetching changed files whole.")
+            return None
+        except Exception as e:
+            self.log(f"No checksums for {item.filename} ({str(e)}); fetching it whole.")
+            return None
+        if signature is None:
+            return False
+        sums, total, whole = signature
+        if total != size:
+            self.log(f"{item.filename} changed while syncing; fetching it whole.")
+            return None
+        tmp = f"{l_path}.delta{PARTIAL_SUFFIX}"
+        try:
+            with open(l_path, "rb") as old:
+                plan = match_blocks(old, os.fstat(old.fileno()).st_size, sums, block, size, stop_event)
+                if plan is None:
+                    return False
+                fetched = self.rebuild(sftp, r_path, old, plan, block, size, tmp, whole, stop_event, on_progress)
+            if fetched is None:
+                return False
+            if fetched is False:
+                self.log(f"{item.filename} changed while syncing; fetching it whole.")
+                return None
+            os.replace(tmp, l_path)
+        except (OSError, EOFError) as e:
+            self.log(f"Delta for {item.filename} failed ({str(e)}); fetching it whole.")
+            return None
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        with self.lock:
+            self.files += 1
+            self.bytes += size
+            self.fetched += fetched
+        self.log(f"Delta: {item.filename} fetched {mb(fetched)} of {mb(size)} MB")
+        return True
+
+    def rebuild(self, sftp, r_path, old, plan, block, size, tmp, whole, stop_event, on_progress):
+        # Writes the new version into tmp. Returns the bytes read from the
+        # server, None if stopped, False if the result is not what the server
+        # hashed (the remote file changed meanwhile).
+        digest = hashlib.blake2b(digest_size=16)
+        done = fetched = 0
+        with sftp.open(r_path, "rb") as f, open(tmp, "wb") as out:
+            for start, end, source in plan_runs(plan, block, size):
+                if source is None:
+                    pieces = iter_chunks(f, start, end)
+                    fetched += end - start
+                else:
+                    pieces = read_range(old, source, end - start)
+                for data in pieces:
+                    if not data:
+                        return False
+                    out.write(data)
+                    digest.update(data)
+                    done += len(data)
+                    if on_progress:
+                        on_progress(done)
+                    if stop_event.is_set():
+                        return None
+        if done != size or digest.hexdigest() != whole:
+            return False
+        return fetched
+
+    def summary(self):
+        if not self.files:
+            return None
+        return f"Delta: {self.files} file(s), fetched {mb(self.fetched)} of {mb(self.bytes)} MB"
+
+
+def mb(size):
+    return round(size / 1024 / 1024, 1)
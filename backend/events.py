@@ -0,0 +1,99 @@
+import json
+import threading
+from collections import deque
+
+DEFAULT_CAPACITY = 2000
+
+
+class EventBus:
+    # Keeps the most recent events with increasing sequence numbers so a
+    # client that reconnects with Last-Event-ID can be sent what it missed.
+    def __init__(self, capacity=DEFAULT_CAPACITY, volatile=()):
+        self.events = deque(maxlen=capacity)
+        self.seq = 0
+        # Sequence number of the latest event not of a volatile kind (such as
+        # CPU samples), for ETags that only change with the state they cover.
+        self.volatile = frozenset(volatile)
+        self.changed = 0
+        # Events up to this sequence number are no longer held.
+        self.floor = 0
+        # forward(kind, data), if set, also gets every published event (see
+        # relay.py). A mirror only forwards: its events arrive via mirror(),
+        # numbered by the relay, so all mirrors agree on sequence numbers.
+        self.forward = None
+        self.mirrored = False
+        # Reentrant so publishers can hold it while changing the state an
+        # event describes, keeping snapshot() consistent with the sequence.
+        self.lock = threading.RLock()
+        self.cond = threading.Condition(self.lock)
+
+    def publish(self, kind, data, shared=None):
+        # shared, if given, is forwarded in place of data.
+        with self.cond:
+            if self.forward:
+                self.forward(kind, data if shared is None else shared)
+            if self.mirrored:
+                return None
+            return self.publish_local(kind, data)
+
+    def publish_local(self, kind, data):
+        # Not forwarded, e.g. for events that came from another process.
+        with self.cond:
+            self.seq += 1
+            self._append(self.seq, kind, data)
+            return self.seq
+
+    def mirror(self, seq, kind, data):
+        with self.cond:
+            self.seq = seq
+            self._append(seq, kind, data)
+
+    def reset(self, seq):
+        # Drops every held event and continues from seq; clients further back
+        # get a fresh snapshot.
+        with self.cond:
+            self.events.clear()
+            self.seq = self.floor = self.changed = seq
+            self.cond.notify_all()
+
+    def _append(self, seq, kind, data):
+        if len(self.events) == self.events.maxlen:
+            self.floor = self.events[0][0]
+        self.events.append((seq, kind, data))
+        if kind not in self.volatile:
+            self.changed = seq
+        self.cond.notify_all()
+
+    def snapshot(self, build):
+        # Runs build() with publishing paused; returns (seq, result) so the
+        # result is exactly the state as of that sequence number.
+        with self.cond:
+            return self.seq, build()
+
+    def last_seq(self):
+        with self.cond:
+            return self.seq
+
+    def last_change(self):
+        with self.cond:
+            return self.changed
+
+    def since(self, seq):
+        # Returns (events after seq, complete). complete is False when some of
+        # them have already been dropped and the caller needs a full snapshot.
+        with self.cond:
+            return self._since(seq)
+
+    def _since(self, seq):
+        if seq > self.seq or seq < self.floor:
+            return [], False
+        return [event for event in self.events if event[0] > seq], True
+
+    def wait(self, seq, timeout):
+        with self.cond:
+            self.cond.wait_for(lambda: self.seq != seq, timeout)
+            return self._since(seq)
+
+
+def format_event(seq, kind, data):
+    return f"id: {seq}\nevent: {kind}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
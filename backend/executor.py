@@ -0,0 +1,284 @@
+import threading
+import time
+
+DEFAULT_WORKERS = 2
+# Lower runs first; manual runs jump ahead of anything the scheduler queued.
+PRIORITIES = {"manual": 0, "scheduled": 10}
+# Finished entries kept for the wait-time figures in describe().
+HISTORY = 200
+
+
+def init_job_queue(conn):
+    c = conn.cursor()
+    c.execute(
+        "CREATE TABLE IF NOT EXISTS job_queue (id INTEGER PRIMARY KEY, job TEXT, source TEXT, priority INTEGER, "
+        "status TEXT, enqueued REAL, started REAL, finished REAL)"
+    )
+    c.execute("CREATE INDEX IF NOT EXISTS idx_job_queue_status ON job_queue (status, priority, id)")
+    conn.commit()
+
+
+def describe_queue(conn, summary):
+    # A JobExecutor.summary() plus how long each entry has waited so far and
+    # the wait times of recently started runs. Works from a summary relayed
+    # by another process too.
+    out = {**summary, "queued": [dict(entry) for entry in summary["queued"]]}
+    now = time.time()
+    for entry in out["queued"]:
+        entry["waiting"] = round(now - entry["enqueued"], 1)
+    row = conn.execute(
+        "SELECT COUNT(*), AVG(started - enqueued), MAX(started - enqueued) FROM "
+        "(SELECT started, enqueued FROM job_queue WHERE started IS NOT NULL ORDER BY id DESC LIMIT ?)",
+        (HISTORY,),
+    ).fetchone()
+    out["recent"] = {
+        "runs": row[0],
+        "avg_wait": round(row[1], 1) if row[1] is not None else None,
+        "max_wait": round(row[2], 1) if row[2] is not None else None,
+    }
+    return out
+
+
+class JobExecutor:
+    # Runs backup jobs on a fixed pool of worker threads. Pending runs live in
+    # the job_queue table so they survive a restart; a job is never queued
+    # twice or run twice at the same time. resource(job), if given, names a
+    # shared resource (a remote host) of which at most resource_limit jobs
+    # may hold at once; queued jobs behind a busy one are passed over. It is
+    # looked up when a job is about to start, so config changes made while
+    # it waited count.
+    def __init__(self, connect, run_job, workers=DEFAULT_WORKERS, log=print, on_change=None, on_start=None,
+                 resource=None, resource_limit=None):
+        self.connect = connect
+        self.run_job = run_job
+        self.workers = max(1, workers)
+        self.resource = resource
+        self.resource_limit = resource_limit
+        self.log = log
+        self.on_change = on_change
+        self.on_start = on_start
+        # Guards the in-memory queue only; database writes happen outside it.
+        self.cond = threading.Condition()
+        # Bumped on every change a waiting worker may care about.
+        self.version = 0
+        # Serializes submit() so a job is inserted at most once.
+        self.submit_lock = threading.Lock()
+        self.queued = []
+        self.running = {}
+        self.closed = False
+        self.threads = []
+
+    def start(self):
+        # Anything still marked running was cut off by a restart; run it again.
+        with self.connect() as conn:
+            conn.execute("UPDATE job_queue SET status = 'queued', started = NULL WHERE status = 'running'")
+            rows = conn.execute(
+                "SELECT id, job, source, priority, enqueued FROM job_queue WHERE status = 'queued' ORDER BY id"
+            ).fetchall()
+        with self.cond:
+            self.queued = [
+                {"id": row[0], "job": row[1], "source": row[2], "priority": row[3], "enqueued": row[4]}
+                for row in rows
+            ]
+            self.notify()
+        if rows:
+            self.log(f"[QUEUE] Restored {len(rows)} queued run(s).")
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self.work, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        self.changed()
+
+    def submit(self, job, source="manual"):
+        # Returns (entry, deduplicated). A job already waiting in the queue is
+        # not added again, but is promoted if this request has higher priority.
+        priority = PRIORITIES.get(source, PRIORITIES["scheduled"])
+        promoted = None
+        with self.submit_lock:
+            with self.cond:
+                existing = next((e for e in self.queued if e["job"] == job), None)
+                if existing and priority < existing["priority"]:
+                    existing["priority"] = priority
+                    existing["source"] = source
+                    promoted = existing["id"]
+                    self.notify()
+                if existing:
+                    entry = dict(existing)
+            if existing:
+                if promoted is not None:
+                    with self.connect() as conn:
+                        conn.execute(
+                            "UPDATE job_queue SET priority = ?, source = ? WHERE id = ?", (priority, source, promoted)
+                        )
+                self.changed()
+                return entry, True
+            entry = {"job": job, "source": source, "priority": priority, "enqueued": time.time()}
+            with self.connect() as conn:
+                cur = conn.execute(
+                    "INSERT INTO job_queue (job, source, priority, status, enqueued) VALUES (?, ?, ?, 'queued', ?)",
+                    (job, source, priority, entry["enqueued"]),
+                )
+                entry["id"] = cur.lastrowid
+            with self.cond:
+                self.queued.append(entry)
+                self.notify()
+                entry = dict(entry)
+        self.changed()
+        return entry, False
+
+    def cancel(self, entry_id=None, job=None):
+        # Drops queued (not running) entries by id or by job; returns how many.
+        with self.cond:
+            dropped = [e for e in self.queued if e["id"] == entry_id or (job is not None and e["job"] == job)]
+            if not dropped:
+                return 0
+            self.queued = [e for e in self.queued if e not in dropped]
+            self.notify()
+        with self.connect() as conn:
+            conn.executemany(
+                "UPDATE job_queue SET status = 'cancelled', finished = ? WHERE id = ?",
+                [(time.time(), e["id"]) for e in dropped],
+            )
+        self.changed()
+        return len(dropped)
+
+    def resource_of(self, job):
+        return self.resource(job) if self.resource else None
+
+    def lookup_resource(self, job):
+        # A failed lookup (the database locked, the target just deleted) must
+        # not take the worker down; the job then runs uncapped.
+        try:
+            return self.resource_of(job)
+        except Exception as e:
+            self.log(f"[QUEUE] Could not resolve the host of {job}: {str(e)}")
+            return None
+
+    def notify(self):
+        # Called with cond held.
+        self.version += 1
+        self.cond.notify_all()
+
+    def next_entry(self, resources):
+        # Highest priority, then oldest, among jobs that are not running and
+        # whose resource has a free slot. resources maps job -> resource;
+        # jobs missing from it were queued since and wait for the next pass.
+        busy = {}
+        for entry in self.running.values():
+            if entry["resource"]:
+                busy[entry["resource"]] = busy.get(entry["resource"], 0) + 1
+        eligible = [
+            e
+            for e in self.queued
+            if e["job"] not in self.running
+            and e["job"] in resources
+            and not (
+                self.resource_limit
+                and resources[e["job"]]
+                and busy.get(resources[e["job"]], 0) >= self.resource_limit
+            )
+        ]
+        if not eligible:
+            return None
+        return min(eligible, key=lambda e: (e["priority"], e["id"]))
+
+    def claim(self):
+        # Waits for an entry that may start and moves it to running, or
+        # returns None once closed. Resources are looked up outside the lock
+        # since that may read the database.
+        while True:
+            with self.cond:
+                while not self.closed and not any(e["job"] not in self.running for e in self.queued):
+                    self.cond.wait()
+                if self.closed:
+                    return None
+                jobs = {e["job"] for e in self.queued if e["job"] not in self.running}
+                version = self.version
+            resources = {job: self.lookup_resource(job) for job in jobs}
+            with self.cond:
+                if self.closed:
+                    return None
+                entry = self.next_entry(resources)
+                if entry is not None:
+                    self.queued.remove(entry)
+                    entry["resource"] = resources[entry["job"]]
+                    entry["started"] = time.time()
+                    self.running[entry["job"]] = entry
+                    return entry
+                if self.version == version:
+                    self.cond.wait()
+
+    def work(self):
+        while True:
+            entry = self.claim()
+            if entry is None:
+                return
+            with self.connect() as conn:
+                conn.execute(
+                    "UPDATE job_queue SET status = 'running', started = ? WHERE id = ?",
+                    (entry["started"], entry["id"]),
+                )
+            self.changed()
+            if self.on_start:
+                self.on_start(entry)
+            status = "done"
+            try:
+                self.run_job(entry["job"])
+            except Exception as e:
+                status = "failed"
+                self.log(f"[{entry['job'].upper()}] Run failed: {str(e)}")
+            with self.connect() as conn:
+                conn.execute(
+                    "UPDATE job_queue SET status = ?, finished = ? WHERE id = ?", (status, time.time(), entry["id"])
+                )
+                conn.execute(
+                    "DELETE FROM job_queue WHERE status NOT IN ('queued', 'running') AND id NOT IN "
+                    "(SELECT id FROM job_queue WHERE status NOT IN ('queued', 'running') ORDER BY id DESC LIMIT ?)",
+                    (HISTORY,),
+                )
+            with self.cond:
+                del self.running[entry["job"]]
+                self.notify()
+            self.changed()
+
+    def changed(self):
+        if self.on_change:
+            self.on_change()
+
+    def summary(self):
+        # Only changes when the queue does, so it can go into the status
+        # snapshot; describe() adds the time-dependent figures.
+        with self.cond:
+            queued = sorted(self.queued, key=lambda e: (e["priority"], e["id"]))
+            return {
+                "workers": self.workers,
+                "depth": len(queued),
+                "running": [
+                    {
+                        "id": e["id"],
+                        "job": e["job"],
+                        "source": e["source"],
+                        "waited": round(e["started"] - e["enqueued"], 1),
+                        "resource": e["resource"],
+                    }
+                    for e in self.running.values()
+                ],
+                "queued": [
+                    {
+                        "id": e["id"],
+                        "job": e["job"],
+                        "source": e["source"],
+                        "enqueued": e["enqueued"],
+                    }
+                    for e in queued
+                ],
+            }
+
+    def describe(self):
+        with self.connect() as conn:
+            return describe_queue(conn, self.summary())
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.notify()
@@ -0,0 +1,32 @@
+import multiprocessing
+import os
+import subprocess
+import sys
+
+# gunicorn -c gunicorn.conf.py wsgi:app
+bind = os.getenv("BIND", f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '8080')}")
+workers = int(os.getenv("WEB_WORKERS", str(min(4, multiprocessing.cpu_count() * 2))))
+# Each open /api/events stream holds a thread for as long as the page is open.
+worker_class = "gthread"
+threads = int(os.getenv("WEB_THREADS", "16"))
+# create_app("web") runs once in the master; workers are forked from it.
+preload_app = True
+# Set RUN_WORKER=0 when the worker role runs as its own service.
+RUN_WORKER = os.getenv("RUN_WORKER", "1") != "0"
+worker_process = []
+
+
+def on_starting(server):
+    if RUN_WORKER:
+        app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+        worker_process.append(subprocess.Popen([sys.executable, app_path, "--role", "worker"]))
+        server.log.info(f"Started backup worker (pid {worker_process[0].pid})")
+
+
+def on_exit(server):
+    for process in worker_process:
+        process.terminate()
+        try:
+            process.wait(30)
+        except subprocess.TimeoutExpired:
+            process.kill()
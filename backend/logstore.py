@@ -0,0 +1,198 @@
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+DEFAULT_CAPACITY = 5000
+DEFAULT_FILE_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_FILE_BACKUPS = 5
+DEFAULT_RETENTION_DAYS = 30
+WRITE_BATCH = 500
+WRITE_INTERVAL = 1.0
+PRUNE_INTERVAL = 3600
+
+# "[SFTP] Connecting..." -> job "sftp"; untagged lines belong to "system".
+JOB_TAG = re.compile(r"^\[([A-Za-z0-9_-]+)\]\s*")
+
+
+def parse_job(message):
+    match = JOB_TAG.match(message)
+    return match.group(1).lower() if match else "system"
+
+
+class LogBuffer:
+    # Fixed-capacity ring of log entries, each with an increasing sequence
+    # number so readers can ask for just the lines they have not seen.
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.entries = deque(maxlen=max(1, capacity))
+        self.seq = 0
+        # Lines up to this sequence number have been dropped.
+        self.floor = 0
+        self.lock = threading.Lock()
+
+    def append(self, timestamp, job, message, line, seq=None):
+        # seq, if given, must be higher than the last one; it need not be
+        # the next one (web workers number lines by relay id).
+        with self.lock:
+            self.seq = self.seq + 1 if seq is None else seq
+            if len(self.entries) == self.entries.maxlen:
+                self.floor = self.entries[0]["seq"]
+            entry = {"seq": self.seq, "time": timestamp, "job": job, "message": message, "line": line}
+            self.entries.append(entry)
+            return entry
+
+    def clear(self, seq=0):
+        with self.lock:
+            self.entries.clear()
+            self.seq = self.floor = seq
+
+    def since(self, seq, limit=None):
+        # Returns (entries newer than seq, last seq, truncated). truncated is
+        # True when lines after seq have already been dropped from the ring.
+        with self.lock:
+            truncated = seq < self.floor
+            entries = [entry for entry in self.entries if entry["seq"] > seq] if seq < self.seq else []
+            last = self.seq
+        if limit is not None and len(entries) > limit:
+            entries = entries[:limit]
+            last = entries[-1]["seq"]
+        return entries, last, truncated
+
+    def tail(self, count):
+        with self.lock:
+            return [entry["line"] for entry in list(self.entries)[-count:]]
+
+
+def init_log_store(conn):
+    c = conn.cursor()
+    c.execute("CREATE TABLE IF NOT EXISTS log_entries (id INTEGER PRIMARY KEY, ts TEXT, job TEXT, message TEXT)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_log_entries_ts ON log_entries (ts)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_log_entries_job_ts ON log_entries (job, ts)")
+    conn.commit()
+
+
+def rotating_file_logger(log_dir, max_bytes=DEFAULT_FILE_MAX_BYTES, backups=DEFAULT_FILE_BACKUPS):
+    os.makedirs(log_dir, exist_ok=True)
+    logger = logging.getLogger(f"backup-log:{log_dir}")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    if not logger.handlers:
+        handler = logging.handlers.RotatingFileHandler(
+            os.path.join(log_dir, "backup.log"), maxBytes=max_bytes, backupCount=backups, encoding="utf-8"
+        )
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+    return logger
+
+
+class LogWriter:
+    # Persists log entries off the calling thread: each batch is appended to a
+    # size-rotated text file and inserted into log_entries for searching.
+    def __init__(self, connect, log_dir, max_bytes=DEFAULT_FILE_MAX_BYTES, backups=DEFAULT_FILE_BACKUPS,
+                 retention_days=DEFAULT_RETENTION_DAYS):
+        self.connect = connect
+        self.log_dir = log_dir
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.file_logger = None
+        self.retention_days = retention_days
+        self.pending = queue.Queue()
+        self.last_prune = 0.0
+        self.closed = threading.Event()
+        self.thread = None
+
+    def start(self):
+        # Entries written before this wait in the queue. Only the process
+        # that persists logs opens the file.
+        self.file_logger = rotating_file_logger(self.log_dir, self.max_bytes, self.backups)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write(self, timestamp, job, message):
+        self.pending.put((timestamp, job, message))
+
+    def run(self):
+        while not (self.closed.is_set() and self.pending.empty()):
+            batch = []
+            deadline = time.monotonic() + WRITE_INTERVAL
+            while len(batch) < WRITE_BATCH:
+                try:
+                    batch.append(self.pending.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            if batch:
+                self.flush(batch)
+            if self.retention_days and time.monotonic() - self.last_prune > PRUNE_INTERVAL:
+                self.prune()
+
+    def flush(self, batch):
+        for timestamp, job, message in batch:
+            self.file_logger.info(f"{timestamp} {job.upper():8} {message}")
+        try:
+            with self.connect() as conn:
+                conn.executemany("INSERT INTO log_entries (ts, job, message) VALUES (?, ?, ?)", batch)
+        except Exception as e:
+            self.file_logger.info(f"{batch[-1][0]} {'SYSTEM':8} Log index write failed: {str(e)}")
+
+    def prune(self):
+        self.last_prune = time.monotonic()
+        cutoff = (datetime.now() - timedelta(days=self.retention_days)).strftime("%Y-%m-%d %H:%M:%S")
+        try:
+            with self.connect() as conn:
+                conn.execute("DELETE FROM log_entries WHERE ts < ?", (cutoff,))
+        except Exception as e:
+            self.file_logger.info(f"{cutoff} {'SYSTEM':8} Log index prune failed: {str(e)}")
+
+    def close(self, timeout=5):
+        self.closed.set()
+        if self.thread:
+            self.thread.join(timeout)
+
+
+def normalize_time(value, end=False):
+    # Accepts "YYYY-MM-DD", "YYYY-MM-DDTHH:MM[:SS]" or the stored format; a bare
+    # date used as an upper bound covers that whole day.
+    if not value:
+        return None
+    value = value.strip().replace("T", " ")
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if end and len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def search_logs(conn, job=None, start=None, end=None, text=None, before_id=None, limit=200):
+    # Newest first. Pass the id of a page's last entry as before_id for the next.
+    clauses = []
+    params = []
+    if job:
+        clauses.append("job = ?")
+        params.append(job.lower())
+    if start:
+        clauses.append("ts >= ?")
+        params.append(start)
+    if end:
+        clauses.append("ts < ?")
+        params.append(end)
+    if text:
+        clauses.append("message LIKE ? ESCAPE '\\'")
+        params.append("%" + text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+    if before_id:
+        clauses.append("(ts, id) < ((SELECT ts FROM log_entries WHERE id = ?), ?)")
+        params.extend((before_id, before_id))
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    # Ordering by (ts, id) lets the ts and (job, ts) indexes return rows in
+    # order, so a page never sorts the whole matching range.
+    c = conn.cursor()
+    c.execute(
+        f"SELECT id, ts, job, message FROM log_entries {where} ORDER BY ts DESC, id DESC LIMIT ?", (*params, limit)
+    )
+    return [{"id": row[0], "time": row[1], "job": row[2], "message": row[3]} for row in c.fetchall()]
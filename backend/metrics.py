@@ -0,0 +1,131 @@
+import threading
+import time
+from array import array
+
+# (name, seconds per slot, slots): raw for 10 minutes, 1-minute rollups for a
+# day, 15-minute rollups for a month.
+TIERS = (
+    ("raw", 1, 600),
+    ("1m", 60, 1440),
+    ("15m", 900, 2880),
+)
+METRICS = ("cpu", "rss_mb", "disk_write_mb_s", "net_mb_s", "active_transfers")
+
+
+class Series:
+    # Ring of fixed-width slots in flat typed arrays. Each slot keeps the
+    # sum, count and max of the samples that fell into it; slot_ids records
+    # which absolute slot is stored there so stale entries are never read.
+    def __init__(self, resolution, capacity):
+        self.resolution = resolution
+        self.capacity = capacity
+        self.slot_ids = array("q", [-1]) * capacity
+        self.sums = array("d", [0.0]) * capacity
+        self.counts = array("l", [0]) * capacity
+        self.maxes = array("d", [0.0]) * capacity
+
+    def add(self, timestamp, value):
+        slot = int(timestamp // self.resolution)
+        i = slot % self.capacity
+        if self.slot_ids[i] != slot:
+            self.slot_ids[i] = slot
+            self.sums[i] = 0.0
+            self.counts[i] = 0
+            self.maxes[i] = value
+        self.sums[i] += value
+        self.counts[i] += 1
+        if value > self.maxes[i]:
+            self.maxes[i] = value
+
+    def oldest(self, now):
+        return (int(now // self.resolution) - self.capacity + 1) * self.resolution
+
+    def query(self, start, end):
+        # [slot start time, average, max] for every filled slot in range.
+        first = max(int(start // self.resolution), int(end // self.resolution) - self.capacity + 1)
+        last = int(end // self.resolution)
+        points = []
+        for slot in range(first, last + 1):
+            i = slot % self.capacity
+            if self.slot_ids[i] == slot and self.counts[i]:
+                points.append([slot * self.resolution, round(self.sums[i] / self.counts[i], 3), round(self.maxes[i], 3)])
+        return points
+
+
+class MetricsStore:
+    def __init__(self, metrics=METRICS, tiers=TIERS):
+        self.tiers = tiers
+        self.series = {metric: {name: Series(res, cap) for name, res, cap in tiers} for metric in metrics}
+        self.lock = threading.Lock()
+
+    def record(self, values, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        with self.lock:
+            for metric, value in values.items():
+                if value is None or metric not in self.series:
+                    continue
+                for series in self.series[metric].values():
+                    series.add(timestamp, float(value))
+
+    def pick_tier(self, start, now):
+        # Finest tier that still covers start; the coarsest one otherwise.
+        for name, resolution, capacity in self.tiers:
+            if start >= (int(now // resolution) - capacity + 1) * resolution:
+                return name
+        return self.tiers[-1][0]
+
+    def query(self, metric, start, end, tier=None):
+        now = time.time()
+        tier = tier or self.pick_tier(start, now)
+        with self.lock:
+            series = self.series[metric][tier]
+            return {
+                "metric": metric,
+                "tier": tier,
+                "resolution": series.resolution,
+                "points": series.query(start, min(end, now)),
+            }
+
+    def latest(self):
+        now = time.time()
+        with self.lock:
+            out = {}
+            for metric, tiers in self.series.items():
+                points = tiers[self.tiers[0][0]].query(now - 5, now)
+                out[metric] = points[-1][1] if points else None
+            return out
+
+    def describe(self):
+        return {
+            "metrics": list(self.series),
+            "tiers": [{"name": name, "resolution": res, "retention": res * cap} for name, res, cap in self.tiers],
+        }
+
+
+class HostSampler:
+    # Turns psutil's cumulative counters into per-second rates between calls.
+    def __init__(self, psutil):
+        self.psutil = psutil
+        self.process = psutil.Process() if psutil else None
+        self.previous = None
+
+    def sample(self):
+        if not self.psutil:
+            return {}
+        now = time.monotonic()
+        disk = self.psutil.disk_io_counters()
+        net = self.psutil.net_io_counters()
+        counters = (
+            now,
+            disk.write_bytes if disk else None,
+            (net.bytes_recv + net.bytes_sent) if net else None,
+        )
+        values = {"rss_mb": round(self.process.memory_info().rss / 1024 / 1024, 2)}
+        if self.previous:
+            elapsed = now - self.previous[0]
+            if elapsed > 0:
+                for metric, new, old in zip(("disk_write_mb_s", "net_mb_s"), counters[1:], self.previous[1:]):
+                    if new is not None and old is not None:
+                        values[metric] = max(0.0, (new - old) / elapsed / 1024 / 1024)
+        self.previous = counters
+        return values
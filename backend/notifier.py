@@ -0,0 +1,218 @@
+import ipaddress
+import queue
+import smtplib
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+SMTP_TIMEOUT = 30
+# An idle SMTP session is closed after this long rather than left for the
+# server to drop; the next message opens a new one.
+SESSION_IDLE = 60
+MAX_ATTEMPTS = 5
+RETRY_BASE = 10
+RETRY_MAX = 600
+POLL_INTERVAL = 0.5
+
+
+def is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def open_smtp(conf):
+    server = smtplib.SMTP(conf["host"], conf["port"], timeout=SMTP_TIMEOUT)
+    try:
+        server.ehlo()
+        # Remote servers must offer STARTTLS; a local relay may skip it.
+        if server.has_extn("starttls") or not is_loopback(conf["host"]):
+            server.starttls()
+            server.ehlo()
+        if conf.get("user"):
+            server.login(conf["user"], conf["password"])
+        return server
+    except BaseException:
+        server.close()
+        raise
+
+
+def build_message(conf, subject, body):
+    msg = MIMEMultipart()
+    msg["From"] = conf["from_addr"]
+    msg["To"] = conf["to_addr"]
+    msg["Subject"] = subject
+    msg.attach(MIMEText(body, "plain"))
+    return msg.as_string()
+
+
+def digest_message(items):
+    failed = sum(1 for _, subject, _ in items if "fail" in subject.lower())
+    subject = f"Backup digest: {len(items)} notification(s)"
+    if failed:
+        subject += f", {failed} failed"
+    parts = []
+    for created, item_subject, body in items:
+        indented = "\n".join(f"    {line}" for line in body.splitlines())
+        parts.append(f"[{created.strftime('%Y-%m-%d %H:%M:%S')}] {item_subject}\n{indented}")
+    return subject, "\n\n".join(parts)
+
+
+class Notifier:
+    # Sends notification emails from a background thread so a slow or dead
+    # mail server never holds up a backup. One SMTP session is reused while
+    # messages keep coming; failed sends are retried with exponential backoff.
+    # When the config has digest_minutes set, notifications are collected and
+    # sent as one summary per window instead.
+    def __init__(self, get_config, log=print, connect=open_smtp, max_attempts=MAX_ATTEMPTS, retry_base=RETRY_BASE,
+                 retry_max=RETRY_MAX):
+        self.get_config = get_config
+        self.log = log
+        self.connect = connect
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.pending = queue.Queue()
+        # Messages ready to go, each {"subject", "body", "attempts", "due"}.
+        self.outbox = deque()
+        self.digest = []
+        self.digest_started = None
+        self.server = None
+        self.server_key = None
+        self.last_used = 0.0
+        self.sent = 0
+        self.closed = threading.Event()
+        self.thread = None
+
+    def start(self):
+        # Messages sent before this wait in the queue.
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def send(self, subject, body):
+        self.pending.put((datetime.now(), subject, body))
+
+    def run(self):
+        while True:
+            try:
+                item = self.pending.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                item = None
+            closing = self.closed.is_set()
+            if item:
+                try:
+                    self.accept(item)
+                except Exception as e:
+                    # No config to decide on a digest; send it on its own.
+                    self.log(f"Notification config unavailable: {str(e)}")
+                    self.outbox.append({"subject": item[1], "body": item[2], "attempts": 0, "due": 0.0})
+            if self.digest and (closing or self.digest_due()):
+                subject, body = digest_message(self.digest)
+                self.digest = []
+                self.digest_started = None
+                self.outbox.append({"subject": subject, "body": body, "attempts": 0, "due": 0.0})
+            self.deliver_due(closing)
+            if self.server and time.monotonic() - self.last_used > SESSION_IDLE:
+                self.close_session()
+            if closing and self.pending.empty() and not self.digest:
+                self.close_session()
+                return
+
+    def accept(self, item):
+        created, subject, body = item
+        if self.digest_window():
+            if not self.digest:
+                self.digest_started = time.monotonic()
+            self.digest.append(item)
+        else:
+            self.outbox.append({"subject": subject, "body": body, "attempts": 0, "due": 0.0})
+
+    def digest_window(self):
+        conf = self.get_config()
+        return (conf.get("digest_minutes") or 0) * 60 if conf else 0
+
+    def digest_due(self):
+        return time.monotonic() - self.digest_started >= self.digest_window()
+
+    def deliver_due(self, closing=False):
+        # In order; a message waiting on its backoff holds back later ones.
+        # When closing, everything left gets one last try.
+        while self.outbox and (closing or self.outbox[0]["due"] <= time.monotonic()):
+            message = self.outbox[0]
+            try:
+                delivered = self.deliver(message)
+            except Exception as e:
+                # A bad config or message counts as a failed attempt instead
+                # of ending the thread and every notification after it.
+                self.close_session()
+                self.log(f"Failed to send email: {str(e)}")
+                delivered = False
+            if delivered:
+                self.outbox.popleft()
+                continue
+            message["attempts"] += 1
+            if closing or message["attempts"] >= self.max_attempts:
+                self.log(f"Email dropped after {message['attempts']} attempt(s): {message['subject']}")
+                self.outbox.popleft()
+                continue
+            delay = min(self.retry_max, self.retry_base * 2 ** (message["attempts"] - 1))
+            message["due"] = time.monotonic() + delay
+            self.log(f"Retrying email in {delay}s (attempt {message['attempts']}/{self.max_attempts}).")
+            return
+
+    def deliver(self, message):
+        conf = self.get_config()
+        if not conf or not conf["host"]:
+            self.log("Notification skipped: No SMTP config.")
+            return True
+        payload = build_message(conf, message["subject"], message["body"])
+        while True:
+            reused = self.server is not None
+            try:
+                server = self.session(conf)
+                server.sendmail(conf["from_addr"], conf["to_addr"], payload)
+                self.last_used = time.monotonic()
+                self.sent += 1
+                return True
+            except smtplib.SMTPServerDisconnected as e:
+                self.close_session()
+                if reused:
+                    # The server dropped the idle session; reconnect once.
+                    continue
+                error = e
+            except (smtplib.SMTPException, OSError) as e:
+                self.close_session()
+                error = e
+            self.log(f"Failed to send email: {str(error)}")
+            return False
+
+    def session(self, conf):
+        key = (conf["host"], conf["port"], conf.get("user"), conf.get("password"))
+        if self.server and self.server_key != key:
+            self.close_session()
+        if not self.server:
+            self.server = self.connect(conf)
+            self.server_key = key
+        return self.server
+
+    def close_session(self):
+        server, self.server = self.server, None
+        if server:
+            try:
+                server.quit()
+            except Exception:
+                server.close()
+
+    def stats(self):
+        return {"pending": self.pending.qsize() + len(self.outbox), "digest": len(self.digest), "sent": self.sent}
+
+    def close(self, timeout=10):
+        self.closed.set()
+        if self.thread:
+            self.thread.join(timeout)
@@ -0,0 +1,90 @@
+import threading
+import time
+from collections import deque
+
+# The rate is averaged over this many seconds of samples, so one slow file
+# or a burst of small ones does not swing the ETA around.
+RATE_WINDOW = 30
+SAMPLE_INTERVAL = 1.0
+
+
+class ProgressTracker:
+    # Byte-level progress for one run. Totals are only known once start() is
+    # called with the pre-scan result; before that (or without a scan) the
+    # done counters and rate still work but there is no percent or ETA.
+    def __init__(self, window=RATE_WINDOW):
+        self.lock = threading.Lock()
+        self.window = window
+        self.total_files = None
+        self.total_bytes = None
+        self.files_done = 0
+        self.bytes_done = 0
+        # Remote path -> bytes read so far, for files still in flight.
+        self.partial = {}
+        self.samples = deque()
+        self.started = time.monotonic()
+
+    def start(self, files, size):
+        with self.lock:
+            self.total_files = files
+            self.total_bytes = size
+
+    def advance(self, r_path, done):
+        with self.lock:
+            self.partial[r_path] = done
+
+    def finish(self, r_path, size):
+        with self.lock:
+            self.partial.pop(r_path, None)
+            self.files_done += 1
+            self.bytes_done += size
+
+    def current_bytes(self):
+        return self.bytes_done + sum(self.partial.values())
+
+    def sample(self, now):
+        done = self.current_bytes()
+        if not self.samples or now - self.samples[-1][0] >= SAMPLE_INTERVAL:
+            self.samples.append((now, done))
+        while len(self.samples) > 2 and now - self.samples[0][0] > self.window:
+            self.samples.popleft()
+        return done
+
+    def rate(self, now, done):
+        if not self.samples:
+            return 0.0
+        first_time, first_done = self.samples[0]
+        elapsed = now - first_time
+        if elapsed <= 0:
+            elapsed = now - self.started
+            first_done = 0
+        return max(0.0, (done - first_done) / elapsed) if elapsed > 0 else 0.0
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self.lock:
+            done = self.sample(now)
+            rate = self.rate(now, done)
+            snap = {
+                "files_done": self.files_done,
+                "files_total": self.total_files,
+                "bytes_done": done,
+                "bytes_total": self.total_bytes,
+                "rate": round(rate),
+                "percent": None,
+                "eta": None,
+            }
+            if self.total_bytes is not None:
+                if self.total_bytes:
+                    percent = done / self.total_bytes * 100
+                elif self.total_files:
+                    percent = self.files_done / self.total_files * 100
+                else:
+                    percent = 100.0
+                snap["percent"] = round(min(100.0, percent), 1)
+                remaining = max(0, self.total_bytes - done)
+                if not remaining:
+                    snap["eta"] = 0
+                elif rate > 0:
+                    snap["eta"] = int(remaining / rate) + 1
+            return snap
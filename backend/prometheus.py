@@ -0,0 +1,182 @@
+import math
+import threading
+import time
+
+# Minimal Prometheus text-format (0.0.4) metrics, enough for a scrape endpoint
+# without pulling in prometheus_client.
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+DURATION_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (list(extra.items()) if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in pairs) + "}"
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.extend(self.render_sample(key, value))
+        return lines
+
+    def render_sample(self, key, value):
+        return [f"{self.name}{format_labels(self.labelnames, key)} {format_value(value)}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self.values[key] = (counts, total + value)
+
+    def render_sample(self, key, value):
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            labels = format_labels(self.labelnames, key, {"le": format_value(bound)})
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class BackupMetrics:
+    def __init__(self):
+        self.registry = Registry()
+        add = self.registry.add
+        self.bytes = add(Counter("backup_bytes_transferred_total", "Bytes transferred by backup jobs.", ["job"]))
+        self.files = add(Counter("backup_files_transferred_total", "Files transferred by backup jobs.", ["job"]))
+        self.failures = add(Counter("backup_file_failures_total", "Files that failed to transfer.", ["job"]))
+        self.runs = add(Counter("backup_runs_total", "Finished backup runs by result.", ["job", "result"]))
+        self.file_seconds = add(
+            Histogram("backup_file_transfer_seconds", "Per-file transfer latency.", ["job"], LATENCY_BUCKETS)
+        )
+        self.connect_seconds = add(
+            Histogram("backup_connect_seconds", "Time to connect and authenticate.", ["job"], LATENCY_BUCKETS)
+        )
+        self.ssh_sessions = add(
+            Counter("backup_ssh_sessions_total", "SSH/SFTP sessions used by runs, by pool reuse.", ["job", "reused"])
+        )
+        self.archive_seconds = add(
+            Histogram("backup_archive_seconds", "Time spent writing the archive after transfer.", ["job"], DURATION_BUCKETS)
+        )
+        self.run_seconds = add(Histogram("backup_run_seconds", "Wall time of whole backup runs.", ["job"], DURATION_BUCKETS))
+        self.compression_ratio = add(
+            Gauge("backup_compression_ratio", "Uncompressed/compressed size of the last archive.", ["job"])
+        )
+        self.last_success = add(
+            Gauge("backup_last_success_timestamp_seconds", "Unix time of the last successful run.", ["job"])
+        )
+        self.running = add(Gauge("backup_job_running", "1 while a job is running.", ["job"]))
+        self.active_transfers = add(Gauge("backup_active_transfers", "File transfers currently in flight."))
+        self.queue_depth = add(Gauge("backup_queue_depth", "Runs waiting in the job queue."))
+        self.queue_wait_seconds = add(
+            Histogram("backup_queue_wait_seconds", "Time runs spent queued before starting.", ["job"], DURATION_BUCKETS)
+        )
+
+    def listener(self, job):
+        return TransferListener(self, job)
+
+    def run_finished(self, job, result, seconds):
+        self.runs.inc(job=job, result=result)
+        self.run_seconds.observe(seconds, job=job)
+        if result == "success":
+            self.last_success.set(time.time(), job=job)
+
+    def render(self):
+        return self.registry.render()
+
+
+class TransferListener:
+    # Per-job hook handed to the transfer engines; see TransferStats.
+    def __init__(self, metrics, job):
+        self.metrics = metrics
+        self.job = job
+
+    def on_file(self, size, seconds=None):
+        self.metrics.files.inc(job=self.job)
+        if size:
+            self.metrics.bytes.inc(size, job=self.job)
+        if seconds is not None:
+            self.metrics.file_seconds.observe(seconds, job=self.job)
+
+    def on_bytes(self, size):
+        self.metrics.bytes.inc(size, job=self.job)
+
+    def on_failure(self):
+        self.metrics.failures.inc(job=self.job)
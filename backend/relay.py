@@ -0,0 +1,325 @@
+import json
+import os
+import queue
+import socket
+import threading
+import time
+
+# Rows kept in relay_events. A web worker that falls further behind than this
+# reloads the worker's snapshot instead of replaying.
+RELAY_CAPACITY = 5000
+WRITE_INTERVAL = 0.1
+WRITE_BATCH = 200
+POLL_INTERVAL = 0.2
+FOLLOW_BATCH = 1000
+SNAPSHOT_INTERVAL = 5
+TRIM_INTERVAL = 30
+# A worker whose snapshot is older than this is taken to be down.
+WORKER_TIMEOUT = 30
+COMMAND_POLL = 0.05
+COMMAND_TIMEOUT = 10
+# Finished commands are kept this long for troubleshooting.
+COMMAND_HISTORY = 3600
+
+
+class WorkerUnavailable(RuntimeError):
+    pass
+
+
+def init_relay(conn):
+    c = conn.cursor()
+    c.execute(
+        "CREATE TABLE IF NOT EXISTS relay_events (id INTEGER PRIMARY KEY, origin TEXT, kind TEXT, data TEXT, "
+        "created REAL)"
+    )
+    # last_id: the worker's follower position when the snapshot was taken;
+    # its own rows up to written are reflected in it too.
+    c.execute(
+        "CREATE TABLE IF NOT EXISTS relay_state (name TEXT PRIMARY KEY, data TEXT, origin TEXT, last_id INTEGER, "
+        "written INTEGER, updated REAL)"
+    )
+    c.execute(
+        "CREATE TABLE IF NOT EXISTS relay_commands (id INTEGER PRIMARY KEY, command TEXT, args TEXT, status TEXT, "
+        "result TEXT, created REAL, finished REAL)"
+    )
+    c.execute("CREATE INDEX IF NOT EXISTS idx_relay_commands_status ON relay_commands (status, id)")
+    conn.commit()
+
+
+def process_origin():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def worker_seen(conn):
+    # Seconds since the worker last stored a snapshot, or None if it never has.
+    row = conn.execute("SELECT updated FROM relay_state WHERE name = 'worker'").fetchone()
+    return time.time() - row[0] if row else None
+
+
+class Relay:
+    # Shares events between the processes of one installation through the
+    # database. Each process appends what it publishes to relay_events and a
+    # follower thread applies the other processes' rows in id order; with
+    # include_own a process applies its own rows too, so every web worker
+    # sees exactly the same sequence. The worker (started with snapshot)
+    # also stores its state every few seconds; a process started with seed
+    # loads that, plus the latest rows of the replay kinds, before following.
+    def __init__(self, connect, apply, lock, replay=(), replay_limit=1000, log=print):
+        self.connect = connect
+        self.apply = apply
+        self.lock = lock
+        self.snapshot = None
+        self.seed = None
+        self.replay = tuple(replay)
+        self.replay_limit = replay_limit
+        self.log = log
+        self.origin = None
+        self.include_own = False
+        # (origin, id): that process's rows up to id are already in the
+        # snapshot this process was seeded from.
+        self.skip = None
+        self.pending = queue.Queue()
+        self.last_written = 0
+        self.last_applied = 0
+        self.failed = False
+        self.started = False
+        self.closed = threading.Event()
+        self.threads = []
+
+    def start(self, snapshot=None, seed=None, include_own=False):
+        # Called in the process that uses it, i.e. after any fork.
+        # snapshot() returns the state to store, seed(snapshot, last_id, rows)
+        # loads it; both run with lock held.
+        self.origin = process_origin()
+        self.snapshot = snapshot
+        self.seed = seed
+        self.include_own = include_own
+        if self.seed:
+            self.resync()
+        else:
+            with self.connect() as conn:
+                self.last_applied = conn.execute("SELECT COALESCE(MAX(id), 0) FROM relay_events").fetchone()[0]
+        self.started = True
+        for target in (self.write_loop, self.follow_loop):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def send(self, kind, data):
+        self.pending.put(("event", kind, data))
+
+    def write_loop(self):
+        last_snapshot = last_trim = 0.0
+        while not (self.closed.is_set() and self.pending.empty()):
+            now = time.monotonic()
+            if self.snapshot and not self.closed.is_set() and now - last_snapshot >= SNAPSHOT_INTERVAL:
+                last_snapshot = now
+                # Under the publishers' lock, so every event the snapshot
+                # reflects is already queued ahead of it.
+                with self.lock:
+                    self.pending.put(("state", self.snapshot(), self.last_applied))
+            batch = []
+            deadline = now + WRITE_INTERVAL
+            while len(batch) < WRITE_BATCH:
+                try:
+                    batch.append(self.pending.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            if batch:
+                self.guard("write", self.write, batch)
+            if now - last_trim >= TRIM_INTERVAL:
+                last_trim = now
+                self.guard("trim", self.trim)
+
+    def write(self, batch):
+        with self.connect() as conn:
+            for item in batch:
+                if item[0] == "event":
+                    cur = conn.execute(
+                        "INSERT INTO relay_events (origin, kind, data, created) VALUES (?, ?, ?, ?)",
+                        (self.origin, item[1], json.dumps(item[2], separators=(",", ":")), time.time()),
+                    )
+                    self.last_written = cur.lastrowid
+                else:
+                    # The snapshot reflects every row up to the follower's
+                    # position when it was taken and this process's own rows
+                    # written so far, which may be further on.
+                    conn.execute(
+                        "INSERT INTO relay_state (name, data, origin, last_id, written, updated) "
+                        "VALUES ('worker', ?, ?, ?, ?, ?) ON CONFLICT(name) DO UPDATE SET data = excluded.data, "
+                        "origin = excluded.origin, last_id = excluded.last_id, written = excluded.written, "
+                        "updated = excluded.updated",
+                        (json.dumps(item[1], separators=(",", ":")), self.origin, item[2], self.last_written,
+                         time.time()),
+                    )
+
+    def trim(self):
+        with self.connect() as conn:
+            conn.execute(
+                "DELETE FROM relay_events WHERE id <= (SELECT MAX(id) FROM relay_events) - ?", (RELAY_CAPACITY,)
+            )
+
+    def follow_loop(self):
+        while not self.closed.is_set():
+            self.guard("follow", self.follow)
+            self.closed.wait(POLL_INTERVAL)
+
+    def follow(self):
+        resynced = False
+        while True:
+            with self.connect() as conn:
+                rows = conn.execute(
+                    "SELECT id, origin, kind, data FROM relay_events WHERE id > ? ORDER BY id LIMIT ?",
+                    (self.last_applied, FOLLOW_BATCH),
+                ).fetchall()
+            if not rows:
+                return
+            if self.seed and not resynced and rows[0][0] > self.last_applied + 1:
+                # Ids have no gaps, so rows were trimmed before we read them.
+                # Once is enough: if even the snapshot is older than what is
+                # left, carry on from the oldest row.
+                self.resync()
+                resynced = True
+                continue
+            with self.lock:
+                for row_id, origin, kind, data in rows:
+                    if self.include_own or origin != self.origin:
+                        # Replay kinds are not part of the snapshot.
+                        seeded = self.skip and origin == self.skip[0] and row_id <= self.skip[1]
+                        if not seeded or kind in self.replay:
+                            self.apply(row_id, kind, json.loads(data))
+                    self.last_applied = row_id
+            if len(rows) < FOLLOW_BATCH:
+                return
+
+    def resync(self):
+        with self.connect() as conn:
+            row = conn.execute(
+                "SELECT data, origin, last_id, written FROM relay_state WHERE name = 'worker'"
+            ).fetchone()
+            if row:
+                snapshot, last_id, skip = json.loads(row[0]), row[2], (row[1], row[3])
+            else:
+                snapshot, skip = None, None
+                last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM relay_events").fetchone()[0]
+            rows = []
+            if self.replay:
+                marks = ", ".join("?" for _ in self.replay)
+                rows = conn.execute(
+                    f"SELECT id, kind, data FROM relay_events WHERE id <= ? AND kind IN ({marks}) "
+                    "ORDER BY id DESC LIMIT ?",
+                    (last_id, *self.replay, self.replay_limit),
+                ).fetchall()
+        with self.lock:
+            self.seed(snapshot, last_id, [(row_id, kind, json.loads(data)) for row_id, kind, data in reversed(rows)])
+            self.last_applied = last_id
+            self.skip = skip
+
+    def guard(self, action, fn, *args):
+        # Logs the first failure of a streak only; logging goes through the
+        # relay too, so one line per retry would feed itself.
+        try:
+            fn(*args)
+            self.failed = False
+        except Exception as e:
+            if not self.failed:
+                self.log(f"[SYSTEM] Relay {action} failed: {str(e)}")
+            self.failed = True
+
+    def close(self, timeout=5):
+        self.closed.set()
+        for thread in self.threads:
+            thread.join(timeout)
+
+
+class CommandChannel:
+    # Runs named commands in the worker on behalf of web workers: call()
+    # queues a row in relay_commands and waits for serve()'s result. Results
+    # travel as JSON, so handlers return plain lists, dicts and strings.
+    def __init__(self, connect, handlers, log=print):
+        self.connect = connect
+        self.handlers = handlers
+        self.log = log
+        self.closed = threading.Event()
+        self.thread = None
+
+    def call(self, command, timeout=COMMAND_TIMEOUT, **args):
+        with self.connect() as conn:
+            seen = worker_seen(conn)
+            if seen is None or seen > WORKER_TIMEOUT:
+                raise WorkerUnavailable("The backup worker is not running.")
+            cur = conn.execute(
+                "INSERT INTO relay_commands (command, args, status, created) VALUES (?, ?, 'queued', ?)",
+                (command, json.dumps(args), time.time()),
+            )
+            command_id = cur.lastrowid
+        deadline = time.monotonic() + timeout
+        while True:
+            time.sleep(COMMAND_POLL)
+            with self.connect() as conn:
+                status, result = conn.execute(
+                    "SELECT status, result FROM relay_commands WHERE id = ?", (command_id,)
+                ).fetchone()
+                if status == "done":
+                    return json.loads(result)
+                if status == "failed":
+                    raise RuntimeError(result)
+                if time.monotonic() > deadline:
+                    # Only withdrawn if the worker has not picked it up yet.
+                    expired = conn.execute(
+                        "UPDATE relay_commands SET status = 'expired', finished = ? WHERE id = ? AND status = 'queued'",
+                        (time.time(), command_id),
+                    ).rowcount
+                    if expired:
+                        raise WorkerUnavailable("The backup worker did not respond.")
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def serve(self):
+        last_prune = 0.0
+        while not self.closed.is_set():
+            try:
+                with self.connect() as conn:
+                    rows = conn.execute(
+                        "SELECT id, command, args FROM relay_commands WHERE status = 'queued' ORDER BY id"
+                    ).fetchall()
+                for command_id, command, args in rows:
+                    self.run(command_id, command, json.loads(args))
+                if time.monotonic() - last_prune > COMMAND_HISTORY / 10:
+                    last_prune = time.monotonic()
+                    with self.connect() as conn:
+                        conn.execute(
+                            "DELETE FROM relay_commands WHERE status != 'queued' AND finished < ?",
+                            (time.time() - COMMAND_HISTORY,),
+                        )
+            except Exception as e:
+                self.log(f"[SYSTEM] Command channel error: {str(e)}")
+                self.closed.wait(1)
+            self.closed.wait(COMMAND_POLL)
+
+    def run(self, command_id, command, args):
+        with self.connect() as conn:
+            claimed = conn.execute(
+                "UPDATE relay_commands SET status = 'running' WHERE id = ? AND status = 'queued'", (command_id,)
+            ).rowcount
+        if not claimed:
+            return
+        try:
+            handler = self.handlers.get(command)
+            if handler is None:
+                raise ValueError(f"Unknown command '{command}'.")
+            status, result = "done", json.dumps(handler(**args))
+        except Exception as e:
+            status, result = "failed", str(e)
+        with self.connect() as conn:
+            conn.execute(
+                "UPDATE relay_commands SET status = ?, result = ?, finished = ? WHERE id = ?",
+                (status, result, time.time(), command_id),
+            )
+
+    def close(self, timeout=5):
+        self.closed.set()
+        if self.thread:
+            self.thread.join(timeout)
@@ -0,0 +1,310 @@
+import posixpath
+import queue
+import stat
+import threading
+import time
+
+import paramiko
+
+from chunkstore import ChunkReader
+from transfer import (
+    DEFAULT_WORKERS,
+    READ_CHUNK,
+    READ_WINDOW,
+    SMALL_FILE_LIMIT,
+    TransferStats,
+    active_transfers,
+    clamp_workers,
+    open_channels,
+    run_pool,
+    walk_remote,
+)
+
+# Files are uploaded as "<name>.restoring" and renamed over the original once
+# complete, so a failed or stopped restore never leaves a truncated file.
+RESTORE_SUFFIX = ".restoring"
+# Paths listed per category in a dry-run diff; the counts cover everything.
+DIFF_LIMIT = 1000
+
+
+def member_path(name):
+    # "sftp_backups/wp-content/index.php" -> "wp-content/index.php". The
+    # archive's own backup_info.json (at the top level) is not site content.
+    parts = [part for part in name.split("/") if part not in ("", ".")]
+    if ".." in parts:
+        return None
+    if parts and parts[0].endswith("_backups"):
+        parts = parts[1:]
+    elif parts == ["backup_info.json"]:
+        return None
+    return "/".join(parts) or None
+
+
+def normalize_paths(paths):
+    # Selected paths are relative to the site root, like member_path() output.
+    normalized = []
+    for path in paths or []:
+        parts = [part for part in str(path).split("/") if part not in ("", ".")]
+        if parts and ".." not in parts:
+            normalized.append("/".join(parts))
+    return normalized
+
+
+def selected(rel, paths):
+    return not paths or any(rel == path or rel.startswith(path + "/") for path in paths)
+
+
+def archive_members(tar, stop_event):
+    # Yields (rel, is_dir, size, mtime, mode, reader) in archive order. A
+    # file's reader must be consumed before the next member is requested.
+    for member in tar:
+        if stop_event.is_set():
+            return
+        rel = member_path(member.name)
+        if rel is None:
+            continue
+        if member.isdir():
+            yield rel, True, 0, member.mtime, member.mode, None
+        elif member.isfile():
+            yield rel, False, member.size, member.mtime, member.mode, tar.extractfile(member)
+
+
+def snapshot_members(store_dir, snapshot, stop_event):
+    for path, entry_type, size, mtime, mode, chunks in snapshot["entries"]:
+        if stop_event.is_set():
+            return
+        rel = member_path(path)
+        if rel is None:
+            continue
+        if entry_type == "d":
+            yield rel, True, 0, mtime, mode, None
+        else:
+            yield rel, False, size, mtime, mode, ChunkReader(store_dir, chunks.split())
+
+
+def snapshot_totals(snapshot, paths):
+    files = size = 0
+    for path, entry_type, entry_size, _, _, _ in snapshot["entries"]:
+        rel = member_path(path)
+        if rel and entry_type != "d" and selected(rel, paths):
+            files += 1
+            size += entry_size
+    return files, size
+
+
+def remote_files(transport, remote_root, stop_event, log=print):
+    # rel -> (size, mtime) for every file under remote_root; {} if it does
+    # not exist yet.
+    sftp = paramiko.SFTPClient.from_transport(transport)
+    try:
+        try:
+            sftp.stat(remote_root)
+        except IOError:
+            return {}
+        return {
+            rel: (item.st_size, int(item.st_mtime or 0))
+            for _, rel, item in walk_remote(sftp, remote_root, stop_event, TransferStats(), log)
+            if not stat.S_ISDIR(item.st_mode)
+        }
+    finally:
+        sftp.close()
+
+
+def diff_tree(members, remote, paths=None, limit=DIFF_LIMIT):
+    # What a restore of members would do to a remote tree listed by
+    # remote_files(). Nothing is uploaded; file contents are not read.
+    diff = {
+        key: {"count": 0, "bytes": 0, "paths": []} for key in ("create", "overwrite", "unchanged", "remote_only")
+    }
+
+    def add(key, rel, size):
+        entry = diff[key]
+        entry["count"] += 1
+        entry["bytes"] += size
+        if len(entry["paths"]) < limit:
+            entry["paths"].append(rel)
+
+    seen = set()
+    for rel, is_dir, size, mtime, _, _ in members:
+        if is_dir or not selected(rel, paths):
+            continue
+        seen.add(rel)
+        current = remote.get(rel)
+        if current is None:
+            add("create", rel, size)
+        elif current == (size, int(mtime)):
+            add("unchanged", rel, size)
+        else:
+            add("overwrite", rel, size)
+    for rel, (size, _) in sorted(remote.items()):
+        if rel not in seen and selected(rel, paths):
+            add("remote_only", rel, size)
+    return diff
+
+
+class Pipe:
+    # Hands one large member from the reading thread to an upload worker with
+    # at most READ_WINDOW chunks in between.
+    def __init__(self):
+        self.chunks = queue.Queue(maxsize=READ_WINDOW)
+        self.closed = threading.Event()
+
+    def feed(self, reader, stop_event):
+        try:
+            while not self.closed.is_set():
+                data = b"" if stop_event.is_set() else reader.read(READ_CHUNK)
+                self.put(data)
+                if not data:
+                    return
+        except BaseException:
+            self.close()
+            raise
+
+    def put(self, data):
+        while not self.closed.is_set():
+            try:
+                self.chunks.put(data, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def read(self, n=-1):
+        while True:
+            try:
+                return self.chunks.get(timeout=1)
+            except queue.Empty:
+                if self.closed.is_set():
+                    raise InterruptedError("Restore stopped")
+
+    def close(self):
+        self.closed.set()
+
+
+def replace_remote(sftp, source, target):
+    try:
+        sftp.posix_rename(source, target)
+    except IOError:
+        # Plain SFTP rename refuses to overwrite an existing file.
+        try:
+            sftp.remove(target)
+        except IOError:
+            pass
+        sftp.rename(source, target)
+
+
+def ensure_remote_dir(sftp, r_dir, made):
+    if r_dir in made or r_dir in ("", ".", "/"):
+        return
+    try:
+        if stat.S_ISDIR(sftp.stat(r_dir).st_mode):
+            made.add(r_dir)
+            return
+    except IOError:
+        pass
+    ensure_remote_dir(sftp, posixpath.dirname(r_dir), made)
+    sftp.mkdir(r_dir)
+    made.add(r_dir)
+
+
+def restore_tree(
+    transport,
+    members,
+    remote_root,
+    stop_event,
+    workers=DEFAULT_WORKERS,
+    log=print,
+    paths=None,
+    remote=None,
+    progress=None,
+):
+    # Uploads archive members under remote_root. members is read strictly in
+    # order (usually straight off a tar stream): small files are read into
+    # memory and uploaded by the workers in parallel, a large one is piped
+    # chunk by chunk to a single worker. remote, if given (see
+    # remote_files), lets files that already match be skipped.
+    workers = clamp_workers(workers)
+    stats = TransferStats(progress=progress)
+    lister = paramiko.SFTPClient.from_transport(transport)
+    channels = open_channels(transport, workers, log)
+    tasks = queue.Queue(maxsize=max(1, len(channels)) * 2)
+    made = set()
+
+    def upload(sftp, task):
+        rel, r_path, size, mtime, mode, source = task
+        tmp = r_path + RESTORE_SUFFIX
+        done = 0
+        try:
+            if stop_event.is_set():
+                raise InterruptedError("Restore stopped")
+            started = time.monotonic()
+            with active_transfers.track(), sftp.open(tmp, "wb") as f:
+                f.set_pipelined(True)
+                chunks = [source] if isinstance(source, bytes) else iter(lambda: source.read(READ_CHUNK), b"")
+                for data in chunks:
+                    f.write(data)
+                    done += len(data)
+                    stats.add_partial(rel, done)
+                    if stop_event.is_set():
+                        raise InterruptedError("Restore stopped")
+            if stop_event.is_set():
+                raise InterruptedError("Restore stopped")
+            if done != size:
+                raise EOFError(f"expected {size} bytes, got {done}")
+            sftp.chmod(tmp, stat.S_IMODE(mode or 0o644))
+            sftp.utime(tmp, (mtime, mtime))
+            replace_remote(sftp, tmp, r_path)
+            stats.add_file(rel, attributes(size, mtime), time.monotonic() - started)
+            log(f"Restored: {rel}")
+        except Exception as e:
+            if isinstance(source, Pipe):
+                source.close()
+            try:
+                sftp.remove(tmp)
+            except IOError:
+                pass
+            if not isinstance(e, InterruptedError):
+                stats.add_failure(rel, size)
+                log(f"FAILED {rel}: {str(e)}")
+
+    submit, shutdown = run_pool(channels, lister, tasks, upload, log)
+    log(f"Restoring with {max(1, len(channels))} parallel channel(s).")
+    try:
+        ensure_remote_dir(lister, remote_root, made)
+        for rel, is_dir, size, mtime, mode, reader in members:
+            if stop_event.is_set():
+                break
+            if not selected(rel, paths):
+                continue
+            r_path = posixpath.join(remote_root, rel)
+            try:
+                ensure_remote_dir(lister, r_path if is_dir else posixpath.dirname(r_path), made)
+            except IOError as e:
+                log(f"FAILED {rel}: {str(e)}")
+                stats.add_listing_errors()
+                continue
+            if is_dir:
+                continue
+            if remote is not None and remote.get(rel) == (size, int(mtime)):
+                stats.add_skipped(rel, attributes(size, mtime))
+                if progress:
+                    progress.finish(rel, size)
+                continue
+            if size <= SMALL_FILE_LIMIT or not channels:
+                # With no worker channels the upload runs inline here and can
+                # read the member itself.
+                submit((rel, r_path, size, mtime, mode, reader.read() if size <= SMALL_FILE_LIMIT else reader))
+            else:
+                pipe = Pipe()
+                submit((rel, r_path, size, mtime, mode, pipe))
+                pipe.feed(reader, stop_event)
+    finally:
+        shutdown()
+        lister.close()
+    return stats
+
+
+def attributes(size, mtime):
+    item = paramiko.SFTPAttributes()
+    item.st_size = size
+    item.st_mtime = int(mtime)
+    return item
@@ -0,0 +1,200 @@
+import threading
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+from apscheduler.jobstores.base import JobLookupError
+from apscheduler.triggers.base import BaseTrigger
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.date import DateTrigger
+
+ALL_DAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+# Schedules set for the same time are spread over this many seconds after
+# it, so a fleet set to 02:00 does not connect all at once.
+DEFAULT_STAGGER = 900
+# Missed runs older than this are skipped instead of run late; 0 skips all.
+DEFAULT_MISFIRE_GRACE = 3600
+# Upper bound for a schedule's random start delay.
+MAX_JITTER = 3600
+NEXT_RUN_CACHE = 4096
+GOLDEN_RATIO = 0.6180339887498949
+
+
+class ScheduleError(ValueError):
+    pass
+
+
+def normalize_jitter(value):
+    try:
+        jitter = int(value or 0)
+    except (TypeError, ValueError):
+        raise ScheduleError("Jitter must be a whole number of seconds.")
+    if not 0 <= jitter <= MAX_JITTER:
+        raise ScheduleError(f"Jitter must be between 0 and {MAX_JITTER} seconds.")
+    return jitter
+
+
+class StaggeredTrigger(BaseTrigger):
+    # A CronTrigger shifted later by a fixed number of seconds.
+    def __init__(self, cron, offset):
+        self.cron = cron
+        self.offset = timedelta(seconds=offset)
+
+    def get_next_fire_time(self, previous_fire_time, now):
+        if previous_fire_time is not None:
+            previous_fire_time -= self.offset
+        fire = self.cron.get_next_fire_time(previous_fire_time, now - self.offset)
+        return fire + self.offset if fire else None
+
+    def __str__(self):
+        return f"{self.cron} +{int(self.offset.total_seconds())}s"
+
+
+@lru_cache(maxsize=1024)
+def schedule_trigger(days, hour, minute, offset, timezone, jitter=0):
+    # Triggers hold no state between calls, so one per distinct schedule is
+    # shared by the scheduler and next-run lookups.
+    cron = CronTrigger(day_of_week=days, hour=hour, minute=minute, timezone=timezone, jitter=jitter or None)
+    return StaggeredTrigger(cron, offset) if offset else cron
+
+
+def stagger_offsets(rows, window):
+    # schedule id -> seconds after its set time, for rows of (id, days, hour,
+    # minute). The oldest schedule firing on the same days at the same time
+    # keeps that time; the others get a fixed point in window derived from
+    # their id. Multiples of the golden ratio spread consecutive ids (a fleet
+    # added in one go) evenly. Adding a schedule never moves the existing ones;
+    # removing the oldest of a group moves the next oldest to the set time.
+    first = {}
+    for schedule_id, days, hour, minute in rows:
+        if first.get((days, hour, minute), schedule_id) >= schedule_id:
+            first[(days, hour, minute)] = schedule_id
+    return {
+        schedule_id: 0 if first[(days, hour, minute)] == schedule_id else int((schedule_id * GOLDEN_RATIO) % 1 * window)
+        for schedule_id, days, hour, minute in rows
+    }
+
+
+def missed_fire(trigger, since, now, grace):
+    # The latest fire time of trigger in (since, now], or None if there is
+    # none or it is more than grace seconds ago.
+    start = max(since, now - timedelta(seconds=grace))
+    latest = None
+    fire = trigger.get_next_fire_time(None, start)
+    while fire and fire <= now:
+        if fire > since:
+            latest = fire
+        fire = trigger.get_next_fire_time(fire, now)
+    return latest
+
+
+class NextRunCache:
+    # Next fire time per (days, hour, minute, offset). An entry stays valid
+    # until that time passes, so listing hundreds of schedules computes each
+    # distinct time once instead of once per row per request.
+    def __init__(self, timezone, size=NEXT_RUN_CACHE):
+        self.timezone = timezone
+        self.size = size
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, days, hour, minute, offset, now):
+        key = (days, hour, minute, offset)
+        with self.lock:
+            fire = self.entries.get(key)
+        if fire and fire > now:
+            return fire
+        fire = schedule_trigger(days, hour, minute, offset, self.timezone).get_next_fire_time(None, now)
+        with self.lock:
+            if len(self.entries) >= self.size:
+                self.entries.clear()
+            self.entries[key] = fire
+        return fire
+
+
+class ScheduleSync:
+    # Keeps an APScheduler in step with the schedules table. sync() only adds,
+    # replaces or removes the jobs whose schedule changed since the last call;
+    # the others keep their pending run as is. run(job_type, schedule_id) is
+    # what each job calls.
+    def __init__(self, scheduler, run, timezone, stagger=DEFAULT_STAGGER, misfire_grace=DEFAULT_MISFIRE_GRACE,
+                 log=print):
+        self.scheduler = scheduler
+        self.run = run
+        self.timezone = timezone
+        self.stagger = stagger
+        self.misfire_grace = misfire_grace
+        self.log = log
+        # schedule id -> (job_type, days, hour, minute, offset, jitter)
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def offsets(self, rows):
+        return stagger_offsets([(row[0], row[4], row[2], row[3]) for row in rows], self.stagger)
+
+    def sync(self, rows, catch_up=False):
+        # rows are (id, job_type, hour, minute, days, jitter, last_fire).
+        # Returns (added, changed, removed).
+        offsets = self.offsets(rows)
+        wanted = {
+            schedule_id: (job_type, days, hour, minute, offsets[schedule_id], jitter or 0)
+            for schedule_id, job_type, hour, minute, days, jitter, _ in rows
+            if days
+        }
+        added = changed = removed = 0
+        with self.lock:
+            for schedule_id in [schedule_id for schedule_id in self.jobs if schedule_id not in wanted]:
+                try:
+                    self.scheduler.remove_job(f"schedule-{schedule_id}")
+                except JobLookupError:
+                    pass
+                del self.jobs[schedule_id]
+                removed += 1
+            for schedule_id, spec in wanted.items():
+                current = self.jobs.get(schedule_id)
+                if current == spec:
+                    continue
+                job_type, days, hour, minute, offset, jitter = spec
+                self.scheduler.add_job(
+                    self.run,
+                    trigger=schedule_trigger(days, hour, minute, offset, self.timezone, jitter),
+                    id=f"schedule-{schedule_id}",
+                    args=[job_type, schedule_id],
+                    replace_existing=True,
+                )
+                self.jobs[schedule_id] = spec
+                if current is None:
+                    added += 1
+                else:
+                    changed += 1
+            if catch_up:
+                self.catch_up(rows, offsets)
+        return added, changed, removed
+
+    def catch_up(self, rows, offsets):
+        # After a restart: a schedule that should have fired while we were
+        # down runs once (however many times it was missed), at its usual
+        # stagger offset from now rather than all at once.
+        now = datetime.now(self.scheduler.timezone)
+        missed = skipped = 0
+        for schedule_id, job_type, hour, minute, days, _, last_fire in rows:
+            if not days or last_fire is None:
+                continue
+            trigger = schedule_trigger(days, hour, minute, offsets[schedule_id], self.timezone)
+            since = datetime.fromtimestamp(last_fire, now.tzinfo)
+            if missed_fire(trigger, since, now, self.misfire_grace):
+                self.scheduler.add_job(
+                    self.run,
+                    trigger=DateTrigger(now + timedelta(seconds=offsets[schedule_id]), timezone=now.tzinfo),
+                    id=f"catch-up-{schedule_id}",
+                    args=[job_type, schedule_id],
+                    replace_existing=True,
+                )
+                missed += 1
+            else:
+                fire = trigger.get_next_fire_time(None, since)
+                if fire and since < fire <= now:
+                    skipped += 1
+        if missed:
+            self.log(f"[SCHEDULER] Catching up {missed} missed run(s).")
+        if skipped:
+            self.log(f"[SCHEDULER] Skipped {skipped} missed run(s) older than {self.misfire_grace}s.")
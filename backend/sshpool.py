@@ -0,0 +1,210 @@
+import hashlib
+import io
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+import paramiko
+
+CONNECT_TIMEOUT = 10
+# A pooled transport whose server does not answer a probe within this long is
+# taken to be dead (e.g. a half-open connection) and replaced.
+PROBE_TIMEOUT = 5
+# Seconds between keepalive packets on a transport, idle or not.
+DEFAULT_KEEPALIVE = 30
+# Idle transports are closed after this long, and none lives longer than
+# max_lifetime so a server-side session limit never cuts one off mid-run.
+DEFAULT_IDLE_TIMEOUT = 300
+DEFAULT_MAX_LIFETIME = 3600
+DEFAULT_MAX_IDLE = 2
+
+
+def pool_key(config):
+    # host, port and user pick the server account; the credential digest makes
+    # sure a changed password or key is actually tried instead of served from
+    # an old session.
+    secret = f"{config.get('password') or ''}\0{config.get('key') or ''}".encode("utf-8")
+    return (
+        (config.get("host") or "").strip().lower(),
+        int(config.get("port") or 22),
+        config.get("user") or "",
+        hashlib.sha256(secret).hexdigest(),
+    )
+
+
+def open_transport(config, keepalive=DEFAULT_KEEPALIVE):
+    sock = socket.create_connection((config["host"], int(config.get("port") or 22)), timeout=CONNECT_TIMEOUT)
+    transport = paramiko.Transport(sock)
+    try:
+        transport.start_client(timeout=CONNECT_TIMEOUT)
+        authenticated = False
+        if config.get("key"):
+            pkey = paramiko.RSAKey.from_private_key(io.StringIO(config["key"]))
+            try:
+                transport.auth_publickey(config["user"], pkey)
+                authenticated = True
+            except paramiko.AuthenticationException:
+                if not config.get("password"):
+                    raise
+        if not authenticated:
+            transport.auth_password(config["user"], config.get("password") or "")
+        transport.set_keepalive(keepalive)
+        return transport
+    except BaseException:
+        transport.close()
+        raise
+
+
+def is_alive(transport, probe=False):
+    if not transport.is_active() or not transport.is_authenticated():
+        return False
+    if probe:
+        # One round trip, still far cheaper than a new handshake; any reply,
+        # even a refusal, proves the session is still there. paramiko waits for
+        # it without a timeout, so the request runs on its own thread.
+        answered = threading.Event()
+
+        def request():
+            try:
+                transport.global_request("keepalive@openssh.com", wait=True)
+            except Exception:
+                pass
+            answered.set()
+
+        threading.Thread(target=request, daemon=True).start()
+        if not answered.wait(PROBE_TIMEOUT):
+            # Closing also ends the waiting request.
+            transport.close()
+            return False
+        return transport.is_active()
+    return True
+
+
+class TransportPool:
+    # Authenticated paramiko transports keyed by pool_key(config). A transport
+    # is checked out by one run or test at a time, exactly like a fresh one
+    # would be, and goes back to the pool afterwards unless it failed.
+    def __init__(self, keepalive=DEFAULT_KEEPALIVE, idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 max_lifetime=DEFAULT_MAX_LIFETIME, max_idle=DEFAULT_MAX_IDLE, connect=open_transport):
+        self.keepalive = keepalive
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self.connect = connect
+        # key -> [(transport, created, last_used)], most recently used last.
+        self.idle = {}
+        self.lock = threading.Lock()
+        self.reaper = None
+        self.closed = False
+        self.created = 0
+        self.reused = 0
+
+    def acquire(self, config):
+        # Returns (transport, entry, reused).
+        key = pool_key(config)
+        while True:
+            with self.lock:
+                entries = self.idle.get(key)
+                entry = entries.pop() if entries else None
+            if entry is None:
+                break
+            transport, created, _ = entry
+            if time.monotonic() - created < self.max_lifetime:
+                try:
+                    if is_alive(transport, probe=True):
+                        with self.lock:
+                            self.reused += 1
+                        return transport, (key, created), True
+                except Exception:
+                    pass
+            transport.close()
+        transport = self.connect(config, self.keepalive)
+        with self.lock:
+            self.created += 1
+        return transport, (key, time.monotonic()), False
+
+    def release(self, transport, entry, broken=False):
+        key, created = entry
+        now = time.monotonic()
+        keep = not broken and not self.closed and now - created < self.max_lifetime and is_alive(transport)
+        if keep:
+            with self.lock:
+                entries = self.idle.setdefault(key, [])
+                if len(entries) < self.max_idle:
+                    entries.append((transport, created, now))
+                    self.start_reaper()
+                else:
+                    keep = False
+        if not keep:
+            transport.close()
+
+    @contextmanager
+    def transport(self, config):
+        transport, entry, _ = self.acquire(config)
+        try:
+            yield transport
+        except BaseException:
+            self.release(transport, entry, broken=True)
+            raise
+        self.release(transport, entry)
+
+    @contextmanager
+    def sftp(self, config):
+        with self.transport(config) as transport:
+            sftp = paramiko.SFTPClient.from_transport(transport)
+            try:
+                yield sftp
+            finally:
+                sftp.close()
+
+    def prune(self):
+        # Closes transports that sat idle too long, outlived max_lifetime or
+        # were dropped by the server. Returns how many were closed.
+        now = time.monotonic()
+        expired = []
+        with self.lock:
+            for key, entries in list(self.idle.items()):
+                fresh = []
+                for entry in entries:
+                    transport, created, last_used = entry
+                    if (now - last_used > self.idle_timeout or now - created > self.max_lifetime
+                            or not transport.is_active()):
+                        expired.append(transport)
+                    else:
+                        fresh.append(entry)
+                if fresh:
+                    self.idle[key] = fresh
+                else:
+                    del self.idle[key]
+        for transport in expired:
+            transport.close()
+        return len(expired)
+
+    def start_reaper(self):
+        # Called with self.lock held.
+        if self.reaper is None:
+            self.reaper = threading.Thread(target=self.reap, daemon=True)
+            self.reaper.start()
+
+    def reap(self):
+        interval = max(1, min(self.idle_timeout, self.keepalive) / 2)
+        while not self.closed:
+            time.sleep(interval)
+            self.prune()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "idle": sum(len(entries) for entries in self.idle.values()),
+                "created": self.created,
+                "reused": self.reused,
+            }
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            idle, self.idle = self.idle, {}
+        for entries in idle.values():
+            for transport, _, _ in entries:
+                transport.close()
@@ -0,0 +1,70 @@
+import json
+import re
+from datetime import datetime
+
+TARGET_METHODS = ("sftp", "ssh", "cpanel")
+# Site names become log tags, archive prefixes ("<name>_backup_...") and local
+# folder names, so they are kept to lowercase letters, digits and dashes.
+TARGET_NAME = re.compile(r"^[a-z0-9][a-z0-9-]{0,62}$")
+# Log tags of the app's own subsystems; a site by one of these names would be
+# mixed up with them in log filtering and search.
+SYSTEM_NAMES = ("system", "archive", "restore", "queue", "scheduler")
+
+
+class TargetError(ValueError):
+    pass
+
+
+def init_targets(conn):
+    c = conn.cursor()
+    c.execute(
+        "CREATE TABLE IF NOT EXISTS targets (id INTEGER PRIMARY KEY, name TEXT UNIQUE, method TEXT, config TEXT, "
+        "enabled INTEGER DEFAULT 1, created TEXT)"
+    )
+    conn.commit()
+
+
+def validate_name(name, reserved=()):
+    if not name or not TARGET_NAME.match(name):
+        raise TargetError("Name must be 1-63 lowercase letters, digits or dashes.")
+    if name in reserved or name in SYSTEM_NAMES:
+        raise TargetError(f"'{name}' is reserved.")
+    return name
+
+
+def row_to_target(row):
+    return {"name": row[0], "method": row[1], "config": json.loads(row[2] or "{}"), "enabled": row[3] != 0}
+
+
+def list_targets(conn):
+    c = conn.cursor()
+    c.execute("SELECT name, method, config, enabled FROM targets ORDER BY name")
+    return [row_to_target(row) for row in c.fetchall()]
+
+
+def get_target(conn, name):
+    c = conn.cursor()
+    c.execute("SELECT name, method, config, enabled FROM targets WHERE name = ?", (name,))
+    row = c.fetchone()
+    return row_to_target(row) if row else None
+
+
+def save_target(conn, name, method, config, enabled=True):
+    if method not in TARGET_METHODS:
+        raise TargetError(f"Unknown method '{method}'.")
+    conn.execute(
+        "INSERT INTO targets (name, method, config, enabled, created) VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT(name) DO UPDATE SET method = excluded.method, config = excluded.config, "
+        "enabled = excluded.enabled",
+        (name, method, json.dumps(config), int(bool(enabled)), datetime.now()),
+    )
+
+
+def delete_target(conn, name):
+    return conn.execute("DELETE FROM targets WHERE name = ?", (name,)).rowcount > 0
+
+
+def host_key(config):
+    # Connection caps are per remote host and port.
+    host = (config.get("host") or "").strip().lower()
+    return f"{host}:{config.get('port') or ''}" if host else None
@@ -0,0 +1,168 @@
+import socketserver
+import threading
+import time
+
+import pytest
+
+from notifier import Notifier
+
+
+class SMTPStub:
+    # Minimal in-process SMTP server: no STARTTLS or auth, counts sessions and
+    # keeps every message. The next `fail` MAIL commands are refused.
+    def __init__(self):
+        self.messages = []
+        self.sessions = 0
+        self.fail = 0
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                with stub.lock:
+                    stub.sessions += 1
+                self.reply("220 stub")
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    command = line.decode().strip().upper()
+                    if command.startswith("EHLO") or command.startswith("HELO"):
+                        self.reply("250 stub")
+                    elif command.startswith("MAIL"):
+                        with stub.lock:
+                            refused, stub.fail = stub.fail > 0, max(0, stub.fail - 1)
+                        self.reply("451 try later" if refused else "250 ok")
+                    elif command == "DATA":
+                        self.reply("354 go ahead")
+                        data = []
+                        while True:
+                            line = self.rfile.readline()
+                            if line in (b".\r\n", b""):
+                                break
+                            data.append(line.decode())
+                        with stub.lock:
+                            stub.messages.append("".join(data))
+                        self.reply("250 queued")
+                    elif command == "QUIT":
+                        self.reply("221 bye")
+                        return
+                    else:
+                        self.reply("250 ok")
+
+            def reply(self, text):
+                self.wfile.write(f"{text}\r\n".encode())
+
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.02)
+
+
+@pytest.fixture
+def stub():
+    server = SMTPStub()
+    yield server
+    server.close()
+
+
+def smtp_config(stub, **extra):
+    return {"host": "127.0.0.1", "port": stub.port, "from_addr": "backup@example.com",
+            "to_addr": "ops@example.com", **extra}
+
+
+def start_notifier(get_config, logs, **options):
+    notifier = Notifier(get_config, log=logs.append, **options)
+    notifier.start()
+    return notifier
+
+
+def test_reuses_one_session(stub):
+    logs = []
+    notifier = start_notifier(lambda: smtp_config(stub), logs)
+    try:
+        for n in range(3):
+            notifier.send(f"Backup {n} succeeded", "ok")
+        wait_for(lambda: len(stub.messages) == 3)
+        assert stub.sessions == 1
+        assert notifier.stats()["sent"] == 3
+    finally:
+        notifier.close()
+
+
+def test_retries_with_backoff(stub):
+    logs = []
+    stub.fail = 2
+    notifier = start_notifier(lambda: smtp_config(stub), logs, retry_base=0.05)
+    try:
+        started = time.monotonic()
+        notifier.send("Backup failed", "boom")
+        wait_for(lambda: len(stub.messages) == 1)
+        # 0.05s, then 0.1s.
+        assert time.monotonic() - started >= 0.15
+        assert [line for line in logs if line.startswith("Retrying")] == [
+            "Retrying email in 0.05s (attempt 1/5).",
+            "Retrying email in 0.1s (attempt 2/5).",
+        ]
+    finally:
+        notifier.close()
+
+
+def test_drops_message_after_max_attempts(stub):
+    logs = []
+    stub.fail = 10
+    notifier = start_notifier(lambda: smtp_config(stub), logs, retry_base=0.01, max_attempts=2)
+    try:
+        notifier.send("Backup failed", "boom")
+        wait_for(lambda: any(line.startswith("Email dropped") for line in logs))
+        assert stub.messages == []
+        assert notifier.stats()["pending"] == 0
+    finally:
+        notifier.close()
+
+
+def test_digest_batches_one_window(stub):
+    logs = []
+    # 0.6s window.
+    notifier = start_notifier(lambda: smtp_config(stub, digest_minutes=0.01), logs)
+    try:
+        notifier.send("Backup of site-a succeeded", "ok")
+        notifier.send("Backup of site-b failed", "timeout")
+        notifier.send("Backup of site-c succeeded", "ok")
+        wait_for(lambda: len(stub.messages) == 1)
+        time.sleep(0.2)
+        assert len(stub.messages) == 1
+        message = stub.messages[0]
+        assert "Subject: Backup digest: 3 notification(s), 1 failed" in message
+        for site in ("site-a", "site-b", "site-c"):
+            assert site in message
+    finally:
+        notifier.close()
+
+
+def test_bad_config_does_not_stop_the_thread(stub):
+    logs = []
+    config = smtp_config(stub)
+    del config["from_addr"]
+    notifier = start_notifier(lambda: config, logs, retry_base=0.01, max_attempts=1)
+    try:
+        notifier.send("Backup failed", "boom")
+        wait_for(lambda: any(line.startswith("Email dropped") for line in logs))
+        config["from_addr"] = "backup@example.com"
+        notifier.send("Backup succeeded", "ok")
+        wait_for(lambda: len(stub.messages) == 1)
+        assert "Subject: Backup succeeded" in stub.messages[0]
+    finally:
+        notifier.close()
@@ -0,0 +1,169 @@
+import stat
+import threading
+import tracemalloc
+
+import paramiko
+import pytest
+
+import transfer
+from transfer import SpillStack, TransferStats, walk_remote
+
+
+def entry(name, is_dir):
+    attr = paramiko.SFTPAttributes()
+    attr.filename = name
+    attr.st_mode = (stat.S_IFDIR | 0o755) if is_dir else (stat.S_IFREG | 0o644)
+    attr.st_size = 0 if is_dir else 10
+    return attr
+
+
+def fake_tree(monkeypatch, tree):
+    # tree: folder path -> callable returning its entries as (name, is_dir).
+    opened, closed = [], []
+
+    def iter_folder(sftp, path):
+        opened.append(path)
+        try:
+            if path not in tree:
+                raise IOError("No such file")
+            for name, is_dir in tree[path]():
+                yield entry(name, is_dir)
+        finally:
+            closed.append(path)
+
+    monkeypatch.setattr(transfer, "iter_folder", iter_folder)
+    return opened, closed
+
+
+def walk(root="root", stop_event=None, stats=None, **options):
+    return walk_remote(None, root, stop_event or threading.Event(), stats or TransferStats(), lambda msg: None,
+                       **options)
+
+
+def test_spill_stack_is_lifo():
+    stack = SpillStack(4)
+    for n in range(100):
+        stack.push((f"r/{n}", str(n)))
+    assert len(stack) == 100
+    assert stack.file is not None
+    popped = []
+    while stack:
+        popped.append(stack.pop())
+    stack.close()
+    assert popped == [(f"r/{n}", str(n)) for n in reversed(range(100))]
+
+
+def test_walk_order_follows_listing(monkeypatch):
+    layout = {
+        "root": ["a/", "b/", "x.php", "c/"],
+        "root/a": ["a1/", "a.txt"],
+        "root/a/a1": ["deep.txt"],
+        "root/b": [],
+        "root/c": ["c1/", "c2/", "c3/", "c.txt"],
+        "root/c/c1": [],
+        "root/c/c2": ["z.txt"],
+        "root/c/c3": [],
+    }
+    fake_tree(monkeypatch, {
+        path: (lambda names=names: [(n.rstrip("/"), n.endswith("/")) for n in names]) for path, names in layout.items()
+    })
+
+    def reference(path, rel):
+        # The recursive walk this replaces: a folder's entries, then each
+        # subfolder in listing order.
+        out, subfolders = [], []
+        for name in layout[path]:
+            child_rel = f"{rel}/{name.rstrip('/')}" if rel else name.rstrip("/")
+            out.append(child_rel)
+            if name.endswith("/"):
+                subfolders.append((f"{path}/{name.rstrip('/')}", child_rel))
+        for child, child_rel in subfolders:
+            out += reference(child, child_rel)
+        return out
+
+    # A limit of 2 makes both stacks spill.
+    assert [rel for _, rel, _ in walk(pending_limit=2)] == reference("root", "")
+
+
+def test_wide_folder_stays_within_memory_budget(monkeypatch):
+    width = 100000
+
+    def iter_folder(sftp, path):
+        # Subfolders are empty; nothing is recorded, so only the walker's
+        # own memory is measured.
+        if path == "root":
+            for n in range(width):
+                yield entry(f"folder-{n:07d}", True)
+
+    monkeypatch.setattr(transfer, "iter_folder", iter_folder)
+    tracemalloc.start()
+    try:
+        count = sum(1 for _ in walk())
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert count == width
+    # Holding every pending folder would take about 20 MB.
+    assert peak < 6 * 1024 * 1024
+
+
+def test_deep_tree_is_walked_without_recursion(monkeypatch):
+    depth = 3000
+    tree = {"root": lambda: [("d", True)]}
+    path = "root"
+    for _ in range(depth):
+        path += "/d"
+        tree[path] = lambda: [("d", True), ("f.txt", False)]
+    tree[path] = lambda: [("f.txt", False)]
+    fake_tree(monkeypatch, tree)
+    entries = list(walk())
+    assert len(entries) == 2 * depth
+    assert entries[-1][1] == "/".join(["d"] * depth + ["f.txt"])
+
+
+def test_folders_are_closed_when_stopped(monkeypatch):
+    opened, closed = fake_tree(monkeypatch, {
+        "root": lambda: [("a", True), ("b", True)],
+        "root/a": lambda: ((f"f{n}", False) for n in range(100)),
+        "root/b": lambda: [],
+    })
+    stop_event = threading.Event()
+    for _, rel, _ in walk(stop_event=stop_event):
+        if rel == "a/f10":
+            stop_event.set()
+    assert opened == ["root", "root/a"]
+    assert closed == opened
+
+
+def test_folders_are_closed_when_abandoned(monkeypatch):
+    opened, closed = fake_tree(monkeypatch, {"root": lambda: [("a", True)], "root/a": lambda: [("f", False)] * 5})
+    walker = walk()
+    for _, rel, _ in walker:
+        if rel.startswith("a/"):
+            break
+    walker.close()
+    assert closed == opened == ["root", "root/a"]
+
+
+def test_unreadable_folder_is_skipped_and_counted(monkeypatch):
+    fake_tree(monkeypatch, {"root": lambda: [("gone", True), ("ok", True)], "root/ok": lambda: [("f", False)]})
+    stats = TransferStats()
+    assert [rel for _, rel, _ in walk(stats=stats)] == ["gone", "ok", "ok/f"]
+    assert stats.listing_errors == 1
+
+
+@pytest.mark.parametrize("limit", [2, 3, 10])
+def test_spilled_walk_is_complete(monkeypatch, limit):
+    tree = {"root": lambda: [(f"d{n}", True) for n in range(25)]}
+    for n in range(25):
+        tree[f"root/d{n}"] = lambda n=n: [(f"e{m}", True) for m in range(n % 4)] + [("f", False)]
+        for m in range(n % 4):
+            tree[f"root/d{n}/e{m}"] = lambda: [("g", False)]
+    fake_tree(monkeypatch, tree)
+    rels = [rel for _, rel, _ in walk(pending_limit=limit)]
+    assert len(rels) == len(set(rels))
+    assert len(rels) == 25 + sum(1 + 2 * (n % 4) for n in range(25))
+    positions = {rel: i for i, rel in enumerate(rels)}
+    for rel in rels:
+        if "/" in rel:
+            assert positions[rel.rsplit("/", 1)[0]] < positions[rel]
@@ -0,0 +1,813 @@
+import io
+import json
+import os
+import queue
+import shlex
+import socket
+import stat
+import tarfile
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import paramiko
+from paramiko.sftp import CMD_CLOSE, CMD_HANDLE, CMD_NAME, CMD_OPENDIR, CMD_READDIR, SFTPError
+
+DEFAULT_WORKERS = 4
+MAX_WORKERS = 32
+# Files up to this size are read whole by the workers when streaming into an
+# archive; larger ones are read by the archive writer through a read-ahead window.
+SMALL_FILE_LIMIT = 1024 * 1024
+READ_CHUNK = 1024 * 1024
+READ_WINDOW = 8
+# Remote tar output is buffered in at most this many chunks between the
+# network reader and the local file writer.
+STREAM_CHUNK = 256 * 1024
+STREAM_BUFFER_CHUNKS = 64
+# Large files are downloaded into "<name>.<size>-<mtime>.partial" and renamed
+# when complete; a later run resumes the partial if the remote file still has
+# that size and mtime.
+PARTIAL_SUFFIX = ".partial"
+# A pre-scan keeps at most this many entries for the transfer to reuse; a
+# bigger tree is only counted, and listed again by the transfer.
+SCAN_ENTRY_LIMIT = 50000
+# Folders waiting to be listed that the walker keeps in memory; beyond this
+# they go to a temporary file.
+PENDING_LIMIT = 10000
+
+
+def clamp_workers(value):
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_WORKERS
+    return max(1, min(MAX_WORKERS, value))
+
+
+class TransferStats:
+    # listener, if given, is told about every file as it happens (for the
+    # /metrics counters): on_file(size, seconds), on_bytes(size), on_failure().
+    # progress, if given, is a ProgressTracker fed per file and per chunk.
+    def __init__(self, listener=None, progress=None):
+        self.listener = listener
+        self.progress = progress
+        self.lock = threading.Lock()
+        self.files = 0
+        self.bytes = 0
+        self.failed = 0
+        self.skipped = 0
+        self.listing_errors = 0
+        # Set when the progress totals include unchanged files, so skipping
+        # one counts towards them.
+        self.progress_skipped = False
+        # Remote path -> (size, mtime) for every file present locally after the run.
+        self.current = {}
+        self.failed_paths = set()
+
+    def add_file(self, r_path, item, seconds=None):
+        with self.lock:
+            self.files += 1
+            self.bytes += item.st_size
+            self.current[r_path] = (item.st_size, item.st_mtime)
+        if self.listener:
+            self.listener.on_file(item.st_size, seconds)
+        if self.progress:
+            self.progress.finish(r_path, item.st_size)
+
+    def add_partial(self, r_path, done):
+        if self.progress:
+            self.progress.advance(r_path, done)
+
+    def add_archived(self):
+        # Remote tar: a member name was reported; its size is not known.
+        with self.lock:
+            self.files += 1
+        if self.listener:
+            self.listener.on_file(0)
+
+    def add_bytes(self, size):
+        with self.lock:
+            self.bytes += size
+        if self.listener:
+            self.listener.on_bytes(size)
+
+    def add_skipped(self, r_path, item):
+        with self.lock:
+            self.skipped += 1
+            self.current[r_path] = (item.st_size, item.st_mtime)
+        if self.progress and self.progress_skipped:
+            self.progress.finish(r_path, item.st_size or 0)
+
+    def add_listing_errors(self, count=1):
+        with self.lock:
+            self.listing_errors += count
+
+    def add_failure(self, r_path, size=0):
+        # size is the file's full size, so progress still adds up to the total.
+        with self.lock:
+            self.failed += 1
+            self.failed_paths.add(r_path)
+        if self.listener:
+            self.listener.on_failure()
+        if self.progress:
+            self.progress.finish(r_path, size)
+
+
+class ActiveCounter:
+    # Number of file transfers in flight across all jobs, for the metrics store.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0
+
+    @contextmanager
+    def track(self):
+        with self.lock:
+            self.value += 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.value -= 1
+
+
+active_transfers = ActiveCounter()
+
+
+class AnyEvent:
+    def __init__(self, *events):
+        self.events = events
+
+    def is_set(self):
+        return any(event.is_set() for event in self.events)
+
+
+def open_channels(transport, count, log):
+    # One SFTP session per worker, all multiplexed over the same transport.
+    channels = []
+    for _ in range(count):
+        try:
+            channels.append(paramiko.SFTPClient.from_transport(transport))
+        except Exception as e:
+            log(f"Could not open extra SFTP channel ({len(channels)} open): {str(e)}")
+            break
+    return channels
+
+
+class SpillStack:
+    # Last-in first-out stack of (remote path, relative path) pairs holding at
+    # most limit of them in memory. When full, the older half is appended to
+    # a temporary file as one block, read back once everything above it has
+    # been popped.
+    def __init__(self, limit=None):
+        self.limit = max(2, limit or PENDING_LIMIT)
+        self.items = []
+        # (offset, count) of each block in the file, oldest first.
+        self.blocks = []
+        self.file = None
+
+    def __bool__(self):
+        return bool(self.items or self.blocks)
+
+    def __len__(self):
+        return len(self.items) + sum(count for _, count in self.blocks)
+
+    def push(self, item):
+        if len(self.items) >= self.limit:
+            half = self.limit // 2
+            if self.file is None:
+                self.file = tempfile.TemporaryFile()
+            self.file.seek(0, os.SEEK_END)
+            self.blocks.append((self.file.tell(), half))
+            self.file.write("".join(json.dumps(entry) + "\n" for entry in self.items[:half]).encode("utf-8"))
+            del self.items[:half]
+        self.items.append(item)
+
+    def pop(self):
+        if not self.items and self.blocks:
+            offset, _ = self.blocks.pop()
+            self.file.seek(offset)
+            self.items = [tuple(json.loads(line)) for line in self.file.read().decode("utf-8").splitlines()]
+            self.file.truncate(offset)
+        return self.items.pop()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+def iter_folder(sftp, path):
+    # listdir_iter with one READDIR request at a time, so nothing is in
+    # flight between pages and the caller can use sftp while it is paused.
+    # Unlike listdir_iter it also closes the directory handle when the caller
+    # stops early or a read fails.
+    t, msg = sftp._request(CMD_OPENDIR, sftp._adjust_cwd(path))
+    if t != CMD_HANDLE:
+        raise SFTPError("Expected handle")
+    handle = msg.get_binary()
+    try:
+        while True:
+            try:
+                t, msg = sftp._request(CMD_READDIR, handle)
+            except EOFError:
+                return
+            if t != CMD_NAME:
+                raise SFTPError("Expected name response")
+            for _ in range(msg.get_int()):
+                filename = msg.get_text()
+                longname = msg.get_text()
+                attr = paramiko.SFTPAttributes._from_msg(msg, filename, longname)
+                if filename not in (".", ".."):
+                    yield attr
+    finally:
+        try:
+            sftp._request(CMD_CLOSE, handle)
+        except Exception:
+            pass
+
+
+def walk_remote(sftp, remote_root, stop_event, stats, log, pending_limit=None):
+    # Yields (remote path, path relative to the root, attributes); a directory
+    # is always yielded before its contents and folders are entered in
+    # listing order. Each directory is read as a stream, and the folders
+    # still to be listed are kept on SpillStacks, so memory stays within a
+    # fixed bound however wide or deep the tree is.
+    pending = SpillStack(pending_limit)
+    found = SpillStack(pending_limit)
+    pending.push((remote_root, ""))
+    try:
+        while pending and not stop_event.is_set():
+            remote, rel = pending.pop()
+            folder = iter_folder(sftp, remote)
+            try:
+                for item in folder:
+                    if stop_event.is_set():
+                        return
+                    r_path = remote + "/" + item.filename if remote != "." else item.filename
+                    child_rel = rel + "/" + item.filename if rel else item.filename
+                    yield r_path, child_rel, item
+                    if stat.S_ISDIR(item.st_mode):
+                        found.push((r_path, child_rel))
+            except Exception as e:
+                log(f"Skipping folder {remote}: {str(e)}")
+                stats.add_listing_errors()
+            finally:
+                folder.close()
+            # found pops in reverse, which leaves the first subfolder on top.
+            while found:
+                pending.push(found.pop())
+    finally:
+        pending.close()
+        found.close()
+
+
+class RemoteScan:
+    # Result of a pre-scan: every entry walk_remote would yield, in the same
+    # order, plus the file and byte totals. The transfer engines accept it in
+    # place of walking the tree a second time. entries is None when the tree
+    # had more than SCAN_ENTRY_LIMIT of them.
+    def __init__(self):
+        self.entries = []
+        self.files = 0
+        self.bytes = 0
+        self.listing_errors = 0
+
+
+def scan_remote(transport, remote_root, stop_event, log=print, limit=SCAN_ENTRY_LIMIT):
+    scan = RemoteScan()
+    stats = TransferStats()
+    sftp = paramiko.SFTPClient.from_transport(transport)
+    try:
+        for entry in walk_remote(sftp, remote_root, stop_event, stats, log):
+            if scan.entries is not None:
+                scan.entries.append(entry)
+                if len(scan.entries) > limit:
+                    log(f"More than {limit} entries; counting only, the transfer will list the tree again.")
+                    scan.entries = None
+            item = entry[2]
+            if not stat.S_ISDIR(item.st_mode):
+                scan.files += 1
+                scan.bytes += item.st_size or 0
+    finally:
+        sftp.close()
+    scan.listing_errors = stats.listing_errors
+    return scan
+
+
+def tree_entries(lister, remote_root, stop_event, stats, log, scan):
+    if scan is None or scan.entries is None:
+        return walk_remote(lister, remote_root, stop_event, stats, log)
+    stats.add_listing_errors(scan.listing_errors)
+    return (entry for entry in scan.entries if not stop_event.is_set())
+
+
+def plan_totals(scan, pending):
+    # Files and bytes that will actually be transferred this run. Without the
+    # entries that is every file; see TransferStats.progress_skipped.
+    if scan.entries is None:
+        return scan.files, scan.bytes
+    files = size = 0
+    for r_path, rel, item in scan.entries:
+        if not stat.S_ISDIR(item.st_mode) and pending(r_path, rel, item):
+            files += 1
+            size += item.st_size or 0
+    return files, size
+
+
+def run_pool(channels, lister, tasks, handle, log=print):
+    # Worker threads drain the task queue, one SFTP channel each. paramiko's
+    # SFTPClient is not safe to share between threads, so when no extra
+    # channel could be opened the tasks run inline on the lister instead.
+    def worker(sftp):
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            # A worker that died here would leave shutdown() waiting on a
+            # full queue.
+            try:
+                handle(sftp, task)
+            except Exception as e:
+                log(f"Worker error: {str(e)}")
+
+    threads = [threading.Thread(target=worker, args=(sftp,), daemon=True) for sftp in channels]
+    for t in threads:
+        t.start()
+
+    def submit(task):
+        if threads:
+            tasks.put(task)
+        else:
+            handle(lister, task)
+
+    def shutdown():
+        for _ in threads:
+            tasks.put(None)
+        for t in threads:
+            t.join()
+        for sftp in channels:
+            sftp.close()
+
+    return submit, shutdown
+
+
+def parallel_download(
+    transport,
+    remote_root,
+    local_root,
+    stop_event,
+    workers=DEFAULT_WORKERS,
+    log=print,
+    verb="Downloaded",
+    previous=None,
+    listener=None,
+    scan=None,
+    progress=None,
+    delta=None,
+):
+    # previous maps remote paths to the (size, mtime) recorded by the last run;
+    # files that still match and exist locally are not transferred again.
+    # delta, a DeltaSync, fetches changed large files against their old copy.
+    previous = previous or {}
+    workers = clamp_workers(workers)
+    stats = TransferStats(listener, progress)
+    lister = paramiko.SFTPClient.from_transport(transport)
+    channels = open_channels(transport, workers, log)
+    tasks = queue.Queue(maxsize=max(1, len(channels)) * 64)
+
+    def fetch(sftp, task):
+        if stop_event.is_set():
+            return
+        r_path, l_path, item = task
+        try:
+            started = time.monotonic()
+            on_progress = lambda done: stats.add_partial(r_path, done)
+            with active_transfers.track():
+                complete = None
+                if delta and r_path in previous and delta.applies(l_path, item):
+                    complete = delta.fetch(sftp, r_path, l_path, item, stop_event, on_progress)
+                if complete is None:
+                    complete = fetch_file(sftp, r_path, l_path, item, stop_event, on_progress, log)
+            if not complete:
+                log(f"Stopped during {item.filename}; the next run picks it up again.")
+                return
+            log(f"{verb}: {item.filename}")
+            stats.add_file(r_path, item, time.monotonic() - started)
+        except Exception as inner_e:
+            stats.add_failure(r_path, item.st_size or 0)
+            log(f"FAILED {item.filename}: {str(inner_e)}")
+
+    def unchanged(r_path, l_path, item):
+        return previous.get(r_path) == (item.st_size, item.st_mtime) and os.path.exists(l_path)
+
+    stats.progress_skipped = scan is not None and scan.entries is None
+    if scan is not None and progress:
+        progress.start(
+            *plan_totals(
+                scan, lambda r_path, rel, item: not unchanged(r_path, os.path.join(local_root, *rel.split("/")), item)
+            )
+        )
+    submit, shutdown = run_pool(channels, lister, tasks, fetch, log)
+    log(f"Transferring with {max(1, len(channels))} parallel channel(s).")
+    try:
+        os.makedirs(local_root, exist_ok=True)
+        for r_path, rel, item in tree_entries(lister, remote_root, stop_event, stats, log, scan):
+            l_path = os.path.join(local_root, *rel.split("/"))
+            if stat.S_ISDIR(item.st_mode):
+                try:
+                    os.makedirs(l_path, exist_ok=True)
+                except Exception as inner_e:
+                    log(f"FAILED {item.filename}: {str(inner_e)}")
+                    stats.add_listing_errors()
+            elif unchanged(r_path, l_path, item):
+                stats.add_skipped(r_path, item)
+            else:
+                submit((r_path, l_path, item))
+    finally:
+        shutdown()
+        lister.close()
+    return stats
+
+
+def iter_chunks(f, offset, size):
+    # Reads [offset, size) with READ_WINDOW requests in flight at a time.
+    while offset < size:
+        window = []
+        while offset < size and len(window) < READ_WINDOW:
+            length = min(READ_CHUNK, size - offset)
+            window.append((offset, length))
+            offset += length
+        for data in f.readv(window):
+            yield data
+
+
+def partial_path(l_path, item):
+    return f"{l_path}.{item.st_size}-{int(item.st_mtime or 0)}{PARTIAL_SUFFIX}"
+
+
+def is_partial(filename):
+    return filename.endswith(PARTIAL_SUFFIX)
+
+
+def discard_partials(l_path, keep=None):
+    folder, name = os.path.split(l_path)
+    try:
+        names = os.listdir(folder or ".")
+    except OSError:
+        return
+    for other in names:
+        path = os.path.join(folder, other)
+        if other.startswith(name + ".") and is_partial(other) and path != keep:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def fetch_file(sftp, r_path, l_path, item, stop_event, on_progress=None, log=print):
+    # Chunked replacement for sftp.get. Returns False if stopped part way; the
+    # partial file is then left in place to be resumed.
+    size = item.st_size or 0
+    if stat.S_ISLNK(item.st_mode or 0):
+        item = sftp.stat(r_path)
+        size = item.st_size or 0
+    if size <= SMALL_FILE_LIMIT:
+        with sftp.open(r_path, "rb") as f:
+            # Without prefetch each 32 KB read would be its own round trip.
+            f.prefetch(size)
+            data = f.read()
+        with open(l_path, "wb") as out:
+            out.write(data)
+        return True
+    partial = partial_path(l_path, item)
+    discard_partials(l_path, keep=partial)
+    offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+    if offset > size:
+        offset = 0
+    if offset:
+        log(f"Resuming {item.filename} at {round(offset/1024/1024, 1)} MB")
+    with sftp.open(r_path, "rb") as f, open(partial, "r+b" if offset else "wb") as out:
+        out.truncate(offset)
+        out.seek(offset)
+        for data in iter_chunks(f, offset, size):
+            if not data:
+                break
+            out.write(data)
+            offset += len(data)
+            if on_progress:
+                on_progress(offset)
+            if stop_event.is_set():
+                return False
+    if offset != size:
+        os.remove(partial)
+        raise EOFError(f"expected {size} bytes, got {offset}")
+    os.replace(partial, l_path)
+    return True
+
+
+class RemoteReader:
+    # File-like view of a remote file for tarfile.addfile. Keeps READ_WINDOW
+    # chunks in flight, and pads with zeros if the file shrinks or a read fails
+    # so the archive stays well-formed; the error is kept for the caller.
+    def __init__(self, f, size, stop_event, on_read=None):
+        self.f = f
+        self.size = size
+        self.stop_event = stop_event
+        self.on_read = on_read
+        self.chunk = b""
+        self.pos = 0
+        self.remaining = size
+        self.error = None
+        self.chunks = iter_chunks(f, 0, size)
+
+    def _next_chunk(self):
+        if self.stop_event.is_set():
+            raise InterruptedError("Transfer stopped")
+        chunk = b""
+        if self.error is None:
+            try:
+                chunk = next(self.chunks, b"")
+            except Exception as e:
+                self.error = e
+        if not chunk:
+            if self.error is None:
+                self.error = EOFError("file shrank while reading")
+            chunk = b"\0" * min(READ_CHUNK, self.remaining)
+        self.chunk, self.pos = chunk, 0
+        if self.on_read:
+            self.on_read(self.size - self.remaining + len(chunk))
+
+    def read(self, n=-1):
+        if n is None or n < 0:
+            n = self.remaining
+        n = min(n, self.remaining)
+        parts = []
+        while n > 0:
+            if self.pos >= len(self.chunk):
+                self._next_chunk()
+            part = self.chunk[self.pos : self.pos + n]
+            self.pos += len(part)
+            n -= len(part)
+            self.remaining -= len(part)
+            parts.append(part)
+        return b"".join(parts)
+
+
+def tar_info(arc_root, rel, item, size=None):
+    info = tarfile.TarInfo(f"{arc_root}/{rel}")
+    info.mtime = item.st_mtime or 0
+    info.mode = stat.S_IMODE(item.st_mode or 0o644)
+    info.uid = item.st_uid or 0
+    info.gid = item.st_gid or 0
+    if stat.S_ISDIR(item.st_mode):
+        info.type = tarfile.DIRTYPE
+    else:
+        info.size = item.st_size if size is None else size
+    return info
+
+
+def stream_archive(
+    transport,
+    remote_root,
+    tar,
+    arc_root,
+    stop_event,
+    workers=DEFAULT_WORKERS,
+    log=print,
+    verb="Archived",
+    previous=None,
+    listener=None,
+    scan=None,
+    progress=None,
+):
+    # Writes the remote tree straight into an open tarfile, with no local
+    # staging copy. Workers fetch small files into memory in parallel; the
+    # calling thread is the only tar writer and reads large files itself.
+    previous = previous or {}
+    workers = clamp_workers(workers)
+    stats = TransferStats(listener, progress)
+    abort = threading.Event()
+    halt = AnyEvent(stop_event, abort)
+    lister = paramiko.SFTPClient.from_transport(transport)
+    reader_sftp = paramiko.SFTPClient.from_transport(transport)
+    channels = open_channels(transport, workers, log)
+    tasks = queue.Queue(maxsize=max(1, len(channels)) * 64)
+    # Bounds the small files held in memory to a few per worker.
+    results = queue.Queue(maxsize=max(1, len(channels)) * 4)
+
+    def fetch(sftp, task):
+        if halt.is_set():
+            return
+        r_path, rel, item = task
+        if (item.st_size or 0) > SMALL_FILE_LIMIT:
+            results.put((r_path, rel, item, None, None))
+            return
+        try:
+            started = time.monotonic()
+            with active_transfers.track(), sftp.open(r_path, "rb") as f:
+                f.prefetch(item.st_size or 0)
+                data = f.read()
+            results.put((r_path, rel, item, data, time.monotonic() - started))
+        except Exception as inner_e:
+            stats.add_failure(r_path, item.st_size or 0)
+            log(f"FAILED {item.filename}: {str(inner_e)}")
+
+    def unchanged(r_path, item):
+        return previous.get(r_path) == (item.st_size, item.st_mtime)
+
+    stats.progress_skipped = scan is not None and scan.entries is None
+    if scan is not None and progress:
+        progress.start(*plan_totals(scan, lambda r_path, rel, item: not unchanged(r_path, item)))
+    submit, shutdown = run_pool(channels, lister, tasks, fetch, log)
+
+    def produce():
+        try:
+            for r_path, rel, item in tree_entries(lister, remote_root, halt, stats, log, scan):
+                if stat.S_ISDIR(item.st_mode):
+                    results.put((r_path, rel, item, None, None))
+                elif stat.S_ISLNK(item.st_mode):
+                    # Follow links the same way sftp.get does in staged mode.
+                    try:
+                        target = lister.stat(r_path)
+                    except Exception as inner_e:
+                        log(f"FAILED {item.filename}: {str(inner_e)}")
+                        stats.add_failure(r_path, item.st_size or 0)
+                        continue
+                    if stat.S_ISDIR(target.st_mode):
+                        log(f"Skipping linked folder {r_path}")
+                        continue
+                    target.filename = item.filename
+                    submit((r_path, rel, target))
+                elif unchanged(r_path, item):
+                    stats.add_skipped(r_path, item)
+                else:
+                    submit((r_path, rel, item))
+        finally:
+            shutdown()
+            results.put(None)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    log(f"Streaming into archive with {max(1, len(channels))} parallel channel(s).")
+    drained = False
+    try:
+        while True:
+            entry = results.get()
+            if entry is None:
+                drained = True
+                break
+            if stop_event.is_set():
+                continue
+            r_path, rel, item, data, seconds = entry
+            if stat.S_ISDIR(item.st_mode):
+                tar.addfile(tar_info(arc_root, rel, item))
+                continue
+            if data is not None:
+                tar.addfile(tar_info(arc_root, rel, item, len(data)), io.BytesIO(data))
+                log(f"{verb}: {item.filename}")
+                stats.add_file(r_path, item, seconds)
+                continue
+            started = time.monotonic()
+            try:
+                f = reader_sftp.open(r_path, "rb")
+            except Exception as inner_e:
+                stats.add_failure(r_path, item.st_size)
+                log(f"FAILED {item.filename}: {str(inner_e)}")
+                continue
+            with active_transfers.track(), f:
+                reader = RemoteReader(f, item.st_size, stop_event, lambda done: stats.add_partial(r_path, done))
+                tar.addfile(tar_info(arc_root, rel, item), reader)
+            if reader.error:
+                stats.add_failure(r_path, item.st_size)
+                log(f"FAILED {item.filename} (zero-padded in archive): {str(reader.error)}")
+            else:
+                log(f"{verb}: {item.filename}")
+                stats.add_file(r_path, item, time.monotonic() - started)
+    finally:
+        if not drained:
+            # The writer bailed out early; keep draining so workers can exit.
+            abort.set()
+            while results.get() is not None:
+                pass
+        producer.join()
+        reader_sftp.close()
+        lister.close()
+    return stats
+
+
+class RemoteExecUnavailable(Exception):
+    pass
+
+
+def remote_tar_command(remote_root, arc_root):
+    # GNU tar; the transform puts members under the same top-level folder the
+    # SFTP modes use. Verbose names go to stderr since stdout carries the archive.
+    transform = shlex.quote(f"s,^\\.,{arc_root},")
+    return f"tar -C {shlex.quote(remote_root)} -czvf - --transform {transform} ."
+
+
+def remote_tar(transport, remote_root, out, arc_root, stop_event, log=print, verb="Archived", listener=None):
+    # Runs tar on the remote host and copies its gzip output into out through a
+    # bounded buffer. Raises RemoteExecUnavailable if exec is refused or the
+    # command fails before archiving anything.
+    stats = TransferStats(listener)
+    errors = []
+    abort = threading.Event()
+    halt = AnyEvent(stop_event, abort)
+    try:
+        channel = transport.open_session()
+        channel.settimeout(1.0)
+        channel.exec_command(remote_tar_command(remote_root, arc_root))
+    except Exception as e:
+        raise RemoteExecUnavailable(str(e))
+
+    buffer = queue.Queue(maxsize=STREAM_BUFFER_CHUNKS)
+
+    def read_stdout():
+        try:
+            while not halt.is_set():
+                try:
+                    data = channel.recv(STREAM_CHUNK)
+                except socket.timeout:
+                    continue
+                if not data:
+                    break
+                buffer.put(data)
+        except Exception as e:
+            errors.append(str(e))
+        finally:
+            buffer.put(None)
+
+    def read_stderr():
+        pending = b""
+        while not halt.is_set():
+            try:
+                data = channel.recv_stderr(32768)
+            except socket.timeout:
+                continue
+            except Exception:
+                break
+            if not data:
+                break
+            *lines, pending = (pending + data).split(b"\n")
+            for line in lines:
+                name = line.decode("utf-8", "replace").strip()
+                if name.startswith("tar: "):
+                    errors.append(name)
+                    log(name)
+                elif name and not name.endswith("/"):
+                    stats.add_archived()
+                    log(f"{verb}: {os.path.basename(name)}")
+
+    threads = [threading.Thread(target=read_stdout, daemon=True), threading.Thread(target=read_stderr, daemon=True)]
+    for t in threads:
+        t.start()
+    drained = False
+    try:
+        # The whole tar stream counts as one transfer.
+        with active_transfers.track():
+            while True:
+                data = buffer.get()
+                if data is None:
+                    drained = True
+                    break
+                if not stop_event.is_set():
+                    out.write(data)
+                    stats.add_bytes(len(data))
+    finally:
+        if not drained:
+            abort.set()
+            while buffer.get() is not None:
+                pass
+        if halt.is_set():
+            channel.close()
+        for t in threads:
+            t.join()
+    if stop_event.is_set():
+        return stats
+    status = channel.recv_exit_status()
+    channel.close()
+    # GNU tar exits with 1 when files changed while being read; the archive is
+    # still usable.
+    if status not in (0, 1):
+        detail = errors[-1] if errors else f"exit status {status}"
+        if not stats.files:
+            raise RemoteExecUnavailable(detail)
+        raise IOError(f"Remote tar failed: {detail}")
+    if status == 1:
+        log("Remote tar reported files changed while reading.")
+    return stats
+
+
+def local_path_for(remote_root, local_root, r_path):
+    rel = r_path if remote_root == "." else r_path[len(remote_root) + 1 :]
+    return os.path.join(local_root, *rel.split("/"))
+
+
+def prune_deleted(remote_root, local_root, deleted):
+    for r_path in deleted:
+        l_path = local_path_for(remote_root, local_root, r_path)
+        if os.path.isfile(l_path):
+            os.remove(l_path)
+        discard_partials(l_path)
@@ -0,0 +1,6 @@
+# WSGI entry point for the web role: gunicorn -c gunicorn.conf.py wsgi:app
+# Backups, schedules and restores run in the separate worker process
+# (python app.py --role worker), which gunicorn.conf.py starts by default.
+from app import create_app
+
+app = create_app("web")
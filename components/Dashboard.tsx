@@ -3,7 +3,32 @@ import React, { useState } from 'react';
 import LogViewer from './LogViewer';
 import CpuChart from './CpuChart';
 import { getGeminiLogSummary } from '../services/geminiService';
-import type { CpuData, DownloadMethod, DownloadMethodId } from '../types';
+import type { CpuData, DownloadMethod, DownloadMethodId, TransferProgress } from '../types';
+
+const formatBytes = (bytes: number) => {
+  if (bytes >= 1024 * 1024 * 1024) return `${(bytes / 1024 / 1024 / 1024).toFixed(2)} GB`;
+  if (bytes >= 1024 * 1024) return `${(bytes / 1024 / 1024).toFixed(1)} MB`;
+  return `${(bytes / 1024).toFixed(0)} KB`;
+};
+
+const formatEta = (seconds: number) => {
+  const h = Math.floor(seconds / 3600);
+  const m = Math.floor((seconds % 3600) / 60);
+  const s = seconds % 60;
+  return h > 0 ? `${h}h ${m}m` : m > 0 ? `${m}m ${s}s` : `${s}s`;
+};
+
+const transferSummary = (transfer: TransferProgress) => {
+  const parts = [
+    transfer.bytes_total !== null
+      ? `${formatBytes(transfer.bytes_done)} / ${formatBytes(transfer.bytes_total)}`
+      : formatBytes(transfer.bytes_done),
+    transfer.files_total !== null ? `${transfer.files_done}/${transfer.files_total} files` : `${transfer.files_done} files`,
+    `${formatBytes(transfer.rate)}/s`,
+  ];
+  if (transfer.eta !== null) parts.push(`ETA ${formatEta(transfer.eta)}`);
+  return parts.join(' · ');
+};
 
 const StatusCard: React.FC<{ title: string; value: string; statusColor?: string }> = ({ title, value, statusColor = 'text-green-400' }) => (
   <div className="bg-gray-950/30 p-4 border border-green-500/20 backdrop-blur-sm">
@@ -88,6 +113,12 @@ const Dashboard: React.FC<DashboardProps> = ({
                             <p className="text-sm font-semibold text-white">{method.label}</p>
                             <p className="text-xs text-gray-400">{method.description}</p>
                             <p className="text-xs text-green-300 mt-1">{method.lastResult}</p>
+                            {method.queued && (
+                              <p className="text-xs text-yellow-300 mt-1">{method.isRunning ? 'Another run queued' : 'Queued'}</p>
+                            )}
+                            {method.isRunning && method.transfer && (
+                              <p className="text-xs text-gray-400 mt-1">{transferSummary(method.transfer)}</p>
+                            )}
                           </div>
                           <div className="flex items-center gap-2">
                             <button
@@ -99,7 +130,7 @@ const Dashboard: React.FC<DashboardProps> = ({
                             </button>
                             <button
                               onClick={() => onStopDownload(method.id)}
-                              disabled={!method.isRunning}
+                              disabled={!method.isRunning && !method.queued}
                               className="px-3 py-1 text-xs border border-red-500 text-red-300 hover:bg-red-700/40 hover:text-white disabled:opacity-50 disabled:cursor-not-allowed"
                             >
                               Stop
@@ -2,11 +2,19 @@
 import React, { useEffect, useState } from 'react';
 import type { BackupFile } from '../types';
 
+const PAGE_SIZE = 50;
+
+type SortKey = 'filename' | 'size' | 'created' | 'job';
+
 const FileManager: React.FC = () => {
   const [searchTerm, setSearchTerm] = useState('');
   const [files, setFiles] = useState<BackupFile[]>([]);
   const [statusMessage, setStatusMessage] = useState('');
   const [isLoading, setIsLoading] = useState(true);
+  const [page, setPage] = useState(1);
+  const [total, setTotal] = useState(0);
+  const [sort, setSort] = useState<SortKey>('created');
+  const [order, setOrder] = useState<'asc' | 'desc'>('desc');
 
   const jobLabels: Record<string, string> = {
     sftp: 'SFTP Pull',
@@ -17,12 +25,20 @@ const FileManager: React.FC = () => {
   const loadFiles = async () => {
     setIsLoading(true);
     try {
-      const response = await fetch('/api/list_archives');
+      const params = new URLSearchParams({ page: String(page), per_page: String(PAGE_SIZE), sort, order });
+      const term = searchTerm.trim();
+      const job = Object.keys(jobLabels).find(id => jobLabels[id].toLowerCase() === term.toLowerCase() || id === term.toLowerCase());
+      if (job) {
+        params.set('job', job);
+      } else if (term) {
+        params.set('q', term);
+      }
+      const response = await fetch(`/api/list_archives?${params.toString()}`);
       if (!response.ok) {
         throw new Error('Failed to load archives');
       }
       const data = await response.json();
-      const mappedFiles = (data as Array<{ filename: string; size: string; created: string; job?: string }>).map(file => ({
+      const mappedFiles = (data.items as Array<{ filename: string; size: string; created: string; job?: string }>).map(file => ({
         id: file.filename,
         filename: file.filename,
         size: file.size,
@@ -30,7 +46,8 @@ const FileManager: React.FC = () => {
         job: jobLabels[file.job || ''] || 'Unknown',
       }));
       setFiles(mappedFiles);
-      if (mappedFiles.length === 0) {
+      setTotal(data.total);
+      if (data.total === 0 && !term) {
         setStatusMessage('No backup archives available yet.');
       } else {
         setStatusMessage('');
@@ -44,13 +61,23 @@ const FileManager: React.FC = () => {
   };
 
   useEffect(() => {
-    loadFiles();
-  }, []);
+    const timer = setTimeout(loadFiles, searchTerm ? 300 : 0);
+    return () => clearTimeout(timer);
+  }, [page, sort, order, searchTerm]);
 
-  const filteredFiles = files.filter(file => 
-      file.filename.toLowerCase().includes(searchTerm.toLowerCase()) ||
-      file.job.toLowerCase().includes(searchTerm.toLowerCase())
-  );
+  const pageCount = Math.max(1, Math.ceil(total / PAGE_SIZE));
+
+  const toggleSort = (key: SortKey) => {
+    if (sort === key) {
+      setOrder(order === 'asc' ? 'desc' : 'asc');
+    } else {
+      setSort(key);
+      setOrder(key === 'created' || key === 'size' ? 'desc' : 'asc');
+    }
+    setPage(1);
+  };
+
+  const sortMarker = (key: SortKey) => (sort === key ? (order === 'asc' ? ' ▲' : ' ▼') : '');
 
   const handleDelete = async (fileId: string) => {
     setStatusMessage(`Deleting ${fileId}...`);
@@ -60,6 +87,7 @@ const FileManager: React.FC = () => {
         throw new Error('Delete failed');
       }
       setFiles(prev => prev.filter(file => file.id !== fileId));
+      setTotal(prev => Math.max(0, prev - 1));
       setStatusMessage(`Deleted ${fileId}.`);
     } catch (error) {
       console.error('Failed to delete archive:', error);
@@ -81,12 +109,13 @@ const FileManager: React.FC = () => {
         body: JSON.stringify({ filename: file.filename }),
       });
       if (!response.ok) {
-        throw new Error('Restore failed');
+        throw new Error(await response.text() || 'Restore failed');
       }
-      setStatusMessage(`Restore queued for ${file.filename}.`);
+      const { id } = await response.json();
+      setStatusMessage(`Restore #${id} started for ${file.filename}; progress is shown in the logs.`);
     } catch (error) {
       console.error('Failed to request restore:', error);
-      setStatusMessage(`Failed to request restore for ${file.filename}.`);
+      setStatusMessage(`Failed to request restore for ${file.filename}: ${(error as Error).message}`);
     }
   };
 
@@ -99,7 +128,10 @@ const FileManager: React.FC = () => {
                 type="text"
                 placeholder="Search archives..."
                 value={searchTerm}
-                onChange={(e) => setSearchTerm(e.target.value)}
+                onChange={(e) => {
+                  setSearchTerm(e.target.value);
+                  setPage(1);
+                }}
                 className="w-full bg-gray-950/50 border border-green-700 text-green-400 focus:border-green-400 focus:outline-none p-2"
             />
         </div>
@@ -120,15 +152,15 @@ const FileManager: React.FC = () => {
             <table className="w-full text-sm text-left text-gray-400">
                 <thead className="text-xs text-gray-300 uppercase bg-gray-900/50">
                     <tr>
-                        <th scope="col" className="px-6 py-3">Filename</th>
-                        <th scope="col" className="px-6 py-3">Size</th>
-                        <th scope="col" className="px-6 py-3">Created Date</th>
-                        <th scope="col" className="px-6 py-3">Source Job</th>
+                        <th scope="col" className="px-6 py-3 cursor-pointer" onClick={() => toggleSort('filename')}>Filename{sortMarker('filename')}</th>
+                        <th scope="col" className="px-6 py-3 cursor-pointer" onClick={() => toggleSort('size')}>Size{sortMarker('size')}</th>
+                        <th scope="col" className="px-6 py-3 cursor-pointer" onClick={() => toggleSort('created')}>Created Date{sortMarker('created')}</th>
+                        <th scope="col" className="px-6 py-3 cursor-pointer" onClick={() => toggleSort('job')}>Source Job{sortMarker('job')}</th>
                         <th scope="col" className="px-6 py-3 text-right">Actions</th>
                     </tr>
                 </thead>
                 <tbody>
-                    {filteredFiles.map(file => (
+                    {files.map(file => (
                         <tr key={file.id} className="border-b border-green-500/10 hover:bg-gray-800/50">
                             <td className="px-6 py-4 font-medium text-white">{file.filename}</td>
                             <td className="px-6 py-4">{file.size}</td>
@@ -156,7 +188,7 @@ const FileManager: React.FC = () => {
                             </td>
                         </tr>
                     ))}
-                     {!isLoading && filteredFiles.length === 0 && (
+                     {!isLoading && files.length === 0 && (
                         <tr>
                             <td colSpan={5} className="text-center py-8">No files found matching your search.</td>
                         </tr>
@@ -169,6 +201,26 @@ const FileManager: React.FC = () => {
                 </tbody>
             </table>
         </div>
+        <div className="flex items-center justify-between px-6 py-3 text-xs text-gray-400 border-t border-green-500/10">
+          <span>{total} archive{total === 1 ? '' : 's'}</span>
+          <div className="flex items-center gap-3">
+            <button
+              onClick={() => setPage(page - 1)}
+              disabled={page <= 1}
+              className="border border-green-500 text-green-300 px-3 py-1 hover:bg-green-700/40 disabled:opacity-50 disabled:cursor-not-allowed"
+            >
+              Prev
+            </button>
+            <span>Page {page} of {pageCount}</span>
+            <button
+              onClick={() => setPage(page + 1)}
+              disabled={page >= pageCount}
+              className="border border-green-500 text-green-300 px-3 py-1 hover:bg-green-700/40 disabled:opacity-50 disabled:cursor-not-allowed"
+            >
+              Next
+            </button>
+          </div>
+        </div>
       </div>
     </div>
   );
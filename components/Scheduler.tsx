@@ -26,6 +26,7 @@ const Scheduler: React.FC = () => {
   const [formJobType, setFormJobType] = useState<Schedule['jobType']>('sftp');
   const [formTime, setFormTime] = useState('02:00');
   const [formDays, setFormDays] = useState<string[]>(['mon', 'tue', 'wed', 'thu', 'fri']);
+  const [formJitter, setFormJitter] = useState(0);
 
   const timeParts = useMemo(() => {
     const [hour, minute] = formTime.split(':').map(Number);
@@ -40,13 +41,14 @@ const Scheduler: React.FC = () => {
         throw new Error('Failed to load schedules');
       }
       const data = await response.json();
-      const mapped = (data as Array<{ id: number; job_type: Schedule['jobType']; hour: number; minute: number; days: string[]; next_run: string }>).map(
+      const mapped = (data as Array<{ id: number; job_type: Schedule['jobType']; hour: number; minute: number; days: string[]; jitter: number; next_run: string }>).map(
         schedule => ({
           id: schedule.id,
           jobType: schedule.job_type,
           hour: schedule.hour,
           minute: schedule.minute,
           days: schedule.days,
+          jitter: schedule.jitter,
           nextRun: schedule.next_run,
         })
       );
@@ -68,6 +70,7 @@ const Scheduler: React.FC = () => {
     setFormJobType('sftp');
     setFormTime('02:00');
     setFormDays(['mon', 'tue', 'wed', 'thu', 'fri']);
+    setFormJitter(0);
   };
 
   const openNewSchedule = () => {
@@ -83,6 +86,7 @@ const Scheduler: React.FC = () => {
     const minute = String(schedule.minute).padStart(2, '0');
     setFormTime(`${hour}:${minute}`);
     setFormDays(schedule.days);
+    setFormJitter(Math.round(schedule.jitter / 60));
     setIsModalOpen(true);
   };
 
@@ -93,6 +97,7 @@ const Scheduler: React.FC = () => {
         hour: timeParts.hour,
         minute: timeParts.minute,
         days: formDays,
+        jitter: formJitter * 60,
       };
       if (editingSchedule) {
         const response = await fetch(`/api/schedules/${editingSchedule.id}`, {
@@ -233,6 +238,17 @@ const Scheduler: React.FC = () => {
                   className="w-full bg-black/50 border border-green-700 text-green-400 focus:border-green-400 focus:outline-none p-2"
                 />
               </div>
+              <div className="space-y-2">
+                <label className="text-sm text-gray-400">Random Delay (minutes, max 60)</label>
+                <input
+                  type="number"
+                  min={0}
+                  max={60}
+                  value={formJitter}
+                  onChange={e => setFormJitter(Math.min(60, Math.max(0, Number(e.target.value) || 0)))}
+                  className="w-full bg-black/50 border border-green-700 text-green-400 focus:border-green-400 focus:outline-none p-2"
+                />
+              </div>
               <div className="space-y-2">
                 <label className="text-sm text-gray-400">Days of the Week</label>
                 <div className="grid grid-cols-4 gap-2">
@@ -56,7 +56,7 @@ const Settings: React.FC<SettingsProps> = ({ onLogoChange, username }) => {
   const [isEditingCpanel, setIsEditingCpanel] = useState(false);
 
   const [sftpSettings, setSftpSettings] = useState({ host: '', port: 22, user: '', password: '', remote_path: '.' });
-  const [smtpSettings, setSmtpSettings] = useState({ host: '', port: 587, user: '', pass: '', from: '', to: '' });
+  const [smtpSettings, setSmtpSettings] = useState({ host: '', port: 587, user: '', pass: '', from: '', to: '', digest: 0 });
   const [sshSettings, setSshSettings] = useState({ host: '', port: 22, user: '', password: '', key: '', remote_path: '.' });
   const [cpanelSettings, setCpanelSettings] = useState({ host: '', port: 2083, user: '', token: '', password: '' });
 
@@ -94,6 +94,7 @@ const Settings: React.FC<SettingsProps> = ({ onLogoChange, username }) => {
           pass: data.password || '',
           from: data.from_addr || '',
           to: data.to_addr || '',
+          digest: data.digest_minutes || 0,
         });
       }
       if (sshRes.ok) {
@@ -158,6 +159,7 @@ const Settings: React.FC<SettingsProps> = ({ onLogoChange, username }) => {
           password: smtpSettings.pass,
           from_addr: smtpSettings.from,
           to_addr: smtpSettings.to,
+          digest_minutes: smtpSettings.digest,
         }),
       });
       if (!response.ok) {
@@ -356,6 +358,10 @@ const Settings: React.FC<SettingsProps> = ({ onLogoChange, username }) => {
                 <label className="text-sm text-gray-400">To Email</label>
                 <input type="email" value={smtpSettings.to} onChange={e => setSmtpSettings({ ...smtpSettings, to: e.target.value })} className="w-full bg-black/50 border border-green-700 text-green-400 focus:border-green-400 focus:outline-none p-2" />
               </div>
+              <div className="space-y-2">
+                <label className="text-sm text-gray-400">Digest Window (minutes, 0 = send each)</label>
+                <input type="number" min={0} value={smtpSettings.digest} onChange={e => setSmtpSettings({ ...smtpSettings, digest: Math.max(0, parseInt(e.target.value) || 0) })} className="w-full bg-black/50 border border-green-700 text-green-400 focus:border-green-400 focus:outline-none p-2" />
+              </div>
             </>
           ) : (
             <>
@@ -365,6 +371,7 @@ const Settings: React.FC<SettingsProps> = ({ onLogoChange, username }) => {
               <DisplayField label="Password" value={smtpSettings.pass ? '************' : ''} />
               <DisplayField label="From Email" value={smtpSettings.from} />
               <DisplayField label="To Email" value={smtpSettings.to} />
+              <DisplayField label="Digest" value={smtpSettings.digest ? `Every ${smtpSettings.digest} min` : 'Off'} />
             </>
           )}
         </div>
@@ -32,6 +32,7 @@ export interface Schedule {
   hour: number;
   minute: number;
   days: string[];
+  jitter: number;
   nextRun: string;
 }
 
@@ -42,6 +43,16 @@ export interface CpuData {
 
 export type DownloadMethodId = 'sftp' | 'ssh' | 'cpanel';
 
+export interface TransferProgress {
+  files_done: number;
+  files_total: number | null;
+  bytes_done: number;
+  bytes_total: number | null;
+  rate: number;
+  percent: number | null;
+  eta: number | null;
+}
+
 export interface DownloadMethod {
   id: DownloadMethodId;
   label: string;
@@ -49,4 +60,6 @@ export interface DownloadMethod {
   isRunning: boolean;
   progress: number;
   lastResult: string;
+  transfer?: TransferProgress | null;
+  queued?: boolean;
 }